@@ -1,15 +1,12 @@
 import os
-from flask import Flask, request, abort
+import atexit
+from flask import Flask, Response, request, abort
 from dotenv import load_dotenv
 
-from linebot.v3 import WebhookHandler
-from linebot.v3.messaging import (
-    Configuration,
-    ApiClient,
-    MessagingApi,
-    ReplyMessageRequest,
-    TextMessage
-)
+# 載入環境變數（需在匯入讀取設定的模組之前）
+load_dotenv()
+
+from linebot.v3.messaging import ApiException
 from linebot.v3.webhooks import (
     MessageEvent,
     TextMessageContent
@@ -17,10 +14,21 @@ from linebot.v3.webhooks import (
 from linebot.v3.exceptions import InvalidSignatureError
 
 import database as db
-from handlers import process_command
-
-# 載入環境變數
-load_dotenv()
+import line_client
+import metrics
+import reply_deadline
+from webhook_worker import (
+    QueuedWebhookHandler,
+    WEBHOOK_ASYNC,
+    WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_SHUTDOWN_TIMEOUT,
+    WEBHOOK_EVENT_CONCURRENCY
+)
+from handlers import process_command, router
+from webhook_capture import create_capture
+from profile_cache import profile_cache
+from presence import presence_buffer, presence_debouncer
 
 app = Flask(__name__)
 
@@ -31,8 +39,68 @@ channel_access_token = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN')
 if not channel_secret or not channel_access_token:
     raise ValueError("請設定 LINE_CHANNEL_SECRET 和 LINE_CHANNEL_ACCESS_TOKEN 環境變數")
 
-configuration = Configuration(access_token=channel_access_token)
-handler = WebhookHandler(channel_secret)
+handler = QueuedWebhookHandler(
+    channel_secret,
+    workers=WEBHOOK_WORKERS,
+    queue_size=WEBHOOK_QUEUE_SIZE,
+    event_concurrency=WEBHOOK_EVENT_CONCURRENCY
+)
+
+# 設定 WEBHOOK_CAPTURE_FILE 時錄製收到的 webhook（供重播測試）
+webhook_capture = create_capture(channel_secret)
+
+UNKNOWN_DISPLAY_NAME = "未知使用者"
+
+# 設定後 /metrics 需帶 Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# 熱路徑上使用的監控指標子項目（預先建立）
+_WEBHOOK_METRICS = (metrics.WEBHOOK_SECONDS.labels(), None, metrics.WEBHOOK_INFLIGHT.labels())
+_WEBHOOK_INVALID_SIGNATURE = metrics.WEBHOOK_ERRORS.labels('invalid_signature')
+_WEBHOOK_FAILED = metrics.WEBHOOK_ERRORS.labels('error')
+_EVENT_SECONDS = {
+    'command': metrics.EVENT_SECONDS.labels('command'),
+    'chat': metrics.EVENT_SECONDS.labels('chat'),
+}
+_EVENT_ERRORS = metrics.EVENT_ERRORS.labels()
+_LINE_API_METRICS = {
+    endpoint: (
+        metrics.LINE_API_SECONDS.labels(endpoint),
+        metrics.LINE_API_ERRORS.labels(endpoint),
+        metrics.LINE_API_INFLIGHT.labels(endpoint)
+    )
+    for endpoint in ('profile', 'reply', 'push')
+}
+
+# 既有的統計資料，輸出 /metrics 時才讀取
+metrics.CallbackMetric(
+    'linebot_webhook_queue_depth', 'Webhook 佇列中等待處理的批次數', 'gauge',
+    lambda: handler.stats()['depth']
+)
+metrics.CallbackMetric(
+    'linebot_webhook_queue_busy_workers', '正在處理事件的背景執行緒數', 'gauge',
+    lambda: handler.stats()['busy']
+)
+metrics.CallbackMetric(
+    'linebot_webhook_queue_events_total',
+    'Webhook 事件數（enqueued 放入佇列、inline 佇列已滿改為同步處理、processed 處理完成、failed 處理失敗）', 'counter',
+    lambda: {
+        (state,): handler.stats()[key]
+        for state, key in (('enqueued', 'enqueued'), ('inline', 'inline_events'),
+                           ('processed', 'processed'), ('failed', 'failed'))
+    },
+    ['state']
+)
+metrics.CallbackMetric(
+    'linebot_webhook_queue_batches_total',
+    'Webhook 批次數，每個請求一批（enqueued 放入佇列、inline 佇列已滿改為同步處理、processed 處理完成）', 'counter',
+    lambda: {
+        (state,): handler.stats()[key]
+        for state, key in (('enqueued', 'enqueued_batches'), ('inline', 'inline'),
+                           ('processed', 'processed_batches'))
+    },
+    ['state']
+)
 
 
 @app.route('/health', methods=['GET'])
@@ -41,77 +109,269 @@ def health_check():
     return 'OK', 200
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus 監控指標（合併所有 worker）"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        abort(401)
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route('/callback', methods=['POST'])
 def callback():
     """LINE Webhook 回調端點"""
     signature = request.headers.get('X-Line-Signature', '')
     body = request.get_data(as_text=True)
 
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
-        abort(400)
+    with metrics.timer(*_WEBHOOK_METRICS):
+        if webhook_capture is not None and handler.parser.signature_validator.validate(body, signature):
+            webhook_capture.record(body)
+
+        try:
+            if WEBHOOK_ASYNC:
+                # 只驗證簽章並放入佇列，由背景執行緒處理，立即回應 LINE
+                handler.enqueue(body, signature)
+            else:
+                handler.handle(body, signature)
+        except InvalidSignatureError:
+            _WEBHOOK_INVALID_SIGNATURE.inc()
+            abort(400)
+        except Exception:
+            _WEBHOOK_FAILED.inc()
+            raise
 
     return 'OK'
 
 
+@handler.before_batch
+def prepare_batch(events):
+    """
+    同一個 webhook 有多則需要記錄用戶的文字訊息時（指令，或到了寫入間隔的聊天訊息），
+    先並行取得顯示名稱，再以單一語句寫入所有用戶的活動紀錄（取代每則訊息各自寫入）
+    回傳: {id(event): 顯示名稱（不需記錄的聊天訊息為 None）}；
+    需要記錄的訊息少於兩則時回傳 None，照一般流程處理
+    """
+    texts = [
+        event for event in events
+        if isinstance(event, MessageEvent)
+        and isinstance(event.message, TextMessageContent)
+        and event.source.user_id
+    ]
+    commands = {id(event): router.match(event.message.text) for event in texts}
+    candidates = [
+        event for event in texts
+        if commands[id(event)] is not None or presence_debouncer.is_due(event.source.user_id)
+    ]
+    if len(candidates) < 2:
+        return None
+
+    # 聊天訊息在此登記寫入間隔，同一用戶只會選到第一則
+    selected = []
+    claimed = []
+    for event in candidates:
+        if commands[id(event)] is None:
+            if not presence_debouncer.claim(event.source.user_id):
+                continue
+            claimed.append(event.source.user_id)
+        selected.append(event)
+
+    # 同一用戶在同一來源只取一次名稱；其中有需要最新名稱的指令時強制重新取得
+    lookups = {}
+    for event in selected:
+        command = commands[id(event)]
+        key = profile_cache.make_key(event.source, event.source.user_id)
+        force = command is not None and command.needs_display_name
+        if key in lookups:
+            force = force or lookups[key][2]
+        lookups[key] = (event.source.user_id, event.source, force)
+
+    keys = list(lookups)
+    names = dict(zip(keys, handler.map_concurrent(
+        lambda key: get_user_display_name(*lookups[key]), keys
+    )))
+
+    prepared = dict.fromkeys(map(id, texts))
+    entries = []
+    for event in selected:
+        name = names[profile_cache.make_key(event.source, event.source.user_id)]
+        prepared[id(event)] = name
+        if (commands[id(event)] is None and presence_buffer.enabled
+                and presence_buffer.add(event.source.user_id, name)):
+            # 聊天訊息交給寫回緩衝，與其他請求的紀錄一起寫入
+            continue
+        entries.append((event.source.user_id, name, None))
+
+    if not entries:
+        return prepared
+
+    try:
+        db.record_presence_batch(entries)
+    except Exception as e:
+        print(f"同步/記錄用戶失敗: {e}")
+        for user_id in claimed:
+            presence_debouncer.release(user_id)
+    else:
+        presence_buffer.mark_written(entries)
+        for user_id, _, _ in entries:
+            presence_debouncer.touch(user_id)
+    return prepared
+
+
 @handler.add(MessageEvent, message=TextMessageContent)
 def handle_message(event: MessageEvent):
     """處理文字訊息"""
     text = event.message.text
+
+    # 不做任何 I/O 先判斷是否為指令
+    command = router.match(text)
+
+    if command is None:
+        with metrics.timer(_EVENT_SECONDS['chat'], _EVENT_ERRORS):
+            _handle_chat(event)
+        return
+
+    with metrics.timer(_EVENT_SECONDS['command'], _EVENT_ERRORS):
+        _handle_command(event, text, command)
+
+
+def _handle_chat(event: MessageEvent):
+    """
+    一般聊天訊息：每位用戶每 PRESENCE_DEBOUNCE_SECONDS 秒最多記錄一次，
+    其餘訊息不呼叫 LINE API 也不查詢資料庫
+    """
+    prepared = handler.current_batch()
+    if prepared is not None and id(event) in prepared:
+        # 已由 prepare_batch 一併處理
+        return
+
     user_id = event.source.user_id
+    if not user_id or not presence_debouncer.claim(user_id):
+        return
 
-    # 取得使用者顯示名稱
+    # 名稱優先使用快取，快取沒有時才呼叫 LINE API
     display_name = get_user_display_name(user_id, event.source)
+    if presence_buffer.enabled and presence_buffer.add(user_id, display_name):
+        return
+    # 未啟用緩衝，或第一次出現／名稱變更的用戶：立即寫入
+    if not _record_presence(user_id, display_name):
+        presence_debouncer.release(user_id)
 
-    # 自動同步 LINE 顯示名稱（如果用戶已登記且名稱有變更）
-    # 並記錄用戶資訊（供代登記使用）
-    try:
-        db.sync_display_name(user_id, display_name)
-        db.record_pending_user(user_id, display_name)
-    except Exception as e:
-        print(f"同步/記錄用戶失敗: {e}")
+
+def _handle_command(event: MessageEvent, text: str, command):
+    """取得顯示名稱、記錄用戶後執行指令並回覆"""
+    user_id = event.source.user_id
+
+    prepared = handler.current_batch()
+    if prepared is not None and id(event) in prepared:
+        # 多則訊息的批次已取得名稱並寫入活動紀錄（prepare_batch）
+        display_name = prepared[id(event)]
+    else:
+        # 取得使用者顯示名稱（會寫入名稱的指令強制重新取得，其餘使用快取）
+        display_name = get_user_display_name(
+            user_id,
+            event.source,
+            force_refresh=command.needs_display_name
+        )
+        if _record_presence(user_id, display_name):
+            presence_debouncer.touch(user_id)
 
     # 處理指令
     reply_message = process_command(user_id, display_name, text)
 
     if reply_message:
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[reply_message]
+        # 指令可能回傳多則訊息（例如分段的名冊）
+        messages = reply_message if isinstance(reply_message, list) else [reply_message]
+        send_reply(event, messages)
+
+
+def send_reply(event: MessageEvent, messages: list):
+    """
+    以 reply token 回覆；token 已接近期限或已失效時，改用 push 送到事件來源
+    訊息直接以 JSON 結構送出（line_client.reply_call），不經過 ReplyMessageRequest 模型
+    """
+    api_client = line_client.get_messaging_api().api_client
+
+    reason = reply_deadline.check_budget(event)
+    if reason is None:
+        try:
+            with metrics.timer(*_LINE_API_METRICS['reply']):
+                api_client.call_api(
+                    **line_client.reply_call(event.reply_token, messages),
+                    _request_timeout=line_client.REQUEST_TIMEOUT
                 )
-            )
+            return
+        except ApiException as e:
+            if not reply_deadline.is_invalid_reply_token(e):
+                raise
+            reason = 'invalid_token'
+
+    push_request = reply_deadline.push_request(event, messages, reason)
+    if push_request is not None:
+        with metrics.timer(*_LINE_API_METRICS['push']):
+            api_client.call_api(**push_request, _request_timeout=line_client.REQUEST_TIMEOUT)
+
+
+def _record_presence(user_id: str, display_name: str) -> bool:
+    """
+    自動同步 LINE 顯示名稱（如果用戶已登記且名稱有變更）
+    並記錄用戶資訊（供代登記使用），單一語句完成
+    回傳: 是否寫入成功
+    """
+    try:
+        db.record_presence(user_id, display_name)
+        presence_buffer.mark_written([(user_id, display_name)])
+        return True
+    except Exception as e:
+        print(f"同步/記錄用戶失敗: {e}")
+        return False
+
+
+def get_user_display_name(user_id: str, source, force_refresh: bool = False) -> str:
+    """取得使用者的顯示名稱（優先使用快取）"""
+    key = profile_cache.make_key(source, user_id)
 
+    if force_refresh:
+        profile_cache.note_refresh()
+    else:
+        found, display_name = profile_cache.get(key)
+        if found:
+            return display_name if display_name is not None else UNKNOWN_DISPLAY_NAME
 
-def get_user_display_name(user_id: str, source) -> str:
-    """取得使用者的顯示名稱"""
     try:
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
+        line_bot_api = line_client.get_messaging_api()
 
-            # 根據來源類型取得 profile
-            source_type = source.type
+        # 根據來源類型取得 profile
+        source_type = source.type
 
+        with metrics.timer(*_LINE_API_METRICS['profile']):
             if source_type == 'group':
                 profile = line_bot_api.get_group_member_profile(
                     group_id=source.group_id,
-                    user_id=user_id
+                    user_id=user_id,
+                    _request_timeout=line_client.REQUEST_TIMEOUT
                 )
             elif source_type == 'room':
                 profile = line_bot_api.get_room_member_profile(
                     room_id=source.room_id,
-                    user_id=user_id
+                    user_id=user_id,
+                    _request_timeout=line_client.REQUEST_TIMEOUT
                 )
             else:
-                profile = line_bot_api.get_profile(user_id=user_id)
+                profile = line_bot_api.get_profile(
+                    user_id=user_id,
+                    _request_timeout=line_client.REQUEST_TIMEOUT
+                )
 
-            return profile.display_name
+        profile_cache.put(key, profile.display_name)
+        return profile.display_name
     except Exception as e:
         print(f"無法取得使用者名稱: {e}")
-        return "未知使用者"
+        # 強制更新失敗時，沿用仍有效的快取名稱
+        cached_name = profile_cache.peek(key)
+        if cached_name is not None:
+            return cached_name
+        profile_cache.put_negative(key)
+        return UNKNOWN_DISPLAY_NAME
 
 
 # 初始化資料庫
@@ -119,12 +379,24 @@ def init_app():
     """應用程式初始化"""
     try:
         db.init_db()
+        metrics.REGISTRY.start()
+        atexit.register(shutdown)
         print("應用程式初始化完成")
     except Exception as e:
         print(f"資料庫初始化失敗: {e}")
         raise
 
 
+def shutdown():
+    """worker 結束時處理完佇列中的事件並釋放資源"""
+    handler.stop(timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+    presence_buffer.stop()
+    line_client.close_client()
+    db.close_member_caches()
+    db.close_pool()
+    metrics.REGISTRY.flush()
+
+
 # 啟動時初始化
 init_app()
 
@@ -0,0 +1,409 @@
+"""
+asyncio 版的 LINE Bot 服務（aiohttp）
+指令處理與 app.py 相同（handlers.process_command），差別在於等待 I/O 的部分：
+- LINE API 使用 AsyncMessagingApi（aiohttp 連線池），用戶活動紀錄使用 asyncpg 連線池
+- 一個行程可以同時進行大量 profile / reply 呼叫與查詢，不受執行緒數限制
+- 指令本身仍是同步程式（psycopg2），在執行緒池中執行（ASYNC_COMMAND_THREADS）
+
+啟動方式：
+    gunicorn async_app:create_app --worker-class aiohttp.GunicornWebWorker --bind 0.0.0.0:$PORT
+    python async_app.py
+"""
+
+import asyncio
+import copy
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+
+# 載入環境變數（需在匯入讀取設定的模組之前）
+load_dotenv()
+
+from linebot.v3 import WebhookParser
+from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.messaging import (
+    ApiException,
+    AsyncApiClient,
+    AsyncMessagingApi
+)
+from linebot.v3.webhooks import (
+    MessageEvent,
+    TextMessageContent
+)
+
+import async_db
+import database as db
+import line_client
+import metrics
+import reply_deadline
+from handlers import process_command, router
+from presence import presence_buffer, presence_debouncer
+from profile_cache import profile_cache
+from webhook_capture import create_capture
+from webhook_worker import WEBHOOK_ASYNC, WEBHOOK_SHUTDOWN_TIMEOUT, partition_key
+
+# 執行同步指令的執行緒數（預設與 psycopg2 連線池大小相同）
+ASYNC_COMMAND_THREADS = int(os.environ.get('ASYNC_COMMAND_THREADS', db.DB_POOL_MAX_SIZE))
+# 同時連到 LINE API 的連線數上限
+ASYNC_LINE_POOL_SIZE = int(os.environ.get('ASYNC_LINE_POOL_SIZE', 100))
+
+channel_secret = os.environ.get('LINE_CHANNEL_SECRET')
+channel_access_token = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN')
+
+if not channel_secret or not channel_access_token:
+    raise ValueError("請設定 LINE_CHANNEL_SECRET 和 LINE_CHANNEL_ACCESS_TOKEN 環境變數")
+
+parser = WebhookParser(channel_secret)
+
+# 設定 WEBHOOK_CAPTURE_FILE 時錄製收到的 webhook（供重播測試）
+webhook_capture = create_capture(channel_secret)
+
+UNKNOWN_DISPLAY_NAME = "未知使用者"
+
+# 設定後 /metrics 需帶 Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# aiohttp 的逾時設定（與同步版相同的連線逾時、讀取逾時）
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(
+    sock_connect=line_client.LINE_CONNECT_TIMEOUT,
+    sock_read=line_client.LINE_READ_TIMEOUT
+)
+
+_WEBHOOK_METRICS = (metrics.WEBHOOK_SECONDS.labels(), None, metrics.WEBHOOK_INFLIGHT.labels())
+_WEBHOOK_INVALID_SIGNATURE = metrics.WEBHOOK_ERRORS.labels('invalid_signature')
+_WEBHOOK_FAILED = metrics.WEBHOOK_ERRORS.labels('error')
+_EVENT_SECONDS = {
+    'command': metrics.EVENT_SECONDS.labels('command'),
+    'chat': metrics.EVENT_SECONDS.labels('chat'),
+}
+_EVENT_ERRORS = metrics.EVENT_ERRORS.labels()
+_LINE_API_METRICS = {
+    endpoint: (
+        metrics.LINE_API_SECONDS.labels(endpoint),
+        metrics.LINE_API_ERRORS.labels(endpoint),
+        metrics.LINE_API_INFLIGHT.labels(endpoint)
+    )
+    for endpoint in ('profile', 'reply', 'push')
+}
+
+# 以下於 on_startup 建立（每個 worker 各自一份）
+_line_client = None
+_line_api = None
+_command_executor = None
+_presence_wake = None
+_presence_task = None
+_presence_stopping = False
+_background_tasks = set()
+
+
+async def health_check(request):
+    """健康檢查端點"""
+    return web.Response(text='OK')
+
+
+async def metrics_endpoint(request):
+    """Prometheus 監控指標（合併所有 worker）"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        raise web.HTTPUnauthorized()
+    return web.Response(body=metrics.REGISTRY.render().encode('utf-8'),
+                        headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+async def callback(request):
+    """LINE Webhook 回調端點"""
+    signature = request.headers.get('X-Line-Signature', '')
+    body = await request.text()
+
+    with metrics.timer(*_WEBHOOK_METRICS):
+        if webhook_capture is not None and parser.signature_validator.validate(body, signature):
+            webhook_capture.record(body)
+
+        try:
+            events = parser.parse(body, signature)
+        except InvalidSignatureError:
+            _WEBHOOK_INVALID_SIGNATURE.inc()
+            raise web.HTTPBadRequest()
+
+        if WEBHOOK_ASYNC:
+            # 立即回應 LINE，事件在背景處理
+            task = asyncio.create_task(_handle_events_logged(events))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+        else:
+            try:
+                await handle_events(events)
+            except Exception:
+                _WEBHOOK_FAILED.inc()
+                raise
+
+    return web.Response(text='OK')
+
+
+async def handle_events(events):
+    """
+    處理一批事件：依來源分組，同一用戶的事件依序處理，不同用戶並行
+    任一事件失敗時在全部處理完後拋出第一個錯誤
+    """
+    groups = {}
+    for event in events:
+        groups.setdefault(partition_key(event), []).append(event)
+
+    results = await asyncio.gather(*(_handle_partition(group) for group in groups.values()))
+    errors = [error for group_errors in results for error in group_errors]
+    if errors:
+        raise errors[0]
+
+
+async def _handle_events_logged(events):
+    try:
+        await handle_events(events)
+    except Exception as e:
+        print(f"處理 Webhook 事件失敗: {e}")
+
+
+async def _handle_partition(events) -> list:
+    errors = []
+    for event in events:
+        try:
+            await handle_event(event)
+        except Exception as e:
+            print(f"處理 Webhook 事件失敗: {e}")
+            errors.append(e)
+    return errors
+
+
+async def handle_event(event):
+    """分派單一事件（目前只處理文字訊息）"""
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent):
+        await handle_message(event)
+
+
+async def handle_message(event: MessageEvent):
+    """處理文字訊息"""
+    text = event.message.text
+
+    # 不做任何 I/O 先判斷是否為指令
+    command = router.match(text)
+
+    if command is None:
+        with metrics.timer(_EVENT_SECONDS['chat'], _EVENT_ERRORS):
+            await _handle_chat(event)
+        return
+
+    with metrics.timer(_EVENT_SECONDS['command'], _EVENT_ERRORS):
+        await _handle_command(event, text, command)
+
+
+async def _handle_chat(event: MessageEvent):
+    """一般聊天訊息：規則同 app._handle_chat（節流後交給寫回緩衝）"""
+    user_id = event.source.user_id
+    if not user_id or not presence_debouncer.claim(user_id):
+        return
+
+    display_name = await get_user_display_name(user_id, event.source)
+    if presence_buffer.enabled and presence_buffer.add(user_id, display_name):
+        if presence_buffer.full:
+            _presence_wake.set()
+        return
+    # 未啟用緩衝，或第一次出現／名稱變更的用戶：立即寫入
+    if not await _record_presence(user_id, display_name):
+        presence_debouncer.release(user_id)
+
+
+async def _handle_command(event: MessageEvent, text: str, command):
+    """取得顯示名稱、記錄用戶後，在執行緒池中執行指令並回覆"""
+    user_id = event.source.user_id
+
+    display_name = await get_user_display_name(
+        user_id,
+        event.source,
+        force_refresh=command.needs_display_name
+    )
+    if await _record_presence(user_id, display_name):
+        presence_debouncer.touch(user_id)
+
+    loop = asyncio.get_running_loop()
+    reply_message = await loop.run_in_executor(
+        _command_executor, process_command, user_id, display_name, text
+    )
+
+    if reply_message:
+        # 指令可能回傳多則訊息（例如分段的名冊）
+        messages = reply_message if isinstance(reply_message, list) else [reply_message]
+        await send_reply(event, messages)
+
+
+async def send_reply(event: MessageEvent, messages: list):
+    """以 reply token 回覆；token 已接近期限或已失效時改用 push（規則同 app.send_reply）"""
+    reason = reply_deadline.check_budget(event)
+    if reason is None:
+        try:
+            with metrics.timer(*_LINE_API_METRICS['reply']):
+                await _line_api.api_client.call_api(
+                    **line_client.reply_call(event.reply_token, messages),
+                    _request_timeout=REQUEST_TIMEOUT
+                )
+            return
+        except ApiException as e:
+            if not reply_deadline.is_invalid_reply_token(e):
+                raise
+            reason = 'invalid_token'
+
+    push_request = reply_deadline.push_request(event, messages, reason)
+    if push_request is not None:
+        with metrics.timer(*_LINE_API_METRICS['push']):
+            await _line_api.api_client.call_api(**push_request, _request_timeout=REQUEST_TIMEOUT)
+
+
+async def _record_presence(user_id: str, display_name: str) -> bool:
+    """同步顯示名稱並記錄用戶資訊；回傳是否寫入成功"""
+    try:
+        await async_db.record_presence(user_id, display_name)
+        presence_buffer.mark_written([(user_id, display_name)])
+        return True
+    except Exception as e:
+        print(f"同步/記錄用戶失敗: {e}")
+        return False
+
+
+async def get_user_display_name(user_id: str, source, force_refresh: bool = False) -> str:
+    """取得使用者的顯示名稱（優先使用快取，規則同 app.get_user_display_name）"""
+    key = profile_cache.make_key(source, user_id)
+
+    if force_refresh:
+        profile_cache.note_refresh()
+    else:
+        found, display_name = profile_cache.get(key)
+        if found:
+            return display_name if display_name is not None else UNKNOWN_DISPLAY_NAME
+
+    try:
+        source_type = source.type
+
+        with metrics.timer(*_LINE_API_METRICS['profile']):
+            if source_type == 'group':
+                profile = await _line_api.get_group_member_profile(
+                    group_id=source.group_id,
+                    user_id=user_id,
+                    _request_timeout=REQUEST_TIMEOUT
+                )
+            elif source_type == 'room':
+                profile = await _line_api.get_room_member_profile(
+                    room_id=source.room_id,
+                    user_id=user_id,
+                    _request_timeout=REQUEST_TIMEOUT
+                )
+            else:
+                profile = await _line_api.get_profile(
+                    user_id=user_id,
+                    _request_timeout=REQUEST_TIMEOUT
+                )
+
+        profile_cache.put(key, profile.display_name)
+        return profile.display_name
+    except Exception as e:
+        print(f"無法取得使用者名稱: {e}")
+        # 強制更新失敗時，沿用仍有效的快取名稱
+        cached_name = profile_cache.peek(key)
+        if cached_name is not None:
+            return cached_name
+        profile_cache.put_negative(key)
+        return UNKNOWN_DISPLAY_NAME
+
+
+async def _flush_presence_loop():
+    """定時（或緩衝已滿時）以 asyncpg 整批寫入活動紀錄"""
+    while not _presence_stopping:
+        try:
+            await asyncio.wait_for(_presence_wake.wait(), presence_buffer.interval)
+        except asyncio.TimeoutError:
+            pass
+        _presence_wake.clear()
+        await flush_presence()
+
+
+async def flush_presence():
+    """將緩衝中的活動紀錄整批寫入；失敗時放回緩衝下次重試"""
+    entries = presence_buffer.drain()
+    if not entries:
+        return
+    try:
+        await async_db.record_presence_batch(entries)
+    except Exception as e:
+        print(f"寫入活動紀錄失敗（{len(entries)} 筆，稍後重試）: {e}")
+        presence_buffer.restore(entries)
+        return
+    presence_buffer.record_flush(entries)
+
+
+async def on_startup(app):
+    """worker 啟動時建立連線池與背景工作"""
+    global _line_client, _line_api, _command_executor, _presence_wake, _presence_task
+    db.init_db()
+    await async_db.init_pool()
+
+    configuration = copy.deepcopy(line_client.configuration)
+    configuration.connection_pool_maxsize = ASYNC_LINE_POOL_SIZE
+    _line_client = AsyncApiClient(configuration)
+    _line_api = AsyncMessagingApi(_line_client)
+
+    _command_executor = ThreadPoolExecutor(
+        max_workers=ASYNC_COMMAND_THREADS,
+        thread_name_prefix='command'
+    )
+
+    # 活動紀錄緩衝改由事件迴圈寫入（asyncpg），不啟動緩衝自己的背景執行緒
+    presence_buffer.background = False
+    _presence_wake = asyncio.Event()
+    if presence_buffer.enabled:
+        _presence_task = asyncio.create_task(_flush_presence_loop())
+
+    metrics.REGISTRY.start()
+    print("應用程式初始化完成（asyncio）")
+
+
+async def on_shutdown(app):
+    """等待背景處理中的事件完成，並寫入剩餘的活動紀錄"""
+    global _presence_stopping
+    if _background_tasks:
+        _, pending = await asyncio.wait(set(_background_tasks), timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+        if pending:
+            print(f"仍有 {len(pending)} 批 Webhook 事件未處理完")
+    # 不取消寫入中的工作（取消會遺失已取出的資料），通知它結束後等待
+    _presence_stopping = True
+    if _presence_task is not None:
+        _presence_wake.set()
+        await _presence_task
+    await flush_presence()
+
+
+async def on_cleanup(app):
+    """釋放連線與執行緒"""
+    if _line_client is not None:
+        await _line_client.close()
+    if _command_executor is not None:
+        _command_executor.shutdown(wait=True)
+    await async_db.close_pool()
+    db.close_member_caches()
+    db.close_pool()
+    metrics.REGISTRY.flush()
+
+
+async def create_app() -> web.Application:
+    """建立 aiohttp 應用程式（gunicorn aiohttp.GunicornWebWorker 的進入點）"""
+    app = web.Application()
+    app.router.add_get('/health', health_check)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.router.add_post('/callback', callback)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 5000))
+    web.run_app(create_app(), host='0.0.0.0', port=port)
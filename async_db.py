@@ -0,0 +1,134 @@
+"""
+非同步資料庫模組（asyncpg）
+供 async_app 的熱路徑使用（記錄用戶出現）；指令處理仍透過 database.py，在執行緒池中執行
+查詢規則與 database.record_presence / record_presence_batch 相同
+"""
+
+import os
+
+import asyncpg
+
+import database as db
+import metrics
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+# asyncpg 連線池大小（每個 worker 各自一個連線池）
+ASYNC_DB_POOL_MIN_SIZE = int(os.environ.get('ASYNC_DB_POOL_MIN_SIZE', 1))
+ASYNC_DB_POOL_MAX_SIZE = int(os.environ.get('ASYNC_DB_POOL_MAX_SIZE', 20))
+ASYNC_DB_COMMAND_TIMEOUT = float(os.environ.get('ASYNC_DB_COMMAND_TIMEOUT', 10))
+
+_pool = None
+
+_DB_STATEMENTS = metrics.DB_STATEMENTS.labels()
+_db_call = metrics.instrument(metrics.DB_CALL_SECONDS, metrics.DB_CALL_ERRORS, metrics.DB_CALL_INFLIGHT)
+
+
+async def init_pool():
+    """建立連線池（在事件迴圈中呼叫）"""
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=ASYNC_DB_POOL_MIN_SIZE,
+            max_size=ASYNC_DB_POOL_MAX_SIZE,
+            command_timeout=ASYNC_DB_COMMAND_TIMEOUT
+        )
+    return _pool
+
+
+async def close_pool():
+    """關閉連線池"""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+@_db_call
+async def record_presence(line_user_id: str, line_display_name: str) -> dict:
+    """
+    記錄用戶出現（同 database.record_presence，單一語句、自動提交）
+    回傳: {'name_synced': bool, 'pending_written': bool}
+    """
+    _DB_STATEMENTS.inc()
+    row = await _pool.fetchrow('''
+        WITH synced AS (
+            UPDATE members
+            SET line_display_name = $2, updated_at = NOW()
+            WHERE line_user_id = $1
+              AND line_display_name IS DISTINCT FROM $2
+            RETURNING 1
+        ), pending AS (
+            INSERT INTO pending_users (line_user_id, line_display_name, last_seen)
+            VALUES ($1, $2, NOW())
+            ON CONFLICT (line_user_id)
+            DO UPDATE SET line_display_name = EXCLUDED.line_display_name,
+                          last_seen = EXCLUDED.last_seen
+            WHERE pending_users.line_display_name IS DISTINCT FROM EXCLUDED.line_display_name
+               OR pending_users.last_seen < NOW() - make_interval(secs => $3)
+            RETURNING 1
+        )
+        SELECT EXISTS (SELECT 1 FROM synced) AS name_synced,
+               EXISTS (SELECT 1 FROM pending) AS pending_written
+    ''', line_user_id, line_display_name, float(db.PRESENCE_FRESH_SECONDS))
+
+    result = dict(row)
+    if result['name_synced']:
+        db.invalidate_member_caches()
+    return result
+
+
+@_db_call
+async def record_presence_batch(entries) -> dict:
+    """
+    一次記錄多位用戶出現（同 database.record_presence_batch，以陣列參數在單一語句完成）
+    entries: [(line_user_id, line_display_name, seen_at)]
+    回傳: {'names_synced': 更新名稱的成員數, 'pending_written': 改寫的 pending_users 筆數}
+    """
+    latest = {user_id: (user_id, name, seen_at) for user_id, name, seen_at in entries}
+    if not latest:
+        return {'names_synced': 0, 'pending_written': 0}
+    # 依 line_user_id 順序鎖定資料列（同 database.record_presence_batch，避免各 worker 之間死結）
+    user_ids, names, seen = zip(*sorted(latest.values()))
+
+    _DB_STATEMENTS.inc()
+    row = await _pool.fetchrow('''
+        WITH incoming AS (
+            SELECT line_user_id, line_display_name,
+                   COALESCE(to_timestamp(seen_at)::timestamp, NOW()::timestamp) AS last_seen
+            FROM unnest($1::text[], $2::text[], $3::float8[])
+                 AS t (line_user_id, line_display_name, seen_at)
+        ), locked AS (
+            SELECT m.line_user_id, i.line_display_name
+            FROM members m
+            JOIN incoming i ON i.line_user_id = m.line_user_id
+            WHERE m.line_display_name IS DISTINCT FROM i.line_display_name
+            ORDER BY m.line_user_id
+            FOR UPDATE OF m
+        ), synced AS (
+            UPDATE members m
+            SET line_display_name = l.line_display_name, updated_at = NOW()
+            FROM locked l
+            WHERE m.line_user_id = l.line_user_id
+              AND m.line_display_name IS DISTINCT FROM l.line_display_name
+            RETURNING 1
+        ), pending AS (
+            INSERT INTO pending_users (line_user_id, line_display_name, last_seen)
+            SELECT line_user_id, line_display_name, last_seen FROM incoming
+            ORDER BY line_user_id
+            ON CONFLICT (line_user_id)
+            DO UPDATE SET line_display_name = EXCLUDED.line_display_name,
+                          last_seen = GREATEST(pending_users.last_seen, EXCLUDED.last_seen)
+            WHERE pending_users.line_display_name IS DISTINCT FROM EXCLUDED.line_display_name
+               OR pending_users.last_seen < EXCLUDED.last_seen - make_interval(secs => $4)
+            RETURNING 1
+        )
+        SELECT (SELECT count(*) FROM synced) AS names_synced,
+               (SELECT count(*) FROM pending) AS pending_written
+    ''', list(user_ids), list(names), list(seen), float(db.PRESENCE_FRESH_SECONDS))
+
+    result = {key: int(value) for key, value in row.items()}
+    if result['names_synced']:
+        db.invalidate_member_caches()
+    return result
@@ -0,0 +1,50 @@
+"""
+比較同步版（app.py，gunicorn 執行緒 worker）與 asyncio 版（async_app.py，aiohttp worker）
+兩者使用相同的壓力測試設定、本地 PostgreSQL 與 LINE API 替身（見 loadtest.py）
+預設提高並行數與 LINE API 延遲，模擬大部分時間都在等待外部服務的情況
+
+用法：
+    python benchmarks/bench_async.py --database-url postgresql://localhost/linebot_test
+    python benchmarks/bench_async.py --database-url ... --concurrency 128 --profile-latency 0.1
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import loadtest
+
+COLUMNS = (
+    ('throughput', '吞吐量（事件/秒）'),
+    ('p50_ms', 'p50（ms）'),
+    ('p95_ms', 'p95（ms）'),
+    ('p99_ms', 'p99（ms）'),
+    ('db_round_trips_per_event', '資料庫往返/事件'),
+    ('errors', '失敗請求'),
+)
+
+
+def main():
+    parser = loadtest.build_parser()
+    parser.description = '同步版與 asyncio 版的壓力測試比較'
+    parser.set_defaults(events=3000, concurrency=64, workers=1, profile_latency=0.1, reply_latency=0.15)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('請以 --database-url 或 LOADTEST_DATABASE_URL 指定測試用資料庫')
+
+    results = {}
+    for server in ('sync', 'async'):
+        args.server = server
+        print(f"\n== {server} ==")
+        results[server] = loadtest.run(args)
+
+    print(f"\n{'':<18}{'sync':>12}{'async':>12}{'變化':>10}")
+    for key, label in COLUMNS:
+        old, new = results['sync'][key], results['async'][key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else '-'
+        print(f"{label:<18}{old:>12.2f}{new:>12.2f}{change:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+比較「每次呼叫建立 ApiClient」與「共用 line_client」的效能
+對本地 LINE API 替身發送 profile + reply 請求，統計耗時與開啟的 TCP 連線數
+
+用法：
+    python benchmarks/bench_line_client.py --calls 200 --threads 8
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_line_api import FakeLineApi, display_name_for
+
+
+def run(label: str, call, calls: int, threads: int, api: FakeLineApi):
+    api.reset_stats()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        names = list(pool.map(call, range(calls)))
+    elapsed = time.perf_counter() - start
+
+    assert all(name == display_name_for(f"U{i:032d}") for i, name in enumerate(names))
+    stats = api.stats()
+    print(f"{label:<12} {elapsed * 1000:8.1f} ms  "
+          f"{calls / elapsed:8.1f} 次/秒  TCP 連線 {stats['connections']:4d}  "
+          f"請求 {stats['requests']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LINE API 用戶端效能比較')
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0, help='替身回應延遲（秒）')
+    args = parser.parse_args()
+
+    api = FakeLineApi(profile_latency=args.latency, reply_latency=args.latency).start()
+    os.environ['LINE_API_HOST'] = api.url
+    os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'benchmark-token')
+
+    import line_client
+    from linebot.v3.messaging import ApiClient, MessagingApi, ReplyMessageRequest, TextMessage
+
+    def request(line_bot_api, i):
+        profile = line_bot_api.get_group_member_profile(
+            group_id='Gbench',
+            user_id=f"U{i:032d}",
+            _request_timeout=line_client.REQUEST_TIMEOUT
+        )
+        line_bot_api.reply_message(
+            ReplyMessageRequest(reply_token=f"token{i}", messages=[TextMessage(text='ok')]),
+            _request_timeout=line_client.REQUEST_TIMEOUT
+        )
+        return profile.display_name
+
+    def per_call(i):
+        with ApiClient(line_client.configuration) as api_client:
+            return request(MessagingApi(api_client), i)
+
+    def shared(i):
+        return request(line_client.get_messaging_api(), i)
+
+    try:
+        run('每次建立', per_call, args.calls, args.threads, api)
+        run('共用用戶端', shared, args.calls, args.threads, api)
+    finally:
+        line_client.close_client()
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
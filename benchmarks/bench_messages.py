@@ -0,0 +1,163 @@
+"""
+訊息建構效能比較：
+- 每次重建 vs 快取重用：/選單、/說明 與錯誤/成功訊息（含 Quick Reply）
+- 每次以 FlexContainer 驗證 vs 預先驗證的模板：20 列的名冊、查詢結果、個人資料、輸入提示
+- 回覆請求序列化：ReplyMessageRequest 模型 vs 直接放入 JSON 結構（line_client.reply_call）
+
+用法：
+    python benchmarks/bench_messages.py --number 2000
+"""
+
+import argparse
+import inspect
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from linebot.v3.messaging import (
+    ApiClient,
+    Configuration,
+    FlexContainer,
+    FlexMessage,
+    ReplyMessageRequest,
+    TextMessage
+)
+
+import line_client
+import messages
+from messages import (
+    create_menu_message,
+    create_help_message,
+    create_error_message,
+    create_success_message,
+    create_roster_message,
+    create_search_result_message,
+    create_profile_message,
+    create_input_prompt_message
+)
+
+QUICK_ACTIONS = [
+    {'label': '查看名冊', 'text': '/名冊'},
+    {'label': '我的資料', 'text': '/我是誰'}
+]
+
+
+def uncached_error():
+    """快取前的錯誤訊息建構方式（每次重建 QuickReply）"""
+    return TextMessage(
+        text="❌ 此指令僅限幹部使用",
+        quick_reply=messages._build_quick_reply.__wrapped__(
+            tuple((item['label'], item['text']) for item in QUICK_ACTIONS)
+        )
+    )
+
+
+def uncached_success():
+    """快取前的成功訊息建構方式（每次重建 QuickReply）"""
+    return TextMessage(
+        text="✅ 登記成功！\n\nLINE 名稱：小明\n遊戲名稱：勇者",
+        quick_reply=messages._build_quick_reply.__wrapped__(
+            tuple((item['label'], item['text']) for item in QUICK_ACTIONS)
+        )
+    )
+
+
+MEMBERS = [
+    {'id': i, 'line_display_name': f"成員{i}", 'game_name': f"勇者{i}", 'is_admin': i == 1}
+    for i in range(1, 21)
+]
+
+
+def roster():
+    return create_roster_message(MEMBERS, total=95, start=21, prev_cursor='21<1', next_cursor='41>20')[0]
+
+
+def search():
+    return create_search_result_message('勇者', MEMBERS[:10])
+
+
+def profile():
+    return create_profile_message(MEMBERS[0], '成員1', True)
+
+
+def input_prompt():
+    return create_input_prompt_message('/登記', '請輸入遊戲名稱', ['/登記 勇者', '/登記 法師'])
+
+
+def validated(build):
+    """模板化之前的做法：組好 dict 後每次以 FlexContainer.from_dict 建立並驗證整棵模型"""
+    def build_validated():
+        message = build()
+        return FlexMessage(alt_text=message.alt_text, contents=FlexContainer.from_dict(message.contents))
+    return build_validated
+
+
+CASES = [
+    ('/選單', inspect.unwrap(create_menu_message), create_menu_message),
+    ('/說明', inspect.unwrap(create_help_message), create_help_message),
+    ('錯誤訊息', uncached_error, lambda: create_error_message("此指令僅限幹部使用", QUICK_ACTIONS)),
+    ('成功訊息', uncached_success,
+     lambda: create_success_message("登記成功！", "LINE 名稱：小明\n遊戲名稱：勇者", QUICK_ACTIONS)),
+]
+
+TEMPLATE_CASES = [
+    ('名冊 20 列', validated(roster), roster),
+    ('查詢 10 筆', validated(search), search),
+    ('個人資料', validated(profile), profile),
+    ('輸入提示', validated(input_prompt), input_prompt),
+]
+
+_api_client = ApiClient(Configuration(access_token='bench'))
+
+
+def model_reply_body(message):
+    """ReplyMessageRequest 模型轉成送出的內容（MessagingApi.reply_message 的做法）"""
+    request = ReplyMessageRequest(reply_token='token', messages=[message])
+    return json.dumps(_api_client.sanitize_for_serialization(request))
+
+
+def json_reply_body(message):
+    """JSON 結構直接放入請求（line_client.reply_call 的做法）"""
+    return json.dumps(_api_client.sanitize_for_serialization(line_client.reply_call('token', [message])['body']))
+
+
+def measure(func, number: int) -> float:
+    """每次呼叫的微秒數（取三輪最快）"""
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='訊息建構效能比較')
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'情境':<8} {'重建 (µs/次)':>14} {'快取 (µs/次)':>14} {'倍數':>8}")
+    for label, before, after in CASES:
+        # 確認兩種方式輸出相同
+        assert before().to_json() == after().to_json()
+        before_us = measure(before, args.number)
+        after_us = measure(after, args.number)
+        print(f"{label:<8} {before_us:14.2f} {after_us:14.2f} {before_us / after_us:7.1f}x")
+
+    print(f"\n{'情境':<10} {'驗證 (µs/次)':>14} {'模板 (µs/次)':>14} {'倍數':>8}")
+    for label, before, after in TEMPLATE_CASES:
+        # 確認模板輸出與 SDK 模型輸出的 JSON 內容相同
+        assert before().to_dict() == after().to_dict()
+        before_us = measure(before, args.number)
+        after_us = measure(after, args.number)
+        print(f"{label:<10} {before_us:14.2f} {after_us:14.2f} {before_us / after_us:7.1f}x")
+
+    # 建構加上序列化成回覆請求：一次回覆的完整成本
+    print(f"\n{'回覆請求':<10} {'模型 (µs/次)':>14} {'JSON (µs/次)':>14} {'倍數':>8}")
+    for label, before, after in TEMPLATE_CASES:
+        assert json.loads(model_reply_body(before())) == json.loads(json_reply_body(after()))
+        before_us = measure(lambda: model_reply_body(before()), args.number)
+        after_us = measure(lambda: json_reply_body(after()), args.number)
+        print(f"{label:<10} {before_us:14.2f} {after_us:14.2f} {before_us / after_us:7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
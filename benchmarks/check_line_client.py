@@ -0,0 +1,152 @@
+"""
+驗證共用 LINE API 用戶端（line_client）的重試、逾時與連線重用行為
+對本地 LINE API 替身（fake_line_api）發送請求，任一項不符合時以非 0 結束
+
+- 取得個人資料（GET）回應 5xx 後恢復正常：只重試一次即成功
+- 5xx 持續發生：重試 LINE_HTTP_RETRIES 次後拋出 ApiException（不會無限重試）
+- reply / push（POST）回應 5xx：不重送，直接拋出 ApiException（避免重複發送）
+- 讀取逾時：在 REQUEST_TIMEOUT 內放棄，且不重送（替身只收到一次請求，訊息不會重複發送）
+- 多個執行緒取得同一個 ApiClient，並行請求時每個執行緒最多一條連線，之後的請求重複使用既有連線
+
+用法：
+    python benchmarks/check_line_client.py
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_line_api import FakeLineApi, display_name_for
+
+READ_TIMEOUT = 0.3
+RETRIES = 2
+THREADS = 8
+
+failures = []
+
+
+def check(condition: bool, description: str):
+    print(f"{'✓' if condition else '✗'} {description}")
+    if not condition:
+        failures.append(description)
+
+
+def main():
+    api = FakeLineApi().start()
+    # line_client 在載入時讀取設定，需先設定環境變數
+    os.environ['LINE_API_HOST'] = api.url
+    os.environ['LINE_CHANNEL_ACCESS_TOKEN'] = 'check-token'
+    os.environ['LINE_READ_TIMEOUT'] = str(READ_TIMEOUT)
+    os.environ['LINE_HTTP_RETRIES'] = str(RETRIES)
+    os.environ['LINE_HTTP_POOL_SIZE'] = str(THREADS)
+
+    import line_client
+    from linebot.v3.messaging import ApiException, TextMessage
+
+    line_api = line_client.get_messaging_api()
+
+    def push(to: str):
+        return line_api.api_client.call_api(
+            **line_client.push_call(to, [TextMessage(text='check')]),
+            _request_timeout=line_client.REQUEST_TIMEOUT
+        )
+
+    def reply(token: str):
+        return line_api.api_client.call_api(
+            **line_client.reply_call(token, [TextMessage(text='check')]),
+            _request_timeout=line_client.REQUEST_TIMEOUT
+        )
+
+    def profile(user_id: str) -> str:
+        return line_api.get_profile(user_id=user_id, _request_timeout=line_client.REQUEST_TIMEOUT).display_name
+
+    # GET 回應 5xx 之後恢復：只重試一次
+    api.reset_stats()
+    api.fail_next('profile', 503)
+    try:
+        name = profile('Ucheck000001')
+    except ApiException as e:
+        name = None
+    stats = api.stats()['requests']
+    check(name == display_name_for('Ucheck000001') and stats == {'profile_failed': 1, 'profile': 1},
+          f"profile 回應 503 後重試一次成功 {stats}")
+
+    # 5xx 持續發生：重試用盡後照常拋出 ApiException
+    api.reset_stats()
+    api.fail_next('profile', *[502] * (RETRIES + 2))
+    try:
+        profile('Ucheck000002')
+        status = None
+    except ApiException as e:
+        status = e.status
+    stats = api.stats()['requests']
+    check(status == 502 and stats == {'profile_failed': RETRIES + 1},
+          f"profile 持續 502 時共送出 {RETRIES + 1} 次後拋出 ApiException（status={status}）{stats}")
+
+    # reply / push 回應 5xx 時 LINE 可能已送出訊息：不重送
+    for endpoint, send in (('reply', lambda: reply('token-5xx')), ('push', lambda: push('Ucheck'))):
+        api.reset_stats()
+        api.fail_next(endpoint, 500)
+        try:
+            send()
+            status = None
+        except ApiException as e:
+            status = e.status
+        stats = api.stats()['requests']
+        check(status == 500 and stats == {f'{endpoint}_failed': 1},
+              f"{endpoint} 回應 500 時不重送，直接拋出 ApiException（status={status}）{stats}")
+    api.reset_stats()
+
+    # 讀取逾時：REQUEST_TIMEOUT 內放棄且不重送
+    check(line_client.REQUEST_TIMEOUT[1] == READ_TIMEOUT, f"REQUEST_TIMEOUT 讀取逾時為 {READ_TIMEOUT} 秒")
+    api.reply_latency = READ_TIMEOUT * 3
+    started = time.perf_counter()
+    try:
+        reply('token-timeout')
+        timed_out = False
+    except Exception as e:
+        timed_out = 'timed out' in str(e).lower()
+    elapsed = time.perf_counter() - started
+    # 等替身處理完逾時的請求，確認期間沒有收到重送
+    time.sleep(api.reply_latency + 0.2)
+    api.reply_latency = 0.0
+    stats = api.stats()['requests']
+    check(timed_out and elapsed < READ_TIMEOUT * 2,
+          f"讀取逾時在 {elapsed * 1000:.0f} ms 後放棄（讀取逾時 {READ_TIMEOUT * 1000:.0f} ms）")
+    check(stats == {'reply': 1}, f"讀取逾時不重送，替身只收到一次 reply {stats}")
+
+    # 多執行緒共用同一個 ApiClient 與連線池
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        clients = set(map(id, pool.map(lambda _: line_client.get_messaging_api().api_client, range(32))))
+    check(clients == {id(line_api.api_client)}, "所有執行緒取得同一個 ApiClient")
+
+    api.reset_stats()
+    user_ids = [f"Ucheck{i:06d}" for i in range(64)]
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        names = list(pool.map(profile, user_ids))
+    stats = api.stats()
+    check(names == [display_name_for(user_id) for user_id in user_ids], "並行取得的名稱皆正確")
+    check(stats['connections'] <= THREADS,
+          f"{THREADS} 個執行緒 {len(user_ids)} 次請求只開啟 {stats['connections']} 條連線")
+
+    api.reset_stats()
+    for user_id in user_ids[:10]:
+        profile(user_id)
+    push('Ucheck')
+    stats = api.stats()
+    check(stats['connections'] == 0, f"之後的請求重複使用既有連線（新建 {stats['connections']} 條）")
+
+    line_client.close_client()
+    api.stop()
+
+    if failures:
+        print(f"\n{len(failures)} 項未通過")
+        sys.exit(1)
+    print("\n全部通過")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+本地 LINE Messaging API 替身
+提供 profile / reply / push 端點，可設定回應延遲，並統計請求數與 TCP 連線數
+以 INVALID_REPLY_TOKEN_PREFIX 開頭的 reply token 會回應 400 Invalid reply token（模擬 token 過期）
+fail_next() 可指定接下來幾次請求回應的錯誤狀態碼（模擬 LINE 端 5xx，驗證重試行為）
+
+用法：
+    python benchmarks/fake_line_api.py --port 8081 --profile-latency 0.05 --reply-latency 0.08
+    LINE_API_HOST=http://127.0.0.1:8081 gunicorn app:app
+"""
+
+import argparse
+import json
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+INVALID_REPLY_TOKEN_PREFIX = 'invalid-'
+
+PROFILE_PATHS = [
+    re.compile(r'^/v2/bot/profile/(?P<user_id>[^/]+)$'),
+    re.compile(r'^/v2/bot/group/(?P<group_id>[^/]+)/member/(?P<user_id>[^/]+)$'),
+    re.compile(r'^/v2/bot/room/(?P<room_id>[^/]+)/member/(?P<user_id>[^/]+)$'),
+]
+
+
+def display_name_for(user_id: str) -> str:
+    """依 user ID 產生固定的顯示名稱"""
+    return f"成員{user_id[-6:]}"
+
+
+class FakeLineApi:
+    """
+    LINE API 替身伺服器
+    - profile_latency / reply_latency：回應前等待的秒數（push 與 reply 相同）
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 profile_latency: float = 0.0, reply_latency: float = 0.0):
+        self.profile_latency = profile_latency
+        self.reply_latency = reply_latency
+
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.requests = {}
+        self.messages_sent = 0
+        self._failures = {}  # 端點 -> 接下來要回應的錯誤狀態碼
+
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _count(self, endpoint: str, messages: int = 0):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.messages_sent += messages
+
+    def fail_next(self, endpoint: str, *statuses: int):
+        """接下來對 endpoint（profile / reply / push）的請求依序回應這些狀態碼，之後恢復正常"""
+        with self._lock:
+            self._failures.setdefault(endpoint, []).extend(statuses)
+
+    def _next_failure(self, endpoint: str):
+        with self._lock:
+            statuses = self._failures.get(endpoint)
+            return statuses.pop(0) if statuses else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'connections': self.connections,
+                'requests': dict(self.requests),
+                'messages_sent': self.messages_sent,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.connections = 0
+            self.requests = {}
+            self.messages_sent = 0
+            self._failures = {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 才會保持連線（keep-alive）
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # 關閉 Nagle，避免 keep-alive 連線上的回應被延遲 ACK 拖慢
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with api._lock:
+                    api.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, payload: dict):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 用戶端已逾時放棄這次請求
+                    pass
+
+            def _send_failure(self, endpoint: str) -> bool:
+                """有指定的錯誤狀態碼時回應錯誤（計入 endpoint_failed）"""
+                status = api._next_failure(endpoint)
+                if status is None:
+                    return False
+                api._count(f'{endpoint}_failed')
+                self._send_json(status, {'message': 'Injected failure'})
+                return True
+
+            def do_GET(self):
+                for pattern in PROFILE_PATHS:
+                    match = pattern.match(self.path)
+                    if match:
+                        if api.profile_latency:
+                            time.sleep(api.profile_latency)
+                        if self._send_failure('profile'):
+                            return
+                        api._count('profile')
+                        user_id = match.group('user_id')
+                        self._send_json(200, {
+                            'displayName': display_name_for(user_id),
+                            'userId': user_id
+                        })
+                        return
+                self._send_json(404, {'message': 'Not found'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                messages = body.get('messages', [])
+
+                if self.path == '/v2/bot/message/reply':
+                    endpoint = 'reply'
+                elif self.path == '/v2/bot/message/push':
+                    endpoint = 'push'
+                else:
+                    self._send_json(404, {'message': 'Not found'})
+                    return
+
+                if api.reply_latency:
+                    time.sleep(api.reply_latency)
+                if self._send_failure(endpoint):
+                    return
+
+                if endpoint == 'reply' and body.get('replyToken', '').startswith(INVALID_REPLY_TOKEN_PREFIX):
+                    api._count('reply_invalid_token')
+                    self._send_json(400, {'message': 'Invalid reply token'})
+                    return
+
+                api._count(endpoint, len(messages))
+
+                self._send_json(200, {
+                    'sentMessages': [{'id': str(i)} for i in range(len(messages))]
+                })
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 LINE Messaging API 替身')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--profile-latency', type=float, default=0.0)
+    parser.add_argument('--reply-latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    api = FakeLineApi(args.host, args.port, args.profile_latency, args.reply_latency)
+    print(f"LINE API 替身啟動於 {api.url}")
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(api.stats(), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
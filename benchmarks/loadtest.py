@@ -0,0 +1,450 @@
+"""
+端對端壓力測試
+以 gunicorn 啟動 app（連到本地 PostgreSQL 與 LINE API 替身），送出正確簽章的 /callback 請求，
+混合一般聊天與各種指令，統計吞吐量、延遲百分位數與每個事件的資料庫往返次數。
+結果附加到 benchmarks/results/loadtest.jsonl，並與相同設定的上一次結果比較。
+
+用法（會在測試資料庫建立 Uload 開頭的測試用戶，結束後刪除）：
+    python benchmarks/loadtest.py --database-url postgresql://localhost/linebot_test \\
+        --events 2000 --concurrency 16 --workers 2 --threads 4 \\
+        --profile-latency 0.05 --reply-latency 0.08
+    # 測試 asyncio 版（async_app，aiohttp worker）
+    python benchmarks/loadtest.py --database-url ... --server async
+"""
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import urllib3
+
+from fake_line_api import FakeLineApi, INVALID_REPLY_TOKEN_PREFIX
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = os.path.join(ROOT, 'benchmarks', 'results', 'loadtest.jsonl')
+
+CHANNEL_SECRET = 'loadtest-secret'
+USER_PREFIX = 'Uload'
+GROUP_ID = 'Gloadtest'
+
+# (權重, 產生訊息的函式)；約八成為一般聊天
+MESSAGE_MIX = [
+    (60, lambda rng, user: rng.choice(['早安', '哈哈哈', '今晚打王嗎？', '+1', '收到'])),
+    (15, lambda rng, user: f"今天的活動 {rng.randint(1, 99)} 點開始"),
+    (5, lambda rng, user: '/我是誰'),
+    (5, lambda rng, user: f"/查詢 角色{rng.randint(0, 99)}"),
+    (3, lambda rng, user: '/說明'),
+    (3, lambda rng, user: '/選單'),
+    (4, lambda rng, user: '/名冊'),
+    (3, lambda rng, user: f"/修改 角色{user}-{rng.randint(0, 9999)}"),
+    (2, lambda rng, user: '/幹部'),
+]
+
+
+def sign(body: bytes) -> str:
+    return base64.b64encode(hmac.new(CHANNEL_SECRET.encode(), body, hashlib.sha256).digest()).decode()
+
+
+def user_id(index: int) -> str:
+    return f"{USER_PREFIX}{index:028d}"
+
+
+def message_event(index: int, uid: str, text: str) -> dict:
+    return {
+        'type': 'message',
+        'mode': 'active',
+        'timestamp': int(time.time() * 1000),
+        'webhookEventId': f"01LOADTEST{index:016d}",
+        'deliveryContext': {'isRedelivery': False},
+        'replyToken': f"loadtest-{index}",
+        'source': {'type': 'group', 'groupId': GROUP_ID, 'userId': uid},
+        'message': {'type': 'text', 'id': str(index), 'quoteToken': 'q', 'text': text},
+    }
+
+
+def signed_payload(events: list):
+    """以送出當下的時間作為事件時間並簽章（reply token 年齡從送出時起算）"""
+    now_ms = int(time.time() * 1000)
+    for event in events:
+        event['timestamp'] = now_ms
+    body = json.dumps({'destination': 'Uloadtestbot', 'events': events}).encode()
+    return body, sign(body), len(events)
+
+
+def build_payloads(events: int, users: int, per_request: int, seed: int,
+                   invalid_token_ratio: float = 0.0) -> list:
+    """預先產生所有請求的事件（不計入測試時間）；invalid_token_ratio 比例的事件使用失效的 reply token"""
+    rng = random.Random(seed)
+    weights = [w for w, _ in MESSAGE_MIX]
+    makers = [m for _, m in MESSAGE_MIX]
+    payloads, batch = [], []
+    for i in range(events):
+        index = rng.randrange(users)
+        text = rng.choices(makers, weights)[0](rng, index)
+        event = message_event(i, user_id(index), text)
+        if invalid_token_ratio and rng.random() < invalid_token_ratio:
+            event['replyToken'] = f"{INVALID_REPLY_TOKEN_PREFIX}{i}"
+        batch.append(event)
+        if len(batch) == per_request or i == events - 1:
+            payloads.append(batch)
+            batch = []
+    return payloads
+
+
+def seed_database(database_url: str, users: int, members: int):
+    """建立測試用戶：前 members 位已登記（第一位為管理員），其餘只在 pending_users"""
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn, conn.cursor() as cursor:
+            cleanup_database_cursor(cursor)
+            for i in range(users):
+                cursor.execute(
+                    'INSERT INTO pending_users (line_user_id, line_display_name) VALUES (%s, %s)',
+                    (user_id(i), f"成員{user_id(i)[-6:]}")
+                )
+                if i < members:
+                    cursor.execute(
+                        'INSERT INTO members (line_user_id, line_display_name, game_name, is_admin) '
+                        'VALUES (%s, %s, %s, %s)',
+                        (user_id(i), f"成員{user_id(i)[-6:]}", f"角色{i}", i == 0)
+                    )
+    finally:
+        conn.close()
+
+
+def cleanup_database_cursor(cursor):
+    cursor.execute('DELETE FROM members WHERE line_user_id LIKE %s', (f"{USER_PREFIX}%",))
+    cursor.execute('DELETE FROM pending_users WHERE line_user_id LIKE %s', (f"{USER_PREFIX}%",))
+
+
+def cleanup_database(database_url: str):
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn, conn.cursor() as cursor:
+            cleanup_database_cursor(cursor)
+    finally:
+        conn.close()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_app(args, line_api_url: str, metrics_dir: str):
+    """以 gunicorn 啟動 app（或 async_app），回傳 (Popen, base_url)"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=args.database_url,
+        LINE_CHANNEL_SECRET=CHANNEL_SECRET,
+        LINE_CHANNEL_ACCESS_TOKEN='loadtest-token',
+        LINE_API_HOST=line_api_url,
+        METRICS_DIR=metrics_dir,
+        METRICS_FLUSH_INTERVAL='0.5',
+        METRICS_TOKEN='',
+        WEBHOOK_ASYNC='1' if args.webhook_async else '0',
+        COMMAND_RATE_LIMIT='0',
+    )
+    env.update(dict(item.split('=', 1) for item in args.env))
+    if args.server == 'async':
+        target = ['async_app:create_app', '--worker-class', 'aiohttp.GunicornWebWorker']
+    else:
+        target = ['app:app', '--threads', str(args.threads)]
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', *target,
+         '--bind', f"127.0.0.1:{port}",
+         '--workers', str(args.workers),
+         '--graceful-timeout', '10',
+         '--log-level', 'warning'],
+        cwd=ROOT,
+        env=env,
+        stdout=None if args.verbose else subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    http = urllib3.PoolManager()
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn 啟動失敗（結束代碼 {process.returncode}），加上 --verbose 查看錯誤")
+        try:
+            if http.request('GET', f"{base_url}/health", timeout=1, retries=False).status == 200:
+                return process, base_url
+        except urllib3.exceptions.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('等待 app 啟動逾時')
+
+
+def read_metrics(http, base_url: str) -> dict:
+    """讀取 /metrics，回傳 {名稱{標籤}: 數值}"""
+    text = http.request('GET', f"{base_url}/metrics").data.decode()
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            values[name] = float(value)
+    return values
+
+
+def metric_delta(before: dict, after: dict, pattern: str) -> float:
+    regex = re.compile(pattern)
+    return sum(v - before.get(k, 0) for k, v in after.items() if regex.fullmatch(k))
+
+
+def histogram_quantile(before: dict, after: dict, name: str, q: float) -> float:
+    """由 /metrics 的分桶增量估計分位數（回傳所在分桶的上限，超過最大分桶時回傳 inf）"""
+    regex = re.compile(re.escape(name) + r'_bucket\{le="([^"]+)"\}')
+    buckets = sorted(
+        (float(match.group(1)), value - before.get(key, 0))
+        for key, value in after.items()
+        for match in [regex.fullmatch(key)] if match
+    )
+    if not buckets or buckets[-1][1] <= 0:
+        return 0.0
+    target = q * buckets[-1][1]
+    for bound, count in buckets:
+        if count >= target:
+            return bound
+    return float('inf')
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_load(base_url: str, payloads: list, concurrency: int):
+    """並行送出所有請求，回傳 (各請求延遲秒數, 失敗數)"""
+    http = urllib3.PoolManager(maxsize=concurrency)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def send(events):
+        nonlocal errors
+        body, signature, _ = signed_payload(events)
+        start = time.perf_counter()
+        try:
+            status = http.request(
+                'POST', f"{base_url}/callback", body=body,
+                headers={'Content-Type': 'application/json', 'X-Line-Signature': signature},
+                retries=False, timeout=30
+            ).status
+        except urllib3.exceptions.HTTPError:
+            status = None
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if status != 200:
+                errors += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, payloads))
+    http.clear()
+    return latencies, errors
+
+
+def wait_for_events(http, base_url: str, before: dict, events: int, timeout: float = 120):
+    """非同步模式下，等待背景執行緒處理完所有事件"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        processed = metric_delta(before, read_metrics(http, base_url), r'linebot_event_seconds_count\{.*\}')
+        if processed >= events:
+            return
+        time.sleep(0.2)
+    print('警告：等待事件處理完成逾時')
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def save_result(result: dict):
+    """附加結果，並與相同設定的上一次結果比較"""
+    previous = None
+    if os.path.exists(RESULTS_FILE):
+        with open(RESULTS_FILE) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('config') == result['config']:
+                    previous = record
+
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, 'a') as f:
+        f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    if previous:
+        print(f"\n與上一次相同設定的結果比較（{previous['revision'] or '?'} @ {previous['time']}）")
+        for key, label in (('throughput', '吞吐量'), ('p50_ms', 'p50'), ('p95_ms', 'p95'),
+                           ('p99_ms', 'p99'), ('db_round_trips_per_event', '資料庫往返/事件')):
+            old, new = previous['results'][key], result['results'][key]
+            change = (new - old) / old * 100 if old else 0.0
+            print(f"  {label:<14} {old:10.2f} → {new:10.2f}  ({change:+.1f}%)")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='LINE Bot 端對端壓力測試')
+    parser.add_argument('--database-url', default=os.environ.get('LOADTEST_DATABASE_URL'),
+                        help='測試用資料庫（預設讀取 LOADTEST_DATABASE_URL，請勿使用正式資料庫）')
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--events-per-request', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--members', type=int, default=150)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker 數')
+    parser.add_argument('--threads', type=int, default=4, help='每個 worker 的執行緒數（僅 sync）')
+    parser.add_argument('--server', choices=('sync', 'async'), default='sync',
+                        help='sync = app.py（Flask），async = async_app.py（aiohttp）')
+    parser.add_argument('--webhook-async', action='store_true', help='以 WEBHOOK_ASYNC=1 啟動')
+    parser.add_argument('--profile-latency', type=float, default=0.05)
+    parser.add_argument('--reply-latency', type=float, default=0.08)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--invalid-token-ratio', type=float, default=0.0,
+                        help='使用失效 reply token 的事件比例（測試改用 push 的路徑）')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='傳給 app 的額外環境變數（可重複）')
+    parser.add_argument('--label', default='', help='記錄在結果中的說明')
+    parser.add_argument('--no-save', action='store_true', help='不寫入結果檔')
+    parser.add_argument('--verbose', action='store_true', help='顯示 gunicorn 的輸出')
+    return parser
+
+
+def run(args) -> dict:
+    """執行一次壓力測試，印出並回傳結果"""
+    api = FakeLineApi(profile_latency=args.profile_latency, reply_latency=args.reply_latency).start()
+    metrics_dir = tempfile.mkdtemp(prefix='linebot-loadtest-')
+    payloads = build_payloads(args.events, args.users, args.events_per_request, args.seed,
+                              args.invalid_token_ratio)
+
+    process, base_url = start_app(args, api.url, metrics_dir)
+    http = urllib3.PoolManager()
+    try:
+        seed_database(args.database_url, args.users, args.members)
+        # 暖身：每位用戶先送一則聊天，讓連線池與名稱快取進入穩定狀態
+        time.sleep(1)
+        before = read_metrics(http, base_url)
+        warmup = [[message_event(i, user_id(i), '早安')] for i in range(args.users)]
+        run_load(base_url, warmup, args.concurrency)
+        if args.webhook_async:
+            wait_for_events(http, base_url, before, args.users)
+        time.sleep(1)
+
+        api.reset_stats()
+        before = read_metrics(http, base_url)
+        start = time.perf_counter()
+        latencies, errors = run_load(base_url, payloads, args.concurrency)
+        if args.webhook_async:
+            # 非同步模式下請求立即返回，吞吐量以事件處理完成的時間計算
+            wait_for_events(http, base_url, before, args.events)
+        elapsed = time.perf_counter() - start
+        time.sleep(1)
+        after = read_metrics(http, base_url)
+    finally:
+        http.clear()
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        api.stop()
+        cleanup_database(args.database_url)
+
+    latencies.sort()
+    statements = metric_delta(before, after, r'linebot_db_statements_total')
+    transactions = metric_delta(before, after, r'linebot_db_transactions_total\{.*\}')
+    events_processed = metric_delta(before, after, r'linebot_event_seconds_count\{.*\}')
+    push_fallbacks = metric_delta(before, after, r'linebot_reply_push_fallbacks_total\{.*\}')
+    line_stats = api.stats()
+
+    results = {
+        'events': args.events,
+        'requests': len(payloads),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'throughput': round(args.events / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'db_statements_per_event': round(statements / args.events, 3),
+        'db_round_trips_per_event': round((statements + transactions) / args.events, 3),
+        'events_processed': int(events_processed),
+        'reply_token_age_p50_s': histogram_quantile(before, after, 'linebot_reply_token_age_seconds', 0.5),
+        'reply_token_age_p99_s': histogram_quantile(before, after, 'linebot_reply_token_age_seconds', 0.99),
+        'push_fallbacks': int(push_fallbacks),
+        'line_api': line_stats,
+    }
+
+    print(f"事件 {args.events}（{len(payloads)} 個請求，失敗 {errors}）  "
+          f"並行 {args.concurrency}  耗時 {elapsed:.2f} s")
+    print(f"吞吐量     {results['throughput']:.1f} 事件/秒")
+    print(f"請求延遲   p50 {results['p50_ms']:.1f} ms  p95 {results['p95_ms']:.1f} ms  "
+          f"p99 {results['p99_ms']:.1f} ms")
+    print(f"資料庫     {results['db_round_trips_per_event']:.2f} 次往返/事件"
+          f"（SQL {results['db_statements_per_event']:.2f}、交易結束 {transactions / args.events:.2f}）")
+    print(f"Reply      token 年齡 p50 ≤ {results['reply_token_age_p50_s']:g} s  "
+          f"p99 ≤ {results['reply_token_age_p99_s']:g} s  改用 push {results['push_fallbacks']} 次")
+    print(f"LINE API   {line_stats['requests']}  新建 TCP 連線 {line_stats['connections']}")
+    return results
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('請以 --database-url 或 LOADTEST_DATABASE_URL 指定測試用資料庫')
+
+    results = run(args)
+
+    if not args.no_save:
+        save_result({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'label': args.label,
+            'config': {
+                'events': args.events,
+                'events_per_request': args.events_per_request,
+                'concurrency': args.concurrency,
+                'users': args.users,
+                'members': args.members,
+                'workers': args.workers,
+                'threads': args.threads,
+                'webhook_async': args.webhook_async,
+                'server': args.server,
+                'profile_latency': args.profile_latency,
+                'reply_latency': args.reply_latency,
+                'invalid_token_ratio': args.invalid_token_ratio,
+                'env': sorted(args.env),
+            },
+            'results': results,
+        })
+
+
+if __name__ == '__main__':
+    main()
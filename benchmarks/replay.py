@@ -0,0 +1,166 @@
+"""
+重播錄製的 webhook 流量（WEBHOOK_CAPTURE_FILE 產生的 JSONL）
+以目標環境的 channel secret 重新簽章後送到 /callback，可用原速、N 倍速或最快速度送出。
+
+用法：
+    # 原速重播
+    python benchmarks/replay.py capture.jsonl --url http://127.0.0.1:5000/callback --channel-secret xxx
+    # 10 倍速，只送前 5000 筆
+    python benchmarks/replay.py capture.jsonl --url ... --speed 10 --limit 5000
+    # 不等待，盡快送出
+    python benchmarks/replay.py capture.jsonl --url ... --speed 0 --concurrency 32
+
+注意：使用者 ID 已匿名化，目標環境的資料庫中不會有這些成員，
+管理員指令會回覆權限不足；適合用來重現流量結構與尖峰，而非驗證回覆內容。
+"""
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import urllib3
+
+
+def load_records(path: str, limit: int = None) -> list:
+    """讀取錄製檔，回傳 [(收到時間, webhook 內容)]（依時間排序）"""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            records.append((record['t'], record['body']))
+            if limit and len(records) >= limit:
+                break
+    records.sort(key=lambda r: r[0])
+    return records
+
+
+def prepare_body(body: dict, captured_at: float, replay_at: float, index: int) -> dict:
+    """
+    將事件時間平移到重播時間（保留事件間的間隔），並換成不重複的 reply token 與事件 ID
+    """
+    shift_ms = int((replay_at - captured_at) * 1000)
+    events = []
+    for n, event in enumerate(body.get('events', [])):
+        event = dict(event)
+        if 'timestamp' in event:
+            event['timestamp'] = event['timestamp'] + shift_ms
+        if 'replyToken' in event:
+            event['replyToken'] = f"replay-{index}-{n}"
+        if 'webhookEventId' in event:
+            event['webhookEventId'] = f"REPLAY{index:012d}{n:04d}"
+        events.append(event)
+    return dict(body, events=events)
+
+
+def sign(secret: str, body: bytes) -> str:
+    return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def replay(records: list, url: str, secret: str, speed: float, concurrency: int):
+    """
+    依錄製時間間隔（除以 speed）送出；speed <= 0 時不等待
+    回傳統計資料
+    """
+    http = urllib3.PoolManager(maxsize=concurrency)
+    lock = threading.Lock()
+    latencies, lags = [], []
+    statuses = {}
+    events = 0
+
+    def send(index, captured_at, body, due):
+        body_bytes = json.dumps(prepare_body(body, captured_at, time.time(), index)).encode()
+        start = time.perf_counter()
+        try:
+            status = http.request(
+                'POST', url, body=body_bytes,
+                headers={'Content-Type': 'application/json', 'X-Line-Signature': sign(secret, body_bytes)},
+                retries=False, timeout=30
+            ).status
+        except urllib3.exceptions.HTTPError as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            lags.append(max(0.0, start - due) if due is not None else 0.0)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    first_at = records[0][0]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, (captured_at, body) in enumerate(records):
+            due = None
+            if speed > 0:
+                due = start + (captured_at - first_at) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            events += len(body.get('events', []))
+            pool.submit(send, index, captured_at, body, due)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    lags.sort()
+    return {
+        'requests': len(records),
+        'events': events,
+        'elapsed_s': round(elapsed, 3),
+        'captured_span_s': round(records[-1][0] - first_at, 3),
+        'requests_per_s': round(len(records) / elapsed, 2) if elapsed else 0.0,
+        'events_per_s': round(events / elapsed, 2) if elapsed else 0.0,
+        'statuses': {str(k): v for k, v in statuses.items()},
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_lag_ms': round(lags[-1] * 1000, 2) if lags else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='重播錄製的 webhook 流量')
+    parser.add_argument('file', help='WEBHOOK_CAPTURE_FILE 錄製的 JSONL 檔')
+    parser.add_argument('--url', default='http://127.0.0.1:5000/callback', help='目標 /callback 網址')
+    parser.add_argument('--channel-secret', default=os.environ.get('LINE_CHANNEL_SECRET'),
+                        help='目標環境的 channel secret（預設讀取 LINE_CHANNEL_SECRET）')
+    parser.add_argument('--speed', type=float, default=1.0, help='倍速（1 = 原速，0 = 不等待）')
+    parser.add_argument('--concurrency', type=int, default=16, help='同時進行的請求數上限')
+    parser.add_argument('--limit', type=int, default=None, help='只重播前 N 筆')
+    args = parser.parse_args()
+
+    if not args.channel_secret:
+        parser.error('請以 --channel-secret 或 LINE_CHANNEL_SECRET 指定目標環境的 channel secret')
+
+    records = load_records(args.file, args.limit)
+    if not records:
+        print('錄製檔沒有任何資料')
+        return
+
+    mode = '最快速度' if args.speed <= 0 else f"{args.speed:g} 倍速"
+    print(f"重播 {len(records)} 筆請求（錄製時長 {records[-1][0] - records[0][0]:.1f} 秒，{mode}）→ {args.url}")
+    result = replay(records, args.url, args.channel_secret, args.speed, args.concurrency)
+
+    print(f"耗時       {result['elapsed_s']:.2f} s（{result['requests_per_s']:.1f} 請求/秒，"
+          f"{result['events_per_s']:.1f} 事件/秒）")
+    print(f"回應狀態   {result['statuses']}")
+    print(f"請求延遲   p50 {result['p50_ms']:.1f} ms  p95 {result['p95_ms']:.1f} ms  p99 {result['p99_ms']:.1f} ms")
+    if args.speed > 0:
+        print(f"排程落後   最多 {result['max_lag_ms']:.1f} ms（過大表示並行數不足，無法維持指定速度）")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,328 @@
 import os
+import threading
+import time
+import functools
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.errors
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor, execute_values
 from contextlib import contextmanager
 
+import member_cache
+import metrics
+import name_keys
+
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
+# 連線池設定（每個 worker 各自一個連線池）
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800))
+DB_POOL_HEALTH_CHECK = os.environ.get('DB_POOL_HEALTH_CHECK', '1') == '1'
+DB_POOL_HEALTH_CHECK_IDLE = float(os.environ.get('DB_POOL_HEALTH_CHECK_IDLE', 30))
+
+# pending_users.last_seen 在此秒數內視為仍然新鮮，不重寫
+PRESENCE_FRESH_SECONDS = int(os.environ.get('PRESENCE_FRESH_SECONDS', 60))
+
+# /查詢 最多回傳的筆數
+SEARCH_RESULT_LIMIT = int(os.environ.get('SEARCH_RESULT_LIMIT', 30))
+# 管理員指令以名稱指定成員時，有歧義最多列出幾位候選成員
+RESOLVE_CANDIDATE_LIMIT = int(os.environ.get('RESOLVE_CANDIDATE_LIMIT', 5))
+
+# 行程內成員名錄（1 = 啟用，透過 LISTEN/NOTIFY 與其他 worker 同步失效）
+MEMBER_DIRECTORY_ENABLED = os.environ.get('MEMBER_DIRECTORY', '0') == '1'
+MEMBER_DIRECTORY_VERSION_CHECK = float(os.environ.get('MEMBER_DIRECTORY_VERSION_CHECK', 5))
+# 行程內管理員快取（1 = 啟用，失效方式與成員名錄相同）
+ADMIN_CACHE_ENABLED = os.environ.get('ADMIN_CACHE', '1') == '1'
+
+
+class PoolTimeoutError(Exception):
+    """等待連線池可用連線逾時"""
+
+
+_DB_STATEMENTS = metrics.DB_STATEMENTS.labels()
+_DB_COMMITS = metrics.DB_TRANSACTIONS.labels('commit')
+_DB_ROLLBACKS = metrics.DB_TRANSACTIONS.labels('rollback')
+
+
+class MeteredCursor(RealDictCursor):
+    """計算送出 SQL 語句數的游標（監控資料庫往返次數）"""
+
+    def execute(self, query, vars=None):
+        _DB_STATEMENTS.inc()
+        return super().execute(query, vars)
+
+
+class ConnectionPool:
+    """
+    執行緒安全的 PostgreSQL 連線池
+    - min_size / max_size：保留的最少連線數與最多同時開啟的連線數
+    - timeout：取得連線時最多等待秒數
+    - max_lifetime：連線存活超過此秒數後，歸還時直接關閉並重建
+    - health_check：取出閒置超過 health_check_idle 秒的連線時，先執行 SELECT 1 確認連線可用
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 5, timeout: float = 10,
+                 max_lifetime: float = 1800, health_check: bool = True,
+                 health_check_idle: float = 30):
+        self.dsn = dsn
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check = health_check
+        self.health_check_idle = health_check_idle
+        self.pid = os.getpid()
+
+        self._idle = []  # [(conn, created_at, returned_at)]
+        self._created_at = {}  # id(conn) -> 建立時間
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # 統計資料
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._discarded = 0
+
+        for _ in range(self.min_size):
+            conn = self._connect()
+            self._idle.append((conn, self._created_at[id(conn)], time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=MeteredCursor)
+        self._created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        with self._cond:
+            self._created_at.pop(id(conn), None)
+            self._discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.max_lifetime > 0 and time.monotonic() - created_at > self.max_lifetime
+
+    def _is_healthy(self, conn, returned_at: float) -> bool:
+        if conn.closed:
+            return False
+        if not self.health_check or time.monotonic() - returned_at < self.health_check_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """取出一條連線（必要時等待，逾時拋出 PoolTimeoutError）"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        with self._cond:
+            if self._closed:
+                raise PoolTimeoutError("連線池已關閉")
+            self._waiting += 1
+            try:
+                while not self._idle and self._in_use >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"等待資料庫連線逾時（{self.timeout} 秒，使用中 {self._in_use} 條）"
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+            conn, _, returned_at = self._idle.pop() if self._idle else (None, 0, 0)
+            self._in_use += 1
+
+            waited = time.monotonic() - start
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        # 連線與健康檢查在鎖外進行，避免阻塞其他執行緒
+        try:
+            if conn is not None and (self._is_expired(self._created_at.get(id(conn), 0))
+                                     or not self._is_healthy(conn, returned_at)):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+            return conn
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, discard: bool = False):
+        """歸還連線；損壞、交易未結束或超過存活時間的連線會直接關閉"""
+        with self._cond:
+            self._in_use -= 1
+            created_at = self._created_at.get(id(conn), 0)
+            broken = (
+                discard
+                or self._closed
+                or conn.closed
+                or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                or self._is_expired(created_at)
+            )
+            if broken:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        """關閉所有閒置連線，使用中的連線會在歸還時關閉"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        """連線池統計資料"""
+        with self._cond:
+            return {
+                'pid': self.pid,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'max_size': self.max_size,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'wait_time_total': round(self._wait_total, 6),
+                'wait_time_max': round(self._wait_max, 6),
+                'wait_time_avg': round(self._wait_total / self._checkouts, 6) if self._checkouts else 0.0,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_inherited_pools = []
+
+
+def _reset_pool_after_fork():
+    """
+    fork 後的子行程不可沿用父行程的連線（socket 為共用）
+    保留參照避免被回收時關閉父行程仍在使用的連線
+    """
+    global _pool, _pool_lock
+    if _pool is not None:
+        _inherited_pools.append(_pool)
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+
+def get_pool() -> ConnectionPool:
+    """取得目前行程的連線池（第一次使用時建立）"""
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool(
+                DATABASE_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                timeout=DB_POOL_TIMEOUT,
+                max_lifetime=DB_POOL_MAX_LIFETIME,
+                health_check=DB_POOL_HEALTH_CHECK,
+                health_check_idle=DB_POOL_HEALTH_CHECK_IDLE
+            )
+        return _pool
+
+
+def close_pool():
+    """關閉目前行程的連線池（worker 結束時呼叫）"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.close()
+        _pool = None
+
+
+def get_pool_stats() -> dict:
+    """取得連線池統計（使用中、閒置、等待時間等）"""
+    pool = _pool
+    if pool is None or pool.pid != os.getpid():
+        return {'pid': os.getpid(), 'in_use': 0, 'idle': 0, 'waiting': 0}
+    return pool.stats()
+
 
 def get_connection():
-    """建立資料庫連線"""
+    """建立資料庫連線（不經過連線池）"""
     return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
 
 
+def _like_pattern(query: str, prefix: bool = False) -> str:
+    """將查詢字串轉為 LIKE 樣式（跳脫 % _ \\），prefix=True 時只比對開頭"""
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'{escaped}%' if prefix else f'%{escaped}%'
+
+
 @contextmanager
-def get_db_cursor():
-    """資料庫游標的 context manager"""
-    conn = get_connection()
+def get_db_cursor(name: str = None):
+    """
+    資料庫游標的 context manager（從連線池取得連線）
+    name：指定時建立伺服器端（named）游標，可逐批讀取大量資料
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    cursor = None
+    discard = False
     try:
-        cursor = conn.cursor()
+        cursor = conn.cursor(name=name) if name else conn.cursor()
         yield cursor
+        cursor.close()
         conn.commit()
-    except Exception as e:
-        conn.rollback()
+        _DB_COMMITS.inc()
+    except BaseException as e:
+        # 包含 GeneratorExit：串流讀取提前結束時也要結束交易，連線才能放回連線池
+        try:
+            conn.rollback()
+            _DB_ROLLBACKS.inc()
+        except Exception:
+            discard = True
         raise e
     finally:
-        cursor.close()
-        conn.close()
+        if cursor is not None and not cursor.closed:
+            try:
+                cursor.close()
+            except psycopg2.Error:
+                # 伺服器端游標在交易結束後即失效，關閉失敗不代表連線損壞
+                if name is None:
+                    discard = True
+        pool.putconn(conn, discard=discard)
 
 
 def init_db():
     """初始化資料庫，建立 members 表和 pending_users 表"""
     with get_db_cursor() as cursor:
+        # 多個 worker 同時啟動時依序執行，避免 DDL 互相衝突
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('linebot_init_db'))")
+
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS members (
                 id SERIAL PRIMARY KEY,
@@ -41,15 +334,6 @@ def init_db():
                 updated_at TIMESTAMP DEFAULT NOW()
             )
         ''')
-        # 建立索引以加速查詢
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_members_game_name
-            ON members (game_name)
-        ''')
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_members_line_display_name
-            ON members (line_display_name)
-        ''')
 
         # 建立 pending_users 表（記錄發過訊息但未登記的用戶）
         cursor.execute('''
@@ -60,123 +344,529 @@ def init_db():
                 last_seen TIMESTAMP DEFAULT NOW()
             )
         ''')
+
+        # 名稱比對鍵：NFKC、去除前後空白、忽略大小寫、繁體轉簡體（規則同 name_keys.name_key()），
+        # 以產生欄位（generated column）隨資料寫入維護，查詢一律比對 *_key 欄位
+        name_key_source = sql.SQL("SELECT translate(lower(btrim(normalize(value, NFKC), ' ')), {}, {})").format(
+            sql.Literal(name_keys.TRADITIONAL), sql.Literal(name_keys.SIMPLIFIED)
+        ).as_string(cursor)
+        cursor.execute("SELECT prosrc FROM pg_proc WHERE proname = 'name_key'")
+        row = cursor.fetchone()
+        name_key_changed = row is not None and row['prosrc'].strip() != name_key_source
+        if row is None or name_key_changed:
+            cursor.execute(f'''
+                CREATE OR REPLACE FUNCTION name_key(value TEXT) RETURNS TEXT AS $$
+                    {name_key_source}
+                $$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+            ''')
+        cursor.execute('''
+            ALTER TABLE members
+                ADD COLUMN IF NOT EXISTS game_name_key TEXT
+                    GENERATED ALWAYS AS (name_key(game_name)) STORED,
+                ADD COLUMN IF NOT EXISTS line_display_name_key TEXT
+                    GENERATED ALWAYS AS (name_key(line_display_name)) STORED
+        ''')
+        cursor.execute('''
+            ALTER TABLE pending_users
+                ADD COLUMN IF NOT EXISTS line_display_name_key TEXT
+                    GENERATED ALWAYS AS (name_key(line_display_name)) STORED
+        ''')
+        if name_key_changed:
+            # 對照表更新後，重算既有資料的比對鍵（UPDATE 時產生欄位會重新計算）
+            cursor.execute('SAVEPOINT refresh_name_keys')
+            try:
+                cursor.execute('''
+                    UPDATE members SET game_name = game_name
+                    WHERE game_name_key IS DISTINCT FROM name_key(game_name)
+                       OR line_display_name_key IS DISTINCT FROM name_key(line_display_name)
+                ''')
+                cursor.execute('''
+                    UPDATE pending_users SET line_display_name = line_display_name
+                    WHERE line_display_name_key IS DISTINCT FROM name_key(line_display_name)
+                ''')
+                cursor.execute('RELEASE SAVEPOINT refresh_name_keys')
+            except psycopg2.Error as e:
+                cursor.execute('ROLLBACK TO SAVEPOINT refresh_name_keys')
+                print(f"無法重算名稱比對鍵（可能有遊戲名稱在新規則下重複）: {e}")
+
+        # 建立索引以加速查詢：完全相符與開頭相符（LIKE '關鍵字%'）都使用比對鍵的 B-tree 索引
+        # 舊版直接比對原始名稱的索引已不再使用
+        for index in ('idx_members_game_name', 'idx_members_line_display_name', 'idx_pending_users_display_name',
+                      'idx_members_game_name_trgm', 'idx_members_line_display_name_trgm',
+                      'idx_pending_users_display_name_trgm'):
+            cursor.execute(sql.SQL('DROP INDEX IF EXISTS {}').format(sql.Identifier(index)))
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_members_line_display_name_key
+            ON members (line_display_name_key text_pattern_ops)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_pending_users_display_name_key
+            ON pending_users (line_display_name_key text_pattern_ops)
+        ''')
+
+        # 建立 pg_trgm 三字元 GIN 索引，讓 LIKE '%關鍵字%' 不必循序掃描
+        # 沒有建立擴充的權限時仍可運作，只是模糊搜尋會退回循序掃描
+        cursor.execute('SAVEPOINT trgm_indexes')
+        try:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_members_game_name_key_trgm
+                ON members USING gin (game_name_key gin_trgm_ops)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_members_line_display_name_key_trgm
+                ON members USING gin (line_display_name_key gin_trgm_ops)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_pending_users_display_name_key_trgm
+                ON pending_users USING gin (line_display_name_key gin_trgm_ops)
+            ''')
+            cursor.execute('RELEASE SAVEPOINT trgm_indexes')
+        except psycopg2.Error as e:
+            cursor.execute('ROLLBACK TO SAVEPOINT trgm_indexes')
+            print(f"無法建立 pg_trgm 索引，模糊搜尋將使用循序掃描: {e}")
+
+        # 遊戲名稱唯一（以比對鍵判斷：全形半形、大小寫、繁簡寫法不同也視為相同），同時登記相同名稱時由資料庫擋下
+        # 既有資料已有重複名稱時無法建立（保留舊的唯一索引），先清理重複資料後重新啟動即可
+        cursor.execute('SAVEPOINT game_name_key')
+        try:
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS uq_members_game_name_norm
+                ON members (game_name_key text_pattern_ops)
+            ''')
+            cursor.execute('DROP INDEX IF EXISTS uq_members_game_name_key')
+            cursor.execute('DROP INDEX IF EXISTS idx_members_game_name_key')
+            cursor.execute('RELEASE SAVEPOINT game_name_key')
+        except psycopg2.Error as e:
+            cursor.execute('ROLLBACK TO SAVEPOINT game_name_key')
+            print(f"無法建立遊戲名稱唯一索引（可能已有重複名稱）: {e}")
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_members_game_name_key
+                ON members (game_name_key text_pattern_ops)
+            ''')
+
+        # 快取版本號與變更通知：members 有快取依賴的變更時遞增版本並 NOTIFY，
+        # 供各 worker 的成員名錄 / 管理員快取判斷是否需要重新載入
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                name VARCHAR(50) PRIMARY KEY,
+                version BIGINT NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO cache_versions (name) VALUES ('members')
+            ON CONFLICT (name) DO NOTHING
+        ''')
+        # 以語句為單位觸發（FOR EACH STATEMENT + 轉換表）：一個語句最多遞增一次版本，
+        # 沒有影響任何資料列、或只改到快取用不到的欄位時不遞增，
+        # 避免每一列的 LINE 名稱同步都鎖住同一筆 cache_versions，讓各 worker 的寫入排隊
+        # TG_ARGV[0]：'directory' = 成員名錄依賴全部欄位（updated_at 除外）；'admin' = 只依賴管理員身分
+        cursor.execute(f'''
+            CREATE OR REPLACE FUNCTION notify_members_changed() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    PERFORM 1 FROM new_rows
+                    WHERE TG_ARGV[0] = 'directory' OR is_admin LIMIT 1;
+                ELSIF TG_OP = 'DELETE' THEN
+                    PERFORM 1 FROM old_rows
+                    WHERE TG_ARGV[0] = 'directory' OR is_admin LIMIT 1;
+                ELSIF TG_ARGV[0] = 'directory' THEN
+                    PERFORM 1 FROM old_rows o JOIN new_rows n ON n.id = o.id
+                    WHERE (o.line_user_id, o.line_display_name, o.game_name, o.is_admin)
+                        IS DISTINCT FROM (n.line_user_id, n.line_display_name, n.game_name, n.is_admin)
+                    LIMIT 1;
+                ELSE
+                    PERFORM 1 FROM old_rows o JOIN new_rows n ON n.id = o.id
+                    WHERE (o.line_user_id, o.is_admin) IS DISTINCT FROM (n.line_user_id, n.is_admin)
+                        AND (o.is_admin OR n.is_admin)
+                    LIMIT 1;
+                END IF;
+                IF NOT FOUND THEN
+                    RETURN NULL;
+                END IF;
+                UPDATE cache_versions SET version = version + 1 WHERE name = 'members';
+                PERFORM pg_notify('{member_cache.MEMBERS_CHANNEL}', '');
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        ''')
+        cursor.execute('DROP TRIGGER IF EXISTS trg_members_changed ON members')
+        for operation in ('insert', 'update', 'delete'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS trg_members_{operation}_changed ON members')
+        # 成員名錄與管理員快取都停用時不建立觸發器，寫入 members 完全不碰 cache_versions
+        # （各 worker / 副本的 MEMBER_DIRECTORY、ADMIN_CACHE 需設定一致，最後啟動的設定生效）
+        if MEMBER_DIRECTORY_ENABLED or ADMIN_CACHE_ENABLED:
+            depends_on = 'directory' if MEMBER_DIRECTORY_ENABLED else 'admin'
+            for operation, referencing in (
+                ('INSERT', 'NEW TABLE AS new_rows'),
+                ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+                ('DELETE', 'OLD TABLE AS old_rows')
+            ):
+                cursor.execute(f'''
+                    CREATE TRIGGER trg_members_{operation.lower()}_changed
+                    AFTER {operation} ON members
+                    REFERENCING {referencing}
+                    FOR EACH STATEMENT EXECUTE FUNCTION notify_members_changed('{depends_on}')
+                ''')
+
+        # 成員總數計數器：由觸發器維護，名冊分頁不必每次 COUNT(*)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS table_counts (
+                name VARCHAR(50) PRIMARY KEY,
+                row_count BIGINT NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE OR REPLACE FUNCTION count_members() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    UPDATE table_counts SET row_count = row_count + 1 WHERE name = 'members';
+                ELSE
+                    UPDATE table_counts SET row_count = row_count - 1 WHERE name = 'members';
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        ''')
+        cursor.execute('DROP TRIGGER IF EXISTS trg_members_count ON members')
+        cursor.execute('''
+            CREATE TRIGGER trg_members_count
+            AFTER INSERT OR DELETE ON members
+            FOR EACH ROW EXECUTE FUNCTION count_members()
+        ''')
+        # 啟動時校正一次（TRUNCATE 等不經觸發器的操作會讓計數失準）
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_pending_users_display_name
-            ON pending_users (line_display_name)
+            INSERT INTO table_counts (name, row_count)
+            SELECT 'members', COUNT(*) FROM members
+            ON CONFLICT (name) DO UPDATE SET row_count = EXCLUDED.row_count
         ''')
     print("資料庫初始化完成")
 
 
+def _load_member_directory():
+    """載入成員名錄，回傳 (版本號, 全部成員)"""
+    with get_db_cursor() as cursor:
+        # 先讀版本號再讀資料：兩者之間若有寫入，只會造成多一次重新載入
+        cursor.execute("SELECT version FROM cache_versions WHERE name = 'members'")
+        version = cursor.fetchone()['version']
+        cursor.execute('SELECT * FROM members')
+        return version, cursor.fetchall()
+
+
+def _load_admin_ids():
+    """載入管理員快取，回傳 (版本號, 管理員 LINE user ID 列表)"""
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT version FROM cache_versions WHERE name = 'members'")
+        version = cursor.fetchone()['version']
+        cursor.execute('SELECT line_user_id FROM members WHERE is_admin = TRUE')
+        return version, [row['line_user_id'] for row in cursor.fetchall()]
+
+
+def _read_members_version():
+    """讀取 members 的快取版本號"""
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT version FROM cache_versions WHERE name = 'members'")
+        return cursor.fetchone()['version']
+
+
+members_feed = member_cache.ChangeFeed(DATABASE_URL, member_cache.MEMBERS_CHANNEL)
+member_directory = member_cache.MemberDirectory(
+    _load_member_directory,
+    _read_members_version,
+    feed=members_feed,
+    version_check_interval=MEMBER_DIRECTORY_VERSION_CHECK
+) if MEMBER_DIRECTORY_ENABLED else None
+admin_cache = member_cache.AdminSet(
+    _load_admin_ids,
+    _read_members_version,
+    feed=members_feed,
+    version_check_interval=MEMBER_DIRECTORY_VERSION_CHECK
+) if ADMIN_CACHE_ENABLED else None
+
+
+def invalidate_member_caches():
+    """清除本行程的成員快取（其他 worker 由 NOTIFY 通知）"""
+    if member_directory is not None:
+        member_directory.invalidate()
+    if admin_cache is not None:
+        admin_cache.invalidate()
+
+
+def close_member_caches():
+    """停止變更通知的背景連線（worker 結束時呼叫）"""
+    members_feed.stop()
+
+
+def _cache_lookups():
+    caches = {'member_directory': member_directory, 'admin': admin_cache}
+    values = {}
+    for name, cache in caches.items():
+        if cache is not None:
+            stats = cache.stats()
+            values[(name, 'hit')] = stats['hits']
+            values[(name, 'miss')] = stats['misses']
+    return values
+
+
+# 連線池與成員快取的統計，輸出 /metrics 時才讀取
+metrics.CallbackMetric(
+    'linebot_db_pool_connections', '連線池連線數', 'gauge',
+    lambda: {(state,): get_pool_stats().get(state, 0) for state in ('in_use', 'idle', 'waiting')},
+    ['state']
+)
+metrics.CallbackMetric(
+    'linebot_db_pool_events_total', '連線池事件數', 'counter',
+    lambda: {(event,): get_pool_stats().get(event, 0) for event in ('checkouts', 'timeouts', 'discarded')},
+    ['event']
+)
+metrics.CallbackMetric(
+    'linebot_db_pool_wait_seconds_total', '等待連線池連線的累計秒數', 'counter',
+    lambda: get_pool_stats().get('wait_time_total', 0)
+)
+metrics.CallbackMetric(
+    'linebot_member_cache_lookups_total', '成員快取查詢數', 'counter', _cache_lookups, ['cache', 'result']
+)
+
+# 記錄各函式執行時間、失敗數與執行中數量的裝飾器
+_db_call = metrics.instrument(metrics.DB_CALL_SECONDS, metrics.DB_CALL_ERRORS, metrics.DB_CALL_INFLIGHT)
+
+
+def _invalidates_members(func):
+    """寫入 members 的函式完成（交易已提交）後清除本行程的成員快取"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            invalidate_member_caches()
+    return wrapper
+
+
+def _find_exact_members_cached(query: str):
+    """
+    從成員名錄以遊戲名稱、再以 LINE 名稱精確查詢（比對鍵相同即相符）
+    回傳: (是否可信, 最優先相符的成員列表)；未啟用名錄或無法確認時回傳 (False, [])
+    """
+    if member_directory is None:
+        return False, []
+    trusted, members = member_directory.find_by_game_name(query)
+    if trusted and not members:
+        trusted, members = member_directory.find_by_display_name(query)
+    if not trusted:
+        return False, []
+    return True, sorted(members, key=lambda m: m['id'])[:RESOLVE_CANDIDATE_LIMIT]
+
+
+def _resolve_member(cursor, query: str, fuzzy: bool = False) -> list:
+    """
+    以單一查詢依優先順序解析成員（皆以名稱比對鍵比較）：
+    遊戲名稱完全相符 > LINE 名稱完全相符 > 開頭相符 > 包含（後兩者僅 fuzzy=True）
+    完全相符走索引查詢，有結果時不再執行模糊比對
+    回傳: 最優先順序中的所有成員（最多 RESOLVE_CANDIDATE_LIMIT 筆），超過一筆表示有歧義
+    """
+    fuzzy_query = '''
+        UNION ALL
+        SELECT *,
+            CASE
+                WHEN game_name_key LIKE %(prefix)s OR line_display_name_key LIKE %(prefix)s THEN 2
+                ELSE 3
+            END
+        FROM members
+        WHERE NOT EXISTS (SELECT 1 FROM exact)
+          AND (game_name_key LIKE %(contains)s OR line_display_name_key LIKE %(contains)s)
+    ''' if fuzzy else ''
+
+    key = name_keys.name_key(query)
+    cursor.execute(f'''
+        WITH exact AS (
+            SELECT *, CASE WHEN game_name_key = %(key)s THEN 0 ELSE 1 END AS match_rank
+            FROM members
+            WHERE game_name_key = %(key)s OR line_display_name_key = %(key)s
+        ), ranked AS (
+            SELECT * FROM exact
+            {fuzzy_query}
+        )
+        SELECT * FROM ranked
+        WHERE match_rank = (SELECT MIN(match_rank) FROM ranked)
+        ORDER BY id
+        LIMIT %(limit)s
+    ''', {
+        'key': key,
+        'prefix': _like_pattern(key, prefix=True),
+        'contains': _like_pattern(key),
+        'limit': RESOLVE_CANDIDATE_LIMIT
+    })
+    return cursor.fetchall()
+
+
+def _ambiguous_result(query: str, candidates: list, name_key: str = 'game_name') -> dict:
+    """多筆成員符合時的回傳內容，列出候選名單請使用者改用更完整的名稱"""
+    lines = [f"• {c['line_display_name']}（{c[name_key]}）" for c in candidates]
+    if len(candidates) >= RESOLVE_CANDIDATE_LIMIT:
+        lines.append("…")
+    return {
+        'success': False,
+        'message': f"有多位成員符合「{query}」，請改用完整的遊戲名稱：\n" + "\n".join(lines)
+    }
+
+
+@_db_call
+@_invalidates_members
 def register_member(line_user_id: str, line_display_name: str, game_name: str) -> dict:
     """
-    登記新成員
+    登記新成員（單一 SQL 完成檢查與新增）
     回傳: {'success': bool, 'message': str}
     """
-    with get_db_cursor() as cursor:
-        # 檢查是否已登記
-        cursor.execute(
-            'SELECT * FROM members WHERE line_user_id = %s',
-            (line_user_id,)
-        )
-        existing = cursor.fetchone()
-
-        if existing:
+    # 同時有人登記相同名稱時 ON CONFLICT 會略過新增，
+    # 此時對方已提交，重新執行一次即可得到正確的結果
+    for _ in range(2):
+        with get_db_cursor() as cursor:
+            cursor.execute('''
+                WITH existing AS (
+                    SELECT game_name FROM members WHERE line_user_id = %(user_id)s
+                ), taken AS (
+                    SELECT 1 FROM members
+                    WHERE game_name_key = name_key(%(game_name)s)
+                    LIMIT 1
+                ), inserted AS (
+                    INSERT INTO members (line_user_id, line_display_name, game_name)
+                    SELECT %(user_id)s, %(display_name)s, %(game_name)s
+                    WHERE NOT EXISTS (SELECT 1 FROM existing)
+                      AND NOT EXISTS (SELECT 1 FROM taken)
+                    ON CONFLICT DO NOTHING
+                    RETURNING id
+                )
+                SELECT
+                    (SELECT game_name FROM existing) AS existing_game_name,
+                    EXISTS (SELECT 1 FROM taken) AS name_taken,
+                    EXISTS (SELECT 1 FROM inserted) AS inserted
+            ''', {
+                'user_id': line_user_id,
+                'display_name': line_display_name,
+                'game_name': game_name
+            })
+            result = cursor.fetchone()
+
+        if result['existing_game_name'] is not None:
             return {
                 'success': False,
-                'message': f"你已經登記過了！\n目前綁定的遊戲名稱：{existing['game_name']}\n如需修改請使用 /修改 [新遊戲名稱]"
+                'message': f"你已經登記過了！\n目前綁定的遊戲名稱：{result['existing_game_name']}\n如需修改請使用 /修改 [新遊戲名稱]"
             }
 
-        # 檢查遊戲名稱是否被使用
-        cursor.execute(
-            'SELECT * FROM members WHERE game_name = %s',
-            (game_name,)
-        )
-        if cursor.fetchone():
+        if result['name_taken']:
             return {
                 'success': False,
                 'message': f"遊戲名稱「{game_name}」已被其他人使用！"
             }
 
-        # 新增成員
-        cursor.execute('''
-            INSERT INTO members (line_user_id, line_display_name, game_name)
-            VALUES (%s, %s, %s)
-        ''', (line_user_id, line_display_name, game_name))
+        if result['inserted']:
+            return {
+                'success': True,
+                'message': f"登記成功！\nLINE 名稱：{line_display_name}\n遊戲名稱：{game_name}"
+            }
 
-        return {
-            'success': True,
-            'message': f"登記成功！\nLINE 名稱：{line_display_name}\n遊戲名稱：{game_name}"
-        }
+    return {
+        'success': False,
+        'message': f"遊戲名稱「{game_name}」已被其他人使用！"
+    }
 
 
+@_db_call
+@_invalidates_members
 def update_game_name(line_user_id: str, new_game_name: str) -> dict:
     """
-    修改遊戲名稱
+    修改遊戲名稱（單一 SQL 完成檢查與更新）
     回傳: {'success': bool, 'message': str}
     """
-    with get_db_cursor() as cursor:
-        # 檢查是否已登記
-        cursor.execute(
-            'SELECT * FROM members WHERE line_user_id = %s',
-            (line_user_id,)
-        )
-        existing = cursor.fetchone()
-
-        if not existing:
-            return {
-                'success': False,
-                'message': "你尚未登記！請先使用 /登記 [遊戲名稱]"
-            }
-
-        # 檢查新遊戲名稱是否被使用
-        cursor.execute(
-            'SELECT * FROM members WHERE game_name = %s AND line_user_id != %s',
-            (new_game_name, line_user_id)
-        )
-        if cursor.fetchone():
-            return {
-                'success': False,
-                'message': f"遊戲名稱「{new_game_name}」已被其他人使用！"
-            }
-
-        old_name = existing['game_name']
-
-        # 更新遊戲名稱
-        cursor.execute('''
-            UPDATE members
-            SET game_name = %s, updated_at = NOW()
-            WHERE line_user_id = %s
-        ''', (new_game_name, line_user_id))
+    try:
+        with get_db_cursor() as cursor:
+            cursor.execute('''
+                WITH old AS (
+                    SELECT id, game_name FROM members
+                    WHERE line_user_id = %(user_id)s
+                    FOR UPDATE
+                ), taken AS (
+                    SELECT 1 FROM members
+                    WHERE game_name_key = name_key(%(game_name)s)
+                      AND line_user_id != %(user_id)s
+                    LIMIT 1
+                ), updated AS (
+                    UPDATE members m
+                    SET game_name = %(game_name)s, updated_at = NOW()
+                    FROM old
+                    WHERE m.id = old.id
+                      AND NOT EXISTS (SELECT 1 FROM taken)
+                    RETURNING m.id
+                )
+                SELECT
+                    (SELECT game_name FROM old) AS old_game_name,
+                    EXISTS (SELECT 1 FROM taken) AS name_taken,
+                    EXISTS (SELECT 1 FROM updated) AS updated
+            ''', {'user_id': line_user_id, 'game_name': new_game_name})
+            result = cursor.fetchone()
+    except psycopg2.errors.UniqueViolation:
+        # 檢查之後、更新之前有人搶先使用了這個名稱
+        result = {'old_game_name': True, 'name_taken': True, 'updated': False}
+
+    if result['old_game_name'] is None:
+        return {
+            'success': False,
+            'message': "你尚未登記！請先使用 /登記 [遊戲名稱]"
+        }
 
+    if result['name_taken'] or not result['updated']:
         return {
-            'success': True,
-            'message': f"修改成功！\n舊遊戲名稱：{old_name}\n新遊戲名稱：{new_game_name}"
+            'success': False,
+            'message': f"遊戲名稱「{new_game_name}」已被其他人使用！"
         }
 
+    return {
+        'success': True,
+        'message': f"修改成功！\n舊遊戲名稱：{result['old_game_name']}\n新遊戲名稱：{new_game_name}"
+    }
+
 
-def search_member(query: str) -> list:
+@_db_call
+def search_member(query: str, limit: int = SEARCH_RESULT_LIMIT) -> list:
     """
-    模糊搜尋成員
+    模糊搜尋成員（以名稱比對鍵比較，不分全形半形、大小寫與繁簡）
+    依相關程度排序：完全相同 > 開頭相同 > 包含關鍵字，最多回傳 limit 筆
     回傳: 符合條件的成員列表
     """
+    key = name_keys.name_key(query)
     with get_db_cursor() as cursor:
         cursor.execute('''
             SELECT line_display_name, game_name
             FROM members
-            WHERE line_display_name ILIKE %s OR game_name ILIKE %s
-            ORDER BY game_name
-        ''', (f'%{query}%', f'%{query}%'))
+            WHERE line_display_name_key LIKE %(pattern)s OR game_name_key LIKE %(pattern)s
+            ORDER BY
+                CASE
+                    WHEN game_name_key = %(key)s
+                      OR line_display_name_key = %(key)s THEN 0
+                    WHEN game_name_key LIKE %(prefix)s
+                      OR line_display_name_key LIKE %(prefix)s THEN 1
+                    ELSE 2
+                END,
+                game_name
+            LIMIT %(limit)s
+        ''', {
+            'key': key,
+            'pattern': _like_pattern(key),
+            'prefix': _like_pattern(key, prefix=True),
+            'limit': limit
+        })
         return cursor.fetchall()
 
 
+@_db_call
 def get_all_members(page: int = 1, per_page: int = 20) -> dict:
     """
     取得所有成員（分頁）
     回傳: {'members': list, 'total': int, 'page': int, 'total_pages': int}
     """
     with get_db_cursor() as cursor:
-        # 取得總數
-        cursor.execute('SELECT COUNT(*) as count FROM members')
+        # 取得總數（觸發器維護的計數器）
+        cursor.execute("SELECT row_count AS count FROM table_counts WHERE name = 'members'")
         total = cursor.fetchone()['count']
 
         total_pages = (total + per_page - 1) // per_page if total > 0 else 1
@@ -185,7 +875,7 @@ def get_all_members(page: int = 1, per_page: int = 20) -> dict:
 
         # 取得分頁資料
         cursor.execute('''
-            SELECT line_display_name, game_name
+            SELECT id, line_display_name, game_name
             FROM members
             ORDER BY id
             LIMIT %s OFFSET %s
@@ -200,10 +890,101 @@ def get_all_members(page: int = 1, per_page: int = 20) -> dict:
         }
 
 
+@_db_call
+def get_members_page(after_id: int = None, before_id: int = None, per_page: int = 20) -> dict:
+    """
+    取得一頁成員（以 id 做 keyset 分頁，不使用 OFFSET）
+    after_id：取 id 大於此值的下一頁；before_id：取 id 小於此值的上一頁；皆未指定時取第一頁
+    回傳: {'members': list, 'total': int, 'first_id': int, 'last_id': int,
+           'has_prev': bool, 'has_next': bool}
+    """
+    if before_id is not None:
+        condition, order = 'id < %(cursor)s', 'DESC'
+    elif after_id is not None:
+        condition, order = 'id > %(cursor)s', 'ASC'
+    else:
+        condition, order = 'TRUE', 'ASC'
+
+    with get_db_cursor() as cursor:
+        # 總數與分頁資料一次取回；多取一筆判斷是否還有下一頁（或上一頁）
+        cursor.execute(f'''
+            WITH page AS (
+                SELECT id, line_display_name, game_name
+                FROM members
+                WHERE {condition}
+                ORDER BY id {order}
+                LIMIT %(limit)s
+            )
+            SELECT t.row_count AS total, page.*
+            FROM table_counts t
+            LEFT JOIN page ON TRUE
+            WHERE t.name = 'members'
+            ORDER BY page.id
+        ''', {'cursor': before_id if before_id is not None else after_id, 'limit': per_page + 1})
+        rows = cursor.fetchall()
+
+    total = rows[0]['total'] if rows else 0
+    members = [
+        {'id': row['id'], 'line_display_name': row['line_display_name'], 'game_name': row['game_name']}
+        for row in rows if row['id'] is not None
+    ]
+    has_more = len(members) > per_page
+
+    if before_id is not None:
+        members = members[-per_page:] if has_more else members
+        has_prev, has_next = has_more, True
+    else:
+        members = members[:per_page]
+        has_prev, has_next = after_id is not None, has_more
+
+    return {
+        'members': members,
+        'total': total,
+        'first_id': members[0]['id'] if members else None,
+        'last_id': members[-1]['id'] if members else None,
+        'has_prev': has_prev,
+        'has_next': has_next
+    }
+
+
+@_db_call
+def get_member_count() -> int:
+    """取得成員總數（觸發器維護的計數器）"""
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT row_count AS count FROM table_counts WHERE name = 'members'")
+        return cursor.fetchone()['count']
+
+
+@_db_call
+def iter_members(after_id: int = None, batch_size: int = 500):
+    """
+    依 id 順序逐批讀取成員（伺服器端游標），記憶體用量不隨名冊大小增加
+    after_id：只讀取 id 大於此值的成員
+    提前停止迭代時會結束交易並歸還連線
+    執行時間記錄的是整段迭代（從開始讀取到迭代結束或 close()）
+    """
+    with get_db_cursor(name='iter_members') as cursor:
+        cursor.itersize = batch_size
+        cursor.execute('''
+            SELECT id, line_display_name, game_name
+            FROM members
+            WHERE id > %s
+            ORDER BY id
+        ''', (after_id or 0,))
+        for row in cursor:
+            yield row
+
+
+@_db_call
 def get_member_by_user_id(line_user_id: str) -> dict:
     """
-    透過 LINE user ID 取得成員資料
+    透過 LINE user ID 取得成員資料（啟用成員名錄時不查資料庫）
     """
+    if member_directory is not None:
+        trusted, member = member_directory.get_by_user_id(line_user_id)
+        if trusted:
+            return member
+
     with get_db_cursor() as cursor:
         cursor.execute(
             'SELECT * FROM members WHERE line_user_id = %s',
@@ -212,18 +993,36 @@ def get_member_by_user_id(line_user_id: str) -> dict:
         return cursor.fetchone()
 
 
+@_db_call
+@_invalidates_members
 def delete_member(query: str) -> dict:
     """
-    刪除成員（透過遊戲名稱或 LINE 名稱）
+    刪除成員（透過遊戲名稱或 LINE 名稱精確比對，比對鍵相同即相符）
     回傳: {'success': bool, 'message': str}
     """
+    trusted, candidates = _find_exact_members_cached(query)
+    if trusted and not candidates:
+        return {
+            'success': False,
+            'message': f"找不到成員「{query}」"
+        }
+
     with get_db_cursor() as cursor:
-        # 尋找成員
-        cursor.execute('''
-            SELECT * FROM members
-            WHERE game_name = %s OR line_display_name = %s
-        ''', (query, query))
-        member = cursor.fetchone()
+        if not trusted:
+            candidates = _resolve_member(cursor, query)
+
+        if len(candidates) > 1:
+            return _ambiguous_result(query, candidates)
+
+        member = None
+        if candidates:
+            # 刪除時再次比對名稱，以防名錄過期
+            cursor.execute('''
+                DELETE FROM members
+                WHERE id = %(id)s AND (game_name_key = %(key)s OR line_display_name_key = %(key)s)
+                RETURNING *
+            ''', {'id': candidates[0]['id'], 'key': name_keys.name_key(query)})
+            member = cursor.fetchone()
 
         if not member:
             return {
@@ -231,89 +1030,115 @@ def delete_member(query: str) -> dict:
                 'message': f"找不到成員「{query}」"
             }
 
-        # 刪除成員
-        cursor.execute(
-            'DELETE FROM members WHERE id = %s',
-            (member['id'],)
-        )
-
         return {
             'success': True,
             'message': f"已刪除成員\nLINE 名稱：{member['line_display_name']}\n遊戲名稱：{member['game_name']}"
         }
 
 
+@_db_call
 def is_admin(line_user_id: str) -> bool:
     """
-    檢查使用者是否為管理員
+    檢查使用者是否為管理員（啟用管理員快取時不查資料庫）
     """
-    member = get_member_by_user_id(line_user_id)
-    return member and member['is_admin']
+    if admin_cache is not None:
+        trusted, result = admin_cache.is_admin(line_user_id)
+        if trusted:
+            return result
+
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            'SELECT is_admin FROM members WHERE line_user_id = %s',
+            (line_user_id,)
+        )
+        member = cursor.fetchone()
+        return bool(member and member['is_admin'])
 
 
+@_db_call
+@_invalidates_members
 def set_admin(query: str) -> dict:
     """
-    設定管理員（透過遊戲名稱或 LINE 名稱）
+    設定管理員（透過遊戲名稱或 LINE 名稱，找不到精確相符時模糊搜尋）
     回傳: {'success': bool, 'message': str}
     """
-    with get_db_cursor() as cursor:
-        # 先用遊戲名稱精確搜尋
-        cursor.execute(
-            'SELECT * FROM members WHERE game_name = %s',
-            (query,)
-        )
-        member = cursor.fetchone()
+    trusted, candidates = _find_exact_members_cached(query)
 
-        # 如果找不到，用 LINE 名稱精確搜尋
-        if not member:
-            cursor.execute(
-                'SELECT * FROM members WHERE line_display_name = %s',
-                (query,)
-            )
-            member = cursor.fetchone()
+    with get_db_cursor() as cursor:
+        if not candidates:
+            candidates = _resolve_member(cursor, query, fuzzy=True)
 
-        # 如果還是找不到，用模糊搜尋
-        if not member:
-            cursor.execute(
-                '''SELECT * FROM members
-                   WHERE game_name ILIKE %s OR line_display_name ILIKE %s
-                   LIMIT 1''',
-                (f'%{query}%', f'%{query}%')
-            )
-            member = cursor.fetchone()
+        if len(candidates) > 1:
+            return _ambiguous_result(query, candidates)
 
-        if not member:
+        if not candidates:
             return {
                 'success': False,
                 'message': f"找不到「{query}」的成員"
             }
 
+        member = candidates[0]
         if member['is_admin']:
             return {
                 'success': False,
                 'message': f"「{member['line_display_name']}」已經是幹部了"
             }
 
-        # 設定為管理員
+        # 設定為管理員；名錄的資料可能過期，更新時確認成員仍存在且名稱未變
         cursor.execute('''
             UPDATE members
             SET is_admin = TRUE, updated_at = NOW()
-            WHERE id = %s
-        ''', (member['id'],))
+            WHERE id = %s AND game_name = %s
+            RETURNING *
+        ''', (member['id'], member['game_name']))
+        updated = cursor.fetchone()
+
+        if not updated:
+            return {
+                'success': False,
+                'message': f"找不到「{query}」的成員"
+            }
 
         return {
             'success': True,
-            'message': f"已將「{member['line_display_name']}」設為幹部\n遊戲名稱：{member['game_name']}"
+            'message': f"已將「{updated['line_display_name']}」設為幹部\n遊戲名稱：{updated['game_name']}"
         }
 
 
+@_db_call
 def get_admin_count() -> int:
-    """取得管理員數量"""
+    """取得管理員數量（啟用管理員快取時不查資料庫）"""
+    if admin_cache is not None:
+        trusted, count = admin_cache.count()
+        if trusted:
+            return count
+
     with get_db_cursor() as cursor:
         cursor.execute('SELECT COUNT(*) as count FROM members WHERE is_admin = TRUE')
         return cursor.fetchone()['count']
 
 
+@_db_call
+@_invalidates_members
+def claim_first_admin(line_user_id: str) -> bool:
+    """
+    尚無任何管理員時，將該成員設為第一位管理員
+    回傳: 是否設定成功（未登記或已有管理員時回傳 False）
+    """
+    with get_db_cursor() as cursor:
+        # 依序處理，避免兩人同時成為「第一位」管理員
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('linebot_first_admin'))")
+        cursor.execute('''
+            UPDATE members
+            SET is_admin = TRUE, updated_at = NOW()
+            WHERE line_user_id = %s
+              AND NOT EXISTS (SELECT 1 FROM members WHERE is_admin = TRUE)
+            RETURNING id
+        ''', (line_user_id,))
+        return cursor.fetchone() is not None
+
+
+@_db_call
 def get_all_admins() -> list:
     """取得所有幹部列表"""
     with get_db_cursor() as cursor:
@@ -326,84 +1151,128 @@ def get_all_admins() -> list:
         return cursor.fetchall()
 
 
+@_db_call
+@_invalidates_members
 def register_by_admin(line_display_name: str, game_name: str = None, set_as_admin: bool = False) -> dict:
     """
     管理員代為登記成員（透過 LINE 名稱）
     game_name 為 None 時，使用 LINE 名稱作為遊戲名稱
     回傳: {'success': bool, 'message': str}
     """
+    key = name_keys.name_key(line_display_name)
     with get_db_cursor() as cursor:
-        # 從最近發過訊息的用戶中尋找（透過已記錄的 line_display_name）
-        # 先檢查是否有這個 LINE 名稱的未登記用戶記錄
-        cursor.execute(
-            'SELECT * FROM pending_users WHERE line_display_name = %s ORDER BY last_seen DESC LIMIT 1',
-            (line_display_name,)
-        )
-        pending_user = cursor.fetchone()
-
-        if not pending_user:
-            # 模糊搜尋
-            cursor.execute(
-                'SELECT * FROM pending_users WHERE line_display_name ILIKE %s ORDER BY last_seen DESC LIMIT 1',
-                (f'%{line_display_name}%',)
+        # 從最近發過訊息的用戶中尋找（以名稱比對鍵比較）：LINE 名稱完全相符 > 開頭相符 > 包含，
+        # 完全相符時不再執行模糊比對；同時帶出是否已登記與遊戲名稱是否已被使用
+        cursor.execute('''
+            WITH exact AS (
+                SELECT *, 0 AS match_rank
+                FROM pending_users
+                WHERE line_display_name_key = %(key)s
+            ), ranked AS (
+                SELECT * FROM exact
+                UNION ALL
+                SELECT *,
+                    CASE WHEN line_display_name_key LIKE %(prefix)s THEN 1 ELSE 2 END
+                FROM pending_users
+                WHERE NOT EXISTS (SELECT 1 FROM exact)
+                  AND line_display_name_key LIKE %(contains)s
             )
-            pending_user = cursor.fetchone()
-
-        if not pending_user:
+            SELECT
+                p.line_user_id,
+                p.line_display_name,
+                p.line_display_name_key,
+                p.match_rank,
+                m.id AS member_id,
+                m.game_name AS member_game_name,
+                m.is_admin AS member_is_admin,
+                EXISTS (
+                    SELECT 1 FROM members t
+                    WHERE t.game_name_key = COALESCE(name_key(%(game_name)s), p.line_display_name_key)
+                ) AS name_taken
+            FROM ranked p
+            LEFT JOIN members m ON m.line_user_id = p.line_user_id
+            WHERE p.match_rank = (SELECT MIN(match_rank) FROM ranked)
+            ORDER BY p.last_seen DESC
+            LIMIT %(limit)s
+        ''', {
+            'key': key,
+            'prefix': _like_pattern(key, prefix=True),
+            'contains': _like_pattern(key),
+            'game_name': game_name,
+            # 多取一筆以判斷符合的用戶是否超過上限
+            'limit': RESOLVE_CANDIDATE_LIMIT + 1
+        })
+        candidates = cursor.fetchall()
+
+        if not candidates:
             return {
                 'success': False,
                 'message': f"找不到「{line_display_name}」\n請確認該用戶已在群組中發過訊息"
             }
 
+        # 符合的用戶超過上限時無法確認沒有其他名稱的用戶，不自行挑選，請管理員輸入更完整的名稱
+        if len(candidates) > RESOLVE_CANDIDATE_LIMIT:
+            lines = [f"• {c['line_display_name']}" for c in candidates[:RESOLVE_CANDIDATE_LIMIT]]
+            return {
+                'success': False,
+                'message': f"符合「{line_display_name}」的用戶過多，請輸入完整的 LINE 名稱：\n" + "\n".join(lines + ["…"])
+            }
+
+        # 模糊比對到不同名稱的用戶時請管理員指定；比對鍵相同的同名用戶取最近發言者
+        if len({c['line_display_name_key'] for c in candidates}) > 1:
+            lines = [f"• {c['line_display_name']}" for c in candidates]
+            return {
+                'success': False,
+                'message': f"有多位用戶符合「{line_display_name}」，請輸入完整的 LINE 名稱：\n" + "\n".join(lines)
+            }
+
+        pending_user = candidates[0]
+
         # 如果沒有提供遊戲名稱，使用 LINE 名稱
         actual_game_name = game_name if game_name else pending_user['line_display_name']
 
-        # 檢查是否已登記
-        cursor.execute(
-            'SELECT * FROM members WHERE line_user_id = %s',
-            (pending_user['line_user_id'],)
-        )
-        existing_member = cursor.fetchone()
-
-        if existing_member:
+        if pending_user['member_id'] is not None:
             # 已登記，如果是要設為幹部就直接更新
             if set_as_admin:
-                if existing_member['is_admin']:
+                if pending_user['member_is_admin']:
                     return {
                         'success': False,
                         'message': f"「{pending_user['line_display_name']}」已經是幹部了"
                     }
                 cursor.execute('''
                     UPDATE members SET is_admin = TRUE, updated_at = NOW()
-                    WHERE line_user_id = %s
-                ''', (pending_user['line_user_id'],))
+                    WHERE id = %s
+                ''', (pending_user['member_id'],))
                 return {
                     'success': True,
-                    'message': f"已將「{pending_user['line_display_name']}」設為幹部\n遊戲名稱：{existing_member['game_name']}"
+                    'message': f"已將「{pending_user['line_display_name']}」設為幹部\n遊戲名稱：{pending_user['member_game_name']}"
                 }
             else:
                 return {
                     'success': False,
-                    'message': f"「{pending_user['line_display_name']}」已經登記過了\n遊戲名稱：{existing_member['game_name']}"
+                    'message': f"「{pending_user['line_display_name']}」已經登記過了\n遊戲名稱：{pending_user['member_game_name']}"
                 }
 
-        # 檢查遊戲名稱是否被使用
-        cursor.execute(
-            'SELECT * FROM members WHERE game_name = %s',
-            (actual_game_name,)
-        )
-        if cursor.fetchone():
+        if pending_user['name_taken']:
             return {
                 'success': False,
                 'message': f"遊戲名稱「{actual_game_name}」已被其他人使用"
             }
 
-        # 新增成員
+        # 新增成員；查詢之後才有人搶先登記時 ON CONFLICT 會略過
         cursor.execute('''
             INSERT INTO members (line_user_id, line_display_name, game_name, is_admin)
             VALUES (%s, %s, %s, %s)
+            ON CONFLICT DO NOTHING
+            RETURNING id
         ''', (pending_user['line_user_id'], pending_user['line_display_name'], actual_game_name, set_as_admin))
 
+        if not cursor.fetchone():
+            return {
+                'success': False,
+                'message': f"「{pending_user['line_display_name']}」已經登記過，或遊戲名稱「{actual_game_name}」已被其他人使用"
+            }
+
         admin_text = "（已設為幹部）" if set_as_admin else ""
         return {
             'success': True,
@@ -411,6 +1280,7 @@ def register_by_admin(line_display_name: str, game_name: str = None, set_as_admi
         }
 
 
+@_db_call
 def record_pending_user(line_user_id: str, line_display_name: str):
     """
     記錄發過訊息但未登記的用戶（供代登記使用）
@@ -424,6 +1294,8 @@ def record_pending_user(line_user_id: str, line_display_name: str):
         ''', (line_user_id, line_display_name, line_display_name))
 
 
+@_db_call
+@_invalidates_members
 def sync_display_name(line_user_id: str, current_display_name: str) -> bool:
     """
     同步 LINE 顯示名稱（如果有變更則更新）
@@ -445,3 +1317,101 @@ def sync_display_name(line_user_id: str, current_display_name: str) -> bool:
             return True
 
         return False
+
+
+@_db_call
+def record_presence(line_user_id: str, line_display_name: str) -> dict:
+    """
+    記錄用戶出現（合併 sync_display_name 與 record_pending_user，單一語句完成）
+    - members：只有顯示名稱變更時才更新
+    - pending_users：名稱變更或 last_seen 已超過 PRESENCE_FRESH_SECONDS 才改寫
+    回傳: {'name_synced': bool, 'pending_written': bool}
+    """
+    with get_db_cursor() as cursor:
+        cursor.execute('''
+            WITH synced AS (
+                UPDATE members
+                SET line_display_name = %(name)s, updated_at = NOW()
+                WHERE line_user_id = %(user_id)s
+                  AND line_display_name IS DISTINCT FROM %(name)s
+                RETURNING 1
+            ), pending AS (
+                INSERT INTO pending_users (line_user_id, line_display_name, last_seen)
+                VALUES (%(user_id)s, %(name)s, NOW())
+                ON CONFLICT (line_user_id)
+                DO UPDATE SET line_display_name = EXCLUDED.line_display_name,
+                              last_seen = EXCLUDED.last_seen
+                WHERE pending_users.line_display_name IS DISTINCT FROM EXCLUDED.line_display_name
+                   OR pending_users.last_seen < NOW() - make_interval(secs => %(fresh)s)
+                RETURNING 1
+            )
+            SELECT EXISTS (SELECT 1 FROM synced) AS name_synced,
+                   EXISTS (SELECT 1 FROM pending) AS pending_written
+        ''', {'user_id': line_user_id, 'name': line_display_name, 'fresh': PRESENCE_FRESH_SECONDS})
+        result = dict(cursor.fetchone())
+
+    if result['name_synced']:
+        invalidate_member_caches()
+    return result
+
+
+@_db_call
+def record_presence_batch(entries) -> dict:
+    """
+    一次記錄多位用戶出現（規則同 record_presence，整批以單一語句完成）
+    entries: [(line_user_id, line_display_name, seen_at)]
+      seen_at 為出現時間（Unix 秒，None = 現在），同一用戶出現多次時以最後一筆為準
+    回傳: {'names_synced': 更新名稱的成員數, 'pending_written': 改寫的 pending_users 筆數}
+    """
+    latest = {user_id: (user_id, name, seen_at) for user_id, name, seen_at in entries}
+    if not latest:
+        return {'names_synced': 0, 'pending_written': 0}
+    # 各 worker 同時寫入重疊的用戶時（寫回緩衝與 app.prepare_batch 都經過這裡），一律依 line_user_id 順序鎖定資料列，避免死結：
+    # members 先以 SELECT ... ORDER BY ... FOR UPDATE 依序鎖定要改名的成員再更新（UPDATE ... FROM 的鎖定順序取決於執行計畫），
+    # pending_users 依排序後的順序逐筆 INSERT ... ON CONFLICT
+    rows = sorted(latest.values())
+
+    query = sql.SQL('''
+        WITH incoming (line_user_id, line_display_name, last_seen) AS (
+            VALUES %s
+        ), locked AS (
+            SELECT m.line_user_id, i.line_display_name
+            FROM members m
+            JOIN incoming i ON i.line_user_id = m.line_user_id
+            WHERE m.line_display_name IS DISTINCT FROM i.line_display_name
+            ORDER BY m.line_user_id
+            FOR UPDATE OF m
+        ), synced AS (
+            UPDATE members m
+            SET line_display_name = l.line_display_name, updated_at = NOW()
+            FROM locked l
+            WHERE m.line_user_id = l.line_user_id
+              AND m.line_display_name IS DISTINCT FROM l.line_display_name
+            RETURNING 1
+        ), pending AS (
+            INSERT INTO pending_users (line_user_id, line_display_name, last_seen)
+            SELECT line_user_id, line_display_name, last_seen FROM incoming
+            ORDER BY line_user_id
+            ON CONFLICT (line_user_id)
+            DO UPDATE SET line_display_name = EXCLUDED.line_display_name,
+                          last_seen = GREATEST(pending_users.last_seen, EXCLUDED.last_seen)
+            WHERE pending_users.line_display_name IS DISTINCT FROM EXCLUDED.line_display_name
+               OR pending_users.last_seen < EXCLUDED.last_seen - make_interval(secs => {fresh})
+            RETURNING 1
+        )
+        SELECT (SELECT count(*) FROM synced) AS names_synced,
+               (SELECT count(*) FROM pending) AS pending_written
+    ''').format(fresh=sql.Literal(PRESENCE_FRESH_SECONDS))
+
+    with get_db_cursor() as cursor:
+        # page_size 設為總筆數，確保整批只送出一個語句
+        counts = execute_values(
+            cursor, query, rows,
+            template='(%s, %s, COALESCE(to_timestamp(%s::float8)::timestamp, NOW()::timestamp))',
+            page_size=len(rows), fetch=True
+        )
+        result = {key: int(value) for key, value in counts[0].items()}
+
+    if result['names_synced']:
+        invalidate_member_caches()
+    return result
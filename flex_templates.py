@@ -0,0 +1,234 @@
+"""
+Flex Message 模板模組
+訊息版面在模組載入時建立，並以 SDK 的模型驗證一次；之後每次只填入變動的欄位（名稱、頁碼、查詢結果）：
+- 模板中沒有欄位的部分直接共用，不再每次建立 FlexContainer（整棵 pydantic 模型樹）再轉回 JSON
+- 產生的 RenderedFlexMessage 內容就是送出時的 JSON 結構，回覆時直接放進請求（見 line_client.reply_call）
+- pack_rows() 依 JSON 大小把重複的列分配到最少的 bubble，超過一個 bubble 時組成 carousel，
+  不會送出超過 LINE 大小限制、被回 400 的訊息
+產生的內容與模板共用物件，視為唯讀，不要修改
+"""
+
+import json
+
+from linebot.v3.messaging import FlexContainer, FlexMessage
+
+# LINE 的 Flex Message 大小限制（以送出的 JSON 計算）
+FLEX_BUBBLE_MAX_BYTES = 30000
+FLEX_CAROUSEL_MAX_BYTES = 50000
+FLEX_CAROUSEL_MAX_BUBBLES = 12
+
+# json.dumps 預設格式中 list 元素之間的 ", "
+_SEPARATOR_SIZE = 2
+
+
+def json_size(value) -> int:
+    """
+    送出時的 JSON 大小（bytes）
+    與 SDK 相同使用 json.dumps 預設格式，非 ASCII 字元以 \\uXXXX 表示，因此字元數即 bytes
+    """
+    return len(json.dumps(value))
+
+
+class Slot:
+    """模板中的變動欄位；填入 None 時不輸出該鍵（例如沒有分頁按鈕時不輸出 footer）"""
+
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return f"Slot({self.name!r})"
+
+
+def _slot_names(node) -> list:
+    """模板中所有欄位名稱（依出現順序，可能重複）"""
+    if isinstance(node, Slot):
+        return [node.name]
+    if isinstance(node, dict):
+        node = node.values()
+    elif not isinstance(node, list):
+        return []
+    return [name for item in node for name in _slot_names(item)]
+
+
+def _compile(node):
+    """
+    將模板節點編譯成 render(values) 函式
+    節點中沒有欄位時回傳 None，表示直接共用原物件
+    """
+    if isinstance(node, Slot):
+        name = node.name
+        return lambda values: values[name]
+
+    if isinstance(node, dict):
+        renderers = [(key, _compile(value)) for key, value in node.items()]
+        renderers = [(key, render) for key, render in renderers if render is not None]
+        if not renderers:
+            return None
+
+        def render_dict(values):
+            result = dict(node)
+            for key, render in renderers:
+                value = render(values)
+                if value is None:
+                    del result[key]
+                else:
+                    result[key] = value
+            return result
+        return render_dict
+
+    if isinstance(node, list):
+        renderers = [_compile(item) for item in node]
+        if not any(renderers):
+            return None
+
+        def render_list(values):
+            return [item if render is None else render(values) for item, render in zip(node, renderers)]
+        return render_list
+
+    return None
+
+
+class FlexTemplate:
+    """
+    Flex 元件模板（整個 bubble 或其中重複的一列）
+    samples：建立時逐一填入並以 FlexContainer 驗證，轉回的 JSON 必須與填入結果相同
+    （欄位名稱打錯或型別不符時在載入時就拋出 ValueError，而不是送出後才被 LINE 拒絕）
+    重複的列不需要 samples，由所屬 bubble 的 samples 一併驗證
+    """
+
+    def __init__(self, template: dict, samples: list = None):
+        self.template = template
+        self._render = _compile(template)
+        self.slots = _slot_names(template)
+        self._measurable = len(set(self.slots)) == len(self.slots)
+        self._empty_size = None
+        for values in samples or ():
+            self.validate(values)
+
+    def render(self, **values) -> dict:
+        """填入欄位，回傳 JSON 結構（dict）"""
+        if self._render is None:
+            return self.template
+        return self._render(values)
+
+    def measure(self, **values) -> int:
+        """
+        填入後的 JSON 大小（bytes，同 json_size）
+        欄位皆為字串時由空白模板的大小加上各欄位的長度計算，不實際產生內容
+        """
+        if not self._measurable:
+            return json_size(self.render(**values))
+        if self._empty_size is None:
+            self._empty_size = json_size(self.render(**dict.fromkeys(self.slots, '')))
+        size = self._empty_size
+        for value in values.values():
+            if not isinstance(value, str):
+                return json_size(self.render(**values))
+            size += len(json.dumps(value)) - 2
+        return size
+
+    def validate(self, values: dict):
+        rendered = self.render(**values)
+        validated = FlexContainer.from_dict(rendered).to_dict()
+        if validated != rendered:
+            raise ValueError(f"Flex 模板與 SDK 模型不一致：{json.dumps(rendered, ensure_ascii=False)}")
+
+
+class RenderedFlexMessage:
+    """
+    已填好內容的 Flex Message
+    to_dict() 即送出的 JSON 結構（與 FlexMessage.to_dict() 相同），不經過 pydantic 驗證
+    """
+
+    __slots__ = ('alt_text', 'contents')
+
+    def __init__(self, alt_text: str, contents: dict):
+        self.alt_text = alt_text
+        self.contents = contents
+
+    def to_dict(self) -> dict:
+        return {'type': 'flex', 'altText': self.alt_text, 'contents': self.contents}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def to_message(self) -> FlexMessage:
+        """轉成 SDK 的 FlexMessage（需要直接呼叫 MessagingApi 的模型方法時使用）"""
+        return FlexMessage(alt_text=self.alt_text, contents=FlexContainer.from_dict(self.contents))
+
+
+CAROUSEL = FlexTemplate({
+    "type": "carousel",
+    "contents": Slot('bubbles')
+}, samples=[{'bubbles': [
+    {"type": "bubble", "body": {"type": "box", "layout": "vertical", "contents": [{"type": "text", "text": "1"}]}},
+    {"type": "bubble", "body": {"type": "box", "layout": "vertical", "contents": [{"type": "text", "text": "2"}]}}
+]}])
+
+_CAROUSEL_OVERHEAD = json_size(CAROUSEL.render(bubbles=[]))
+
+
+def pack_rows(row_sizes: list, bubble_overhead: int, max_messages: int = 1,
+              max_bubble_bytes: int = FLEX_BUBBLE_MAX_BYTES,
+              max_carousel_bytes: int = FLEX_CAROUSEL_MAX_BYTES,
+              max_bubbles: int = FLEX_CAROUSEL_MAX_BUBBLES) -> list:
+    """
+    將依序排列的列分配到最少的 bubble（列的順序不變，依序塞滿）
+    - 每個 bubble 不超過 max_bubble_bytes；每則訊息（單一 bubble 或 carousel）不超過
+      max_carousel_bytes 與 max_bubbles 個 bubble，最多 max_messages 則
+    row_sizes：每一列的 JSON 大小；bubble_overhead：沒有任何列時 bubble 的大小（含頁首、頁尾）
+    回傳: [[各 bubble 的列數, ...], ...]，每則訊息一個 list；放不下的列不計入（呼叫端以總列數判斷是否截斷）
+    """
+    messages = []
+    bubbles = []  # 目前訊息中已完成的 bubble（列數）
+    count = 0  # 目前 bubble 的列數
+    bubble_size = bubble_overhead
+    message_size = _CAROUSEL_OVERHEAD + bubble_overhead
+
+    for size in row_sizes:
+        added = size + (_SEPARATOR_SIZE if count else 0)
+        if bubble_size + added <= max_bubble_bytes and message_size + added <= max_carousel_bytes:
+            count += 1
+            bubble_size += added
+            message_size += added
+            continue
+
+        new_bubble = _SEPARATOR_SIZE + bubble_overhead + size
+        if (count and len(bubbles) + 1 < max_bubbles
+                and bubble_overhead + size <= max_bubble_bytes
+                and message_size + new_bubble <= max_carousel_bytes):
+            # 同一則訊息再加一個 bubble
+            bubbles.append(count)
+            count = 1
+            bubble_size = bubble_overhead + size
+            message_size += new_bubble
+            continue
+
+        if not count or len(messages) + 1 >= max_messages:
+            # 單獨一列就超過限制，或已沒有可用的訊息數
+            break
+
+        # 換下一則訊息
+        messages.append(bubbles + [count])
+        bubbles = []
+        count = 0
+        bubble_size = bubble_overhead
+        message_size = _CAROUSEL_OVERHEAD + bubble_overhead
+        if bubble_size + size > max_bubble_bytes or message_size + size > max_carousel_bytes:
+            break
+        count = 1
+        bubble_size += size
+        message_size += size
+
+    if count:
+        messages.append(bubbles + [count])
+    return messages
+
+
+def carousel_or_bubble(bubbles: list) -> dict:
+    """只有一個 bubble 時直接送出 bubble，否則組成 carousel"""
+    if len(bubbles) == 1:
+        return bubbles[0]
+    return CAROUSEL.render(bubbles=bubbles)
@@ -3,11 +3,18 @@
 回傳 LINE Message 物件（支援 Flex Message 和 Quick Reply）
 """
 
+import os
+import re
+from contextlib import closing
+
 import database as db
+from presence import presence_buffer
+from router import CommandRouter, CommandTimer, RateLimiter
 from messages import (
     create_menu_message,
     create_roster_message,
-    create_roster_text_message,
+    create_roster_text_messages,
+    fit_roster_members,
     create_search_result_message,
     create_profile_message,
     create_help_message,
@@ -18,7 +25,46 @@ from messages import (
 )
 from linebot.v3.messaging import TextMessage
 
+# 名冊每頁最多筆數（依訊息大小限制分成多個 bubble / carousel，名稱很長時實際筆數會較少）
+ROSTER_PAGE_SIZE = int(os.environ.get('ROSTER_PAGE_SIZE', 100))
+
+# 名冊分頁游標：「序號>最後一筆 id」為下一頁（序號為下一頁第一位），「序號<第一筆 id」為上一頁（序號為該位成員）
+ROSTER_CURSOR_PATTERN = re.compile(r'(\d+)([<>])(\d+)')
+
+# 指令路由；中介層由外而內為：計時 → 頻率限制 → 權限檢查
+router = CommandRouter(is_admin=db.is_admin)
+command_timer = CommandTimer()
+
+
+def require_admin(ctx, call_next):
+    """權限中介層：admin_only 的指令僅限管理員（同一次呼叫只查詢一次）"""
+    if ctx.command.admin_only and not ctx.is_admin:
+        return create_error_message(
+            "此指令僅限幹部使用",
+            quick_actions=[
+                {'label': '我的資料', 'text': '/我是誰'},
+                {'label': '查看說明', 'text': '/說明'}
+            ]
+        )
+    return call_next()
+
+
+def rate_limited():
+    """超過指令頻率限制時的回覆"""
+    return create_error_message(
+        "指令太頻繁了，請稍後再試",
+        quick_actions=[
+            {'label': '查看說明', 'text': '/說明'}
+        ]
+    )
+
 
+router.use(command_timer)
+router.use(RateLimiter(rate_limited))
+router.use(require_admin)
+
+
+@router.command('/登記', writes=True, needs_display_name=True)
 def handle_register(line_user_id: str, line_display_name: str, args: str):
     """處理 /登記 指令"""
     if not args:
@@ -59,6 +105,7 @@ def handle_register(line_user_id: str, line_display_name: str, args: str):
         )
 
 
+@router.command('/修改', writes=True)
 def handle_update(line_user_id: str, args: str):
     """處理 /修改 指令"""
     if not args:
@@ -99,6 +146,7 @@ def handle_update(line_user_id: str, args: str):
         )
 
 
+@router.command('/查詢')
 def handle_search(args: str):
     """處理 /查詢 指令"""
     if not args:
@@ -109,29 +157,38 @@ def handle_search(args: str):
         )
 
     query = args.strip()
-    results = db.search_member(query)
-
-    return create_search_result_message(query, results)
-
-
-def handle_roster(line_user_id: str, args: str):
-    """處理 /名冊 指令（僅限管理員）"""
-    if not db.is_admin(line_user_id):
+    if len(query) > 100:
         return create_error_message(
-            "此指令僅限幹部使用",
+            "查詢名稱過長（最多 100 字）",
             quick_actions=[
-                {'label': '我的資料', 'text': '/我是誰'},
+                {'label': '重新查詢', 'text': '/查詢'},
                 {'label': '查看說明', 'text': '/說明'}
             ]
         )
 
+    # 多取一筆以判斷結果是否被截斷
+    results = db.search_member(query, limit=db.SEARCH_RESULT_LIMIT + 1)
+    truncated = len(results) > db.SEARCH_RESULT_LIMIT
+
+    return create_search_result_message(query, results[:db.SEARCH_RESULT_LIMIT], truncated=truncated)
+
+
+@router.command('/名冊', admin_only=True)
+def handle_roster(args: str):
+    """處理 /名冊 指令（僅限管理員）"""
     show_all = False
     page = 1
+    cursor = None
 
     if args:
         args = args.strip()
-        if args in ['全部', '所有', 'all']:
+        parts = args.split()
+        if parts[0] in ['全部', '所有', 'all']:
             show_all = True
+            if len(parts) > 1 and ROSTER_CURSOR_PATTERN.fullmatch(parts[1]) and '>' in parts[1]:
+                cursor = ROSTER_CURSOR_PATTERN.fullmatch(parts[1]).groups()
+        elif ROSTER_CURSOR_PATTERN.fullmatch(args):
+            cursor = ROSTER_CURSOR_PATTERN.fullmatch(args).groups()
         else:
             try:
                 page = int(args)
@@ -139,34 +196,63 @@ def handle_roster(line_user_id: str, args: str):
                 pass
 
     if show_all:
-        # 取得所有成員，使用純文字訊息避免 Flex Message 大小限制
-        data = db.get_all_members(page=1, per_page=999999)
-        return create_roster_text_message(
-            members=data['members'],
-            total=data['total']
-        )
+        # 以伺服器端游標逐筆讀取，切成多則純文字訊息，超出部分用續看指令
+        start, after_id = (int(cursor[0]), int(cursor[2])) if cursor else (1, None)
+        total = db.get_member_count()
+        with closing(db.iter_members(after_id=after_id)) as members:
+            return create_roster_text_messages(members, total=total, start=max(1, start))
+
+    backward = cursor is not None and cursor[1] == '<'
+    if cursor is None and page > 1:
+        # 直接指定頁碼時使用 OFFSET 分頁，之後的上下頁按鈕改用游標
+        data = db.get_all_members(page=page, per_page=ROSTER_PAGE_SIZE)
+        members = data['members']
+        start = (data['page'] - 1) * ROSTER_PAGE_SIZE + 1
+        has_prev = start > 1
+        has_next = data['page'] < data['total_pages']
+    elif backward:
+        # 上一頁：游標中的序號是 id 那一位成員的序號，往前取一頁
+        data = db.get_members_page(before_id=int(cursor[2]), per_page=ROSTER_PAGE_SIZE)
+        members = data['members']
+        start = max(1, int(cursor[0]) - len(members))
+        has_prev = data['has_prev'] and start > 1
+        has_next = data['has_next']
     else:
-        data = db.get_all_members(page=page)
-        return create_roster_message(
-            members=data['members'],
-            page=data['page'],
-            total_pages=data['total_pages'],
-            total=data['total'],
-            show_all=False
-        )
+        if cursor is None:
+            data = db.get_members_page(per_page=ROSTER_PAGE_SIZE)
+            start = 1
+        else:
+            data = db.get_members_page(after_id=int(cursor[2]), per_page=ROSTER_PAGE_SIZE)
+            start = max(1, int(cursor[0]))
+        members = data['members']
+        has_prev = data['has_prev'] and start > 1
+        has_next = data['has_next']
+
+    total = data['total']
+
+    # 依訊息大小限制裁掉一次回覆放不下的成員（名稱很長時），改由分頁按鈕接續
+    fit = fit_roster_members(members, start, total, from_end=backward)
+    if fit < len(members):
+        if backward:
+            start += len(members) - fit
+            members = members[-fit:] if fit else []
+            has_prev = True
+        else:
+            members = members[:fit]
+            has_next = True
 
+    return create_roster_message(
+        members=members,
+        total=total,
+        start=start,
+        prev_cursor=f"{start}<{members[0]['id']}" if has_prev and members else None,
+        next_cursor=f"{start + len(members)}>{members[-1]['id']}" if has_next and members else None
+    )
 
-def handle_delete(line_user_id: str, args: str):
-    """處理 /刪除 指令（僅限管理員）"""
-    if not db.is_admin(line_user_id):
-        return create_error_message(
-            "此指令僅限管理員使用",
-            quick_actions=[
-                {'label': '查看說明', 'text': '/說明'},
-                {'label': '查看名冊', 'text': '/名冊'}
-            ]
-        )
 
+@router.command('/刪除', admin_only=True, writes=True)
+def handle_delete(args: str):
+    """處理 /刪除 指令（僅限管理員）"""
     if not args:
         return create_input_prompt_message(
             command="刪除成員",
@@ -195,7 +281,9 @@ def handle_delete(line_user_id: str, args: str):
         )
 
 
-def handle_set_admin(line_user_id: str, args: str):
+# 還沒有任何管理員時，第一位使用者可以自行成為管理員，因此不宣告 admin_only
+@router.command('/設定管理員', writes=True)
+def handle_set_admin(line_user_id: str, args: str, ctx):
     """處理 /設定管理員 指令（僅限管理員）"""
     admin_count = db.get_admin_count()
 
@@ -209,24 +297,18 @@ def handle_set_admin(line_user_id: str, args: str):
                 ]
             )
 
-        from database import get_db_cursor
-        with get_db_cursor() as cursor:
-            cursor.execute('''
-                UPDATE members
-                SET is_admin = TRUE, updated_at = NOW()
-                WHERE line_user_id = %s
-            ''', (line_user_id,))
-
-        return create_success_message(
-            title="你已成為第一位管理員！",
-            content="現在可以使用管理員指令了",
-            quick_actions=[
-                {'label': '查看名冊', 'text': '/名冊'},
-                {'label': '查看說明', 'text': '/說明'}
-            ]
-        )
+        # 已有其他人搶先成為第一位管理員時，改走一般的權限檢查
+        if db.claim_first_admin(line_user_id):
+            return create_success_message(
+                title="你已成為第一位管理員！",
+                content="現在可以使用管理員指令了",
+                quick_actions=[
+                    {'label': '查看名冊', 'text': '/名冊'},
+                    {'label': '查看說明', 'text': '/說明'}
+                ]
+            )
 
-    if not db.is_admin(line_user_id):
+    if not ctx.is_admin:
         return create_error_message(
             "此指令僅限管理員使用",
             quick_actions=[
@@ -262,22 +344,16 @@ def handle_set_admin(line_user_id: str, args: str):
         )
 
 
+@router.command('/我是誰', needs_display_name=True)
 def handle_whoami(line_user_id: str, line_display_name: str):
     """處理 /我是誰 指令"""
     member = db.get_member_by_user_id(line_user_id)
     return create_profile_message(member, line_display_name, member is not None)
 
 
-def handle_register_for(line_user_id: str, args: str):
+@router.command('/代登記', admin_only=True, writes=True)
+def handle_register_for(args: str):
     """處理 /代登記 指令（僅限管理員）"""
-    if not db.is_admin(line_user_id):
-        return create_error_message(
-            "此指令僅限幹部使用",
-            quick_actions=[
-                {'label': '查看說明', 'text': '/說明'}
-            ]
-        )
-
     if not args:
         return create_input_prompt_message(
             command="代登記",
@@ -319,6 +395,9 @@ def handle_register_for(line_user_id: str, args: str):
         game_name = parts[1]
         set_as_admin = parts[2] in ['幹部', '管理員', 'admin']
 
+    # 先寫入緩衝中的活動紀錄（更新 last_seen）；
+    # 第一次出現或改名的用戶在任何 worker 上都是立即寫入，不會因緩衝而查不到
+    presence_buffer.flush()
     result = db.register_by_admin(line_name, game_name, set_as_admin)
 
     if result['success']:
@@ -338,6 +417,7 @@ def handle_register_for(line_user_id: str, args: str):
         )
 
 
+@router.command('/幹部', aliases=['/幹部名單'])
 def handle_admin_list():
     """處理 /幹部 指令"""
     admins = db.get_all_admins()
@@ -357,11 +437,13 @@ def handle_admin_list():
     return TextMessage(text="\n".join(lines))
 
 
+@router.command('/說明', aliases=['/help', '/幫助'])
 def handle_help():
     """處理 /說明 或 /help 指令"""
     return create_help_message()
 
 
+@router.command('/選單', aliases=['/menu', '/功能'])
 def handle_menu():
     """處理 /選單 或 /menu 指令"""
     return create_menu_message()
@@ -370,40 +452,6 @@ def handle_menu():
 def process_command(line_user_id: str, line_display_name: str, text: str):
     """
     處理使用者指令
-    回傳: LINE Message 物件，如果不是指令則回傳 None
+    回傳: LINE Message 物件（或多則訊息的列表），如果不是指令則回傳 None
     """
-    text = text.strip()
-
-    if not text.startswith('/'):
-        return None
-
-    # 分離指令和參數
-    parts = text.split(maxsplit=1)
-    command = parts[0].lower()
-    args = parts[1] if len(parts) > 1 else ""
-
-    # 指令路由
-    if command == '/登記':
-        return handle_register(line_user_id, line_display_name, args)
-    elif command == '/修改':
-        return handle_update(line_user_id, args)
-    elif command == '/查詢':
-        return handle_search(args)
-    elif command == '/名冊':
-        return handle_roster(line_user_id, args)
-    elif command == '/刪除':
-        return handle_delete(line_user_id, args)
-    elif command == '/設定管理員':
-        return handle_set_admin(line_user_id, args)
-    elif command == '/代登記':
-        return handle_register_for(line_user_id, args)
-    elif command == '/我是誰':
-        return handle_whoami(line_user_id, line_display_name)
-    elif command in ['/說明', '/help', '/幫助']:
-        return handle_help()
-    elif command in ['/選單', '/menu', '/功能']:
-        return handle_menu()
-    elif command in ['/幹部', '/幹部名單']:
-        return handle_admin_list()
-    else:
-        return None
+    return router.dispatch(line_user_id, line_display_name, text)
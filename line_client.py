@@ -0,0 +1,127 @@
+"""
+LINE Messaging API 用戶端模組
+每個 worker 共用一個長期存在的 ApiClient / MessagingApi，重複使用到 api.line.me 的連線
+"""
+
+import os
+import socket
+import threading
+
+from urllib3 import Retry
+from urllib3.connection import HTTPConnection
+from linebot.v3.messaging import (
+    Configuration,
+    ApiClient,
+    MessagingApi
+)
+
+LINE_API_HOST = os.environ.get('LINE_API_HOST', 'https://api.line.me')
+LINE_HTTP_POOL_SIZE = int(os.environ.get('LINE_HTTP_POOL_SIZE', 10))
+LINE_CONNECT_TIMEOUT = float(os.environ.get('LINE_CONNECT_TIMEOUT', 3))
+LINE_READ_TIMEOUT = float(os.environ.get('LINE_READ_TIMEOUT', 10))
+LINE_HTTP_RETRIES = int(os.environ.get('LINE_HTTP_RETRIES', 2))
+
+# 每次 API 呼叫都帶入 (連線逾時, 讀取逾時)
+REQUEST_TIMEOUT = (LINE_CONNECT_TIMEOUT, LINE_READ_TIMEOUT)
+
+configuration = Configuration(
+    host=LINE_API_HOST,
+    access_token=os.environ.get('LINE_CHANNEL_ACCESS_TOKEN')
+)
+# urllib3 連線池大小（同時連到 LINE API 的連線數上限）
+configuration.connection_pool_maxsize = LINE_HTTP_POOL_SIZE
+# 連線失敗（請求尚未送出）一律重試；LINE 回應 5xx 只重試冪等的方法（取得個人資料等 GET）
+# reply / push 的 POST 不因 5xx 重試：LINE 可能已送出訊息，重送 reply 會得到 400（reply token 已使用）
+# 而改用 push 補送，重送 push 則會直接重複發送
+# 讀取逾時也不重試：請求可能已送達，重送同樣會重複發送，也會讓等待時間倍增
+# 重試用盡時回傳最後的回應，由 SDK 照常拋出 ApiException
+configuration.retries = Retry(
+    total=LINE_HTTP_RETRIES,
+    read=0,
+    status_forcelist=(500, 502, 503, 504),
+    allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+    raise_on_status=False
+)
+# 開啟 TCP keep-alive，避免閒置連線被中間設備默默切斷
+configuration.socket_options = HTTPConnection.default_socket_options + [
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+]
+
+_api_client = None
+_messaging_api = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_messaging_api() -> MessagingApi:
+    """取得目前行程共用的 MessagingApi（第一次使用時建立，fork 後重新建立）"""
+    global _api_client, _messaging_api, _client_pid
+    messaging_api = _messaging_api
+    if messaging_api is not None and _client_pid == os.getpid():
+        return messaging_api
+
+    with _client_lock:
+        if _messaging_api is None or _client_pid != os.getpid():
+            # fork 之後不沿用父行程的連線，直接建立新的用戶端
+            _api_client = ApiClient(configuration)
+            _messaging_api = MessagingApi(_api_client)
+            _client_pid = os.getpid()
+        return _messaging_api
+
+
+def close_client():
+    """關閉共用的用戶端與其連線池（worker 結束時呼叫）"""
+    global _api_client, _messaging_api, _client_pid
+    with _client_lock:
+        if _api_client is not None and _client_pid == os.getpid():
+            _api_client.close()
+            _api_client.rest_client.pool_manager.clear()
+        _api_client = None
+        _messaging_api = None
+        _client_pid = None
+
+
+def serialize_messages(messages: list) -> list:
+    """訊息轉成送出的 JSON 結構；SDK 模型（TextMessage 等）與 RenderedFlexMessage 都提供 to_dict()"""
+    return [message.to_dict() for message in messages]
+
+
+def reply_call(reply_token: str, messages: list) -> dict:
+    """
+    reply API 的 call_api 參數
+    訊息以 JSON 結構直接放入請求，不再建立 ReplyMessageRequest 驗證整棵模型；
+    同步版使用 api_client.call_api(**...)，asyncio 版使用 await async_api_client.call_api(**...)
+    """
+    return _json_post(
+        '/v2/bot/message/reply',
+        {'replyToken': reply_token, 'messages': serialize_messages(messages), 'notificationDisabled': False},
+        'ReplyMessageResponse'
+    )
+
+
+def push_call(to: str, messages: list) -> dict:
+    """push API 的 call_api 參數（同 reply_call）"""
+    return _json_post(
+        '/v2/bot/message/push',
+        {'to': to, 'messages': serialize_messages(messages), 'notificationDisabled': False},
+        'PushMessageResponse'
+    )
+
+
+def _json_post(resource_path: str, body: dict, response_type: str) -> dict:
+    # 與 MessagingApi 產生的呼叫相同：Bearer 驗證、JSON 請求；錯誤回應一樣拋出 ApiException
+    return {
+        'resource_path': resource_path,
+        'method': 'POST',
+        'header_params': {'Accept': 'application/json', 'Content-Type': 'application/json'},
+        'body': body,
+        'response_types_map': {
+            '200': response_type,
+            '400': 'ErrorResponse',
+            '403': 'ErrorResponse',
+            '409': 'ErrorResponse',
+            '429': 'ErrorResponse',
+        },
+        'auth_settings': ['Bearer'],
+        '_return_http_data_only': True,
+    }
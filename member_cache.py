@@ -0,0 +1,305 @@
+"""
+成員資料記憶體快取模組
+- ChangeFeed：以 PostgreSQL LISTEN/NOTIFY 接收 members 表變更通知
+- MemberDirectory：行程內的成員名錄，依 LINE user ID、遊戲名稱與 LINE 名稱的比對鍵建立索引
+- AdminSet：行程內的管理員 LINE user ID 集合，權限檢查不必查資料庫
+
+members 表的觸發器在寫入語句影響快取內容時遞增 cache_versions 並發出 NOTIFY（每個語句一次），
+各 worker / 副本收到通知後清除快取；LISTEN 連線異常時改為定期比對版本號，
+任何無法確定資料是否最新的情況都回報「未命中」，由呼叫端改查資料庫
+"""
+
+import os
+import select
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+from name_keys import name_key
+
+MEMBERS_CHANNEL = 'members_changed'
+
+
+class ChangeFeed:
+    """
+    背景執行緒 LISTEN 指定頻道，收到通知時呼叫所有訂閱的函式
+    連線中斷時自動重連，重連後也會通知訂閱者（期間可能漏掉通知）
+    """
+
+    def __init__(self, dsn: str, channel: str, reconnect_delay: float = 5):
+        self.dsn = dsn
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._pid = None
+        self._listening = False
+        self.notifications = 0
+        self.reconnects = 0
+
+    def subscribe(self, callback):
+        """註冊收到變更通知時要呼叫的函式"""
+        self._callbacks.append(callback)
+
+    @property
+    def healthy(self) -> bool:
+        """目前行程是否正在 LISTEN（可以信任通知來判斷快取是否過期）"""
+        return self._listening and self._pid == os.getpid()
+
+    def start(self):
+        """啟動背景執行緒（第一次使用時或 fork 之後）"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._listening = False
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run,
+                name=f"listen-{self.channel}",
+                daemon=True
+            )
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        """停止背景執行緒"""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.reconnect_delay + 1)
+
+    def _notify_subscribers(self):
+        for callback in self._callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"處理快取失效通知失敗: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(
+                    self.dsn,
+                    keepalives=1,
+                    keepalives_idle=30,
+                    keepalives_interval=10,
+                    keepalives_count=3
+                )
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                self._listening = True
+                # 連線建立前的變更可能沒收到，一律視為已變更
+                self._notify_subscribers()
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], self.reconnect_delay) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        self.notifications += len(conn.notifies)
+                        conn.notifies.clear()
+                        self._notify_subscribers()
+            except Exception as e:
+                print(f"LISTEN {self.channel} 連線中斷: {e}")
+            finally:
+                was_listening = self._listening
+                self._listening = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+            if was_listening:
+                self.reconnects += 1
+                self._notify_subscribers()
+            self._stop.wait(self.reconnect_delay)
+
+
+class VersionedCache:
+    """
+    依 members 版本號失效的行程內快取（子類別實作 _build 把載入的資料整理成查詢用結構）
+    - loader()：回傳 (版本號, 資料)
+    - version_reader()：回傳目前的版本號
+    LISTEN 正常時只依通知失效；否則每 version_check_interval 秒比對一次版本號
+    """
+
+    label = '快取'
+
+    def __init__(self, loader, version_reader, feed: ChangeFeed = None,
+                 version_check_interval: float = 5):
+        self.loader = loader
+        self.version_reader = version_reader
+        self.feed = feed
+        self.version_check_interval = version_check_interval
+
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._loaded = False
+        self._version = None
+        self._last_version_check = 0.0
+        self._data = self._build([])
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+        if feed is not None:
+            feed.subscribe(self.invalidate)
+
+    def _build(self, rows):
+        raise NotImplementedError
+
+    def invalidate(self):
+        """清除快取，下次讀取時重新載入"""
+        with self._lock:
+            self._generation += 1
+            self._loaded = False
+
+    def _reload(self) -> bool:
+        with self._lock:
+            generation = self._generation
+        version, rows = self.loader()
+        data = self._build(rows)
+
+        with self._lock:
+            # 載入期間收到變更通知時，這份資料可能已過期，不採用
+            if generation != self._generation:
+                return False
+            self._data = data
+            self._version = version
+            self._last_version_check = time.monotonic()
+            self._loaded = True
+            self.reloads += 1
+            return True
+
+    def _ensure_fresh(self) -> bool:
+        """確認快取可以使用；無法確認時回傳 False"""
+        try:
+            if self.feed is not None:
+                self.feed.start()
+
+            if self._loaded and self.feed is not None and self.feed.healthy:
+                return True
+
+            now = time.monotonic()
+            if self._loaded:
+                if now - self._last_version_check < self.version_check_interval:
+                    return True
+                if self.version_reader() == self._version:
+                    self._last_version_check = now
+                    return True
+                self.invalidate()
+
+            return self._reload()
+        except Exception as e:
+            print(f"{self.label}載入失敗，改查資料庫: {e}")
+            self.invalidate()
+            return False
+
+    def _snapshot(self):
+        """取得可用的資料；無法確認是否最新時回傳 None"""
+        if not self._ensure_fresh():
+            self._record(False)
+            return None
+        self._record(True)
+        return self._data
+
+    def _record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _size(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """快取統計資料"""
+        with self._lock:
+            return {
+                'loaded': self._loaded,
+                'size': self._size(),
+                'version': self._version,
+                'listening': self.feed.healthy if self.feed is not None else False,
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+            }
+
+
+class MemberDirectory(VersionedCache):
+    """行程內的成員名錄，loader() 回傳 (版本號, 全部成員列表)"""
+
+    label = '成員名錄'
+
+    def _build(self, members):
+        by_user_id, by_game_name, by_display_name = {}, {}, {}
+        for member in members:
+            member = dict(member)
+            by_user_id[member['line_user_id']] = member
+            by_game_name.setdefault(name_key(member['game_name']), []).append(member)
+            by_display_name.setdefault(name_key(member['line_display_name']), []).append(member)
+        return by_user_id, by_game_name, by_display_name
+
+    def _size(self) -> int:
+        return len(self._data[0])
+
+    def get_by_user_id(self, line_user_id: str):
+        """
+        透過 LINE user ID 查詢
+        回傳: (是否可信, 成員資料或 None)；不可信時呼叫端應改查資料庫
+        """
+        data = self._snapshot()
+        if data is None:
+            return False, None
+        member = data[0].get(line_user_id)
+        return True, dict(member) if member else None
+
+    def find_by_game_name(self, game_name: str):
+        """透過遊戲名稱精確查詢（比對鍵相同即相符），回傳: (是否可信, 成員列表)"""
+        data = self._snapshot()
+        if data is None:
+            return False, []
+        return True, [dict(m) for m in data[1].get(name_key(game_name), [])]
+
+    def find_by_display_name(self, line_display_name: str):
+        """透過 LINE 名稱精確查詢（比對鍵相同即相符），回傳: (是否可信, 成員列表)"""
+        data = self._snapshot()
+        if data is None:
+            return False, []
+        return True, [dict(m) for m in data[2].get(name_key(line_display_name), [])]
+
+
+class AdminSet(VersionedCache):
+    """行程內的管理員集合，loader() 回傳 (版本號, 管理員 LINE user ID 列表)"""
+
+    label = '管理員快取'
+
+    def _build(self, user_ids):
+        return frozenset(user_ids)
+
+    def is_admin(self, line_user_id: str):
+        """回傳: (是否可信, 是否為管理員)；不可信時呼叫端應改查資料庫"""
+        admins = self._snapshot()
+        if admins is None:
+            return False, False
+        return True, line_user_id in admins
+
+    def count(self):
+        """回傳: (是否可信, 管理員數量)"""
+        admins = self._snapshot()
+        if admins is None:
+            return False, 0
+        return True, len(admins)
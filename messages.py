@@ -1,6 +1,7 @@
 """
 LINE 訊息模板建構模組
 支援 Flex Message 和 Quick Reply
+名冊、查詢結果、個人資料與輸入提示使用預先驗證的 Flex 模板（flex_templates），每次只填入變動的欄位
 """
 
 from linebot.v3.messaging import (
@@ -17,28 +18,44 @@ from linebot.v3.messaging import (
     FlexButton
 )
 import json
+from functools import lru_cache
+
+import metrics
+from flex_templates import FlexTemplate, RenderedFlexMessage, Slot, carousel_or_bubble, json_size, pack_rows
+
+# 記錄各訊息建構函式執行時間的裝飾器
+_timed = metrics.instrument(metrics.MESSAGE_BUILD_SECONDS)
 
 
 def create_quick_reply(items: list) -> QuickReply:
     """
     建立 Quick Reply
     items: [{'label': '顯示文字', 'text': '發送文字'}, ...]
+    相同的按鈕組合共用同一個 QuickReply 物件
     """
+    return _build_quick_reply(tuple((item['label'], item['text']) for item in items))
+
+
+@lru_cache(maxsize=256)
+def _build_quick_reply(items: tuple) -> QuickReply:
+    """依 ((label, text), ...) 建立 QuickReply（結果會被快取）"""
     quick_reply_items = []
-    for item in items:
+    for label, text in items:
         quick_reply_items.append(
             QuickReplyItem(
                 action=MessageAction(
-                    label=item['label'],
-                    text=item['text']
+                    label=label,
+                    text=text
                 )
             )
         )
     return QuickReply(items=quick_reply_items)
 
 
+@_timed
+@lru_cache(maxsize=None)
 def create_menu_message() -> FlexMessage:
-    """建立主選單 Flex Message"""
+    """建立主選單 Flex Message（內容固定，第一次呼叫時建立後重複使用）"""
     bubble = {
         "type": "bubble",
         "size": "kilo",
@@ -171,445 +188,675 @@ def create_menu_message() -> FlexMessage:
     )
 
 
-def create_roster_text_message(members: list, total: int) -> TextMessage:
-    """建立純文字版名冊（用於顯示全部成員，避免 Flex Message 大小限制）"""
-    if not members:
-        return TextMessage(text="📋 目前沒有任何登記資料")
+# LINE 文字訊息上限 5000 字，保留一些餘裕
+TEXT_MESSAGE_BUDGET = 4800
+# 單次回覆最多 5 則訊息
+MAX_REPLY_MESSAGES = 5
+# LINE Flex Message 的 altText 上限 400 字
+ALT_TEXT_MAX_CHARS = 400
 
-    lines = [f"📋 成員名冊（全部 {total} 人）", ""]
 
-    for i, member in enumerate(members, start=1):
-        lines.append(f"{i}. {member['line_display_name']} ↔ {member['game_name']}")
+def truncate_text(text: str, max_chars: int) -> str:
+    """超過 max_chars 字時截斷並以「…」結尾"""
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars - 1] + "…"
 
-    return TextMessage(text="\n".join(lines))
 
+@_timed
+def create_roster_text_messages(members, total: int, start: int = 1,
+                                max_messages: int = MAX_REPLY_MESSAGES,
+                                max_chars: int = TEXT_MESSAGE_BUDGET) -> list:
+    """
+    建立純文字版名冊（用於顯示全部成員，避免 Flex Message 大小限制）
+    members 可為逐筆讀取的迭代器（需含 id），依字數切成最多 max_messages 則訊息，
+    放不下的部分在最後一則附上續看指令（/名冊 全部 序號>id），不會一次讀入全部成員
+    start：第一筆成員的序號
+    """
+    if start == 1:
+        header = f"📋 成員名冊（全部 {total} 人）"
+    else:
+        header = f"📋 成員名冊（續，第 {start} 筆起，共 {total} 人）"
 
-def create_roster_message(members: list, page: int, total_pages: int, total: int, show_all: bool = False) -> FlexMessage:
-    """建立名冊 Flex Message"""
+    continuation_reserve = 60
+    chunks = []
+    lines = [header, ""]
+    length = len(header) + 1
+    last_id = None
+    next_cursor = None
 
-    # 建立成員列表
-    member_contents = []
+    for index, member in enumerate(members, start=start):
+        line = f"{index}. {member['line_display_name']} ↔ {member['game_name']}"
+        budget = max_chars - (continuation_reserve if len(chunks) == max_messages - 1 else 0)
 
-    if not members:
-        member_contents.append({
+        if length + len(line) + 1 > budget:
+            if len(chunks) == max_messages - 1:
+                next_cursor = f"{index}>{last_id}"
+                break
+            chunks.append(lines)
+            lines, length = [], 0
+
+        lines.append(line)
+        length += len(line) + 1
+        last_id = member['id']
+
+    if last_id is None:
+        if start == 1:
+            return [TextMessage(text="📋 目前沒有任何登記資料")]
+        return [TextMessage(text="📋 已顯示所有成員")]
+
+    chunks.append(lines)
+    messages = [TextMessage(text="\n".join(chunk)) for chunk in chunks]
+
+    if next_cursor:
+        command = f"/名冊 全部 {next_cursor}"
+        messages[-1] = TextMessage(
+            text=f"{messages[-1].text}\n\n還有更多成員，請輸入：\n{command}",
+            quick_reply=create_quick_reply([{'label': '➡️ 下一批', 'text': command}])
+        )
+
+    return messages
+
+
+# 名冊的一列：序號、LINE 名稱 ↔ 遊戲名稱
+ROSTER_ROW = FlexTemplate({
+    "type": "box",
+    "layout": "horizontal",
+    "contents": [
+        {
             "type": "text",
-            "text": "目前沒有任何登記資料",
+            "text": Slot('number'),
             "size": "sm",
             "color": "#888888",
+            "flex": 0,
+            "margin": "none"
+        },
+        {
+            "type": "text",
+            "text": Slot('line_display_name'),
+            "size": "sm",
+            "color": "#333333",
+            "flex": 4,
+            "margin": "sm"
+        },
+        {
+            "type": "text",
+            "text": "↔",
+            "size": "sm",
+            "color": "#888888",
+            "flex": 0,
             "align": "center"
-        })
-    else:
-        start_num = 1 if show_all else (page - 1) * 20 + 1
-        for i, member in enumerate(members, start=start_num):
-            member_contents.append({
-                "type": "box",
-                "layout": "horizontal",
-                "contents": [
-                    {
-                        "type": "text",
-                        "text": f"{i}.",
-                        "size": "sm",
-                        "color": "#888888",
-                        "flex": 0,
-                        "margin": "none"
-                    },
-                    {
-                        "type": "text",
-                        "text": f"{member['line_display_name']}",
-                        "size": "sm",
-                        "color": "#333333",
-                        "flex": 4,
-                        "margin": "sm"
-                    },
-                    {
-                        "type": "text",
-                        "text": "↔",
-                        "size": "sm",
-                        "color": "#888888",
-                        "flex": 0,
-                        "align": "center"
-                    },
-                    {
-                        "type": "text",
-                        "text": f"{member['game_name']}",
-                        "size": "sm",
-                        "color": "#1DB446",
-                        "flex": 4,
-                        "margin": "sm",
-                        "align": "end"
-                    }
-                ],
-                "margin": "sm"
-            })
-
-    # 建立頁面資訊
-    if show_all:
-        page_info = f"全部 {total} 人"
-    else:
-        page_info = f"第 {page}/{total_pages} 頁，共 {total} 人"
-
-    bubble = {
-        "type": "bubble",
-        "size": "mega",
-        "header": {
-            "type": "box",
-            "layout": "horizontal",
-            "contents": [
-                {
-                    "type": "text",
-                    "text": "📋 成員名冊",
-                    "weight": "bold",
-                    "size": "lg",
-                    "color": "#1DB446",
-                    "flex": 4
-                },
-                {
-                    "type": "text",
-                    "text": page_info,
-                    "size": "xs",
-                    "color": "#888888",
-                    "align": "end",
-                    "gravity": "center",
-                    "flex": 3
-                }
-            ],
-            "paddingBottom": "sm"
         },
-        "body": {
-            "type": "box",
-            "layout": "vertical",
-            "contents": member_contents,
-            "paddingTop": "sm"
+        {
+            "type": "text",
+            "text": Slot('game_name'),
+            "size": "sm",
+            "color": "#1DB446",
+            "flex": 4,
+            "margin": "sm",
+            "align": "end"
         }
+    ],
+    "margin": "sm"
+})
+
+ROSTER_EMPTY_ROW = {
+    "type": "text",
+    "text": "目前沒有任何登記資料",
+    "size": "sm",
+    "color": "#888888",
+    "align": "center"
+}
+
+ROSTER_PREV_BUTTON = FlexTemplate({
+    "type": "button",
+    "style": "secondary",
+    "height": "sm",
+    "action": {
+        "type": "message",
+        "label": "⬅️ 上一頁",
+        "text": Slot('text')
+    }
+})
+
+ROSTER_ALL_BUTTON = {
+    "type": "button",
+    "style": "primary",
+    "height": "sm",
+    "action": {
+        "type": "message",
+        "label": "📄 全部",
+        "text": "/名冊 全部"
+    },
+    "color": "#5B82DB"
+}
+
+ROSTER_NEXT_BUTTON = FlexTemplate({
+    "type": "button",
+    "style": "secondary",
+    "height": "sm",
+    "action": {
+        "type": "message",
+        "label": "➡️ 下一頁",
+        "text": Slot('text')
     }
+})
 
-    # 如果有多頁且不是顯示全部，加入分頁按鈕
-    if total_pages > 1 and not show_all:
+ROSTER_FOOTER = FlexTemplate({
+    "type": "box",
+    "layout": "horizontal",
+    "spacing": "sm",
+    "contents": Slot('buttons')
+})
+
+ROSTER_BUBBLE = FlexTemplate({
+    "type": "bubble",
+    "size": "mega",
+    "header": {
+        "type": "box",
+        "layout": "horizontal",
+        "contents": [
+            {
+                "type": "text",
+                "text": "📋 成員名冊",
+                "weight": "bold",
+                "size": "lg",
+                "color": "#1DB446",
+                "flex": 4
+            },
+            {
+                "type": "text",
+                "text": Slot('page_info'),
+                "size": "xs",
+                "color": "#888888",
+                "align": "end",
+                "gravity": "center",
+                "flex": 3
+            }
+        ],
+        "paddingBottom": "sm"
+    },
+    "body": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": Slot('rows'),
+        "paddingTop": "sm"
+    },
+    "footer": Slot('footer')
+}, samples=[
+    {
+        'page_info': "第 101–200 筆，共 245 人",
+        'rows': [ROSTER_ROW.render(number="101.", line_display_name="小明", game_name="勇者")],
+        'footer': ROSTER_FOOTER.render(buttons=[
+            ROSTER_PREV_BUTTON.render(text="/名冊 101<121"),
+            ROSTER_ALL_BUTTON,
+            ROSTER_NEXT_BUTTON.render(text="/名冊 201>220")
+        ])
+    },
+    {'page_info': "共 0 人", 'rows': [ROSTER_EMPTY_ROW], 'footer': None}
+])
+
+
+# 預留分頁按鈕的大小：游標（序號與 id）以最長的情況計算
+_ROSTER_FOOTER_RESERVE = ROSTER_FOOTER.render(buttons=[
+    ROSTER_PREV_BUTTON.render(text="/名冊 9999999999<9999999999"),
+    ROSTER_ALL_BUTTON,
+    ROSTER_NEXT_BUTTON.render(text="/名冊 9999999999>9999999999")
+])
+
+
+def _roster_page_info(total: int, start: int, count: int) -> str:
+    if start == 1 and count >= total:
+        return f"全部 {total} 人"
+    return f"第 {start}–{start + count - 1} 筆，共 {total} 人"
+
+
+def _roster_row_sizes(members: list, start: int) -> list:
+    return [
+        ROSTER_ROW.measure(
+            number=f"{i}.",
+            line_display_name=f"{member['line_display_name']}",
+            game_name=f"{member['game_name']}"
+        )
+        for i, member in enumerate(members, start=start)
+    ]
+
+
+def _roster_bubble_overhead(end: int, total: int) -> int:
+    """沒有任何列時 bubble 的大小；頁首以最長的序號、分頁按鈕以最長的游標計算"""
+    return json_size(ROSTER_BUBBLE.render(
+        page_info=f"第 {end}–{end} 筆，共 {total} 人",
+        rows=[],
+        footer=_ROSTER_FOOTER_RESERVE
+    ))
+
+
+def _pack_roster(members: list, start: int, total: int, max_messages: int) -> list:
+    """依 JSON 大小分配名冊的列（見 flex_templates.pack_rows）"""
+    overhead = _roster_bubble_overhead(start + len(members), total)
+    return pack_rows(_roster_row_sizes(members, start), overhead, max_messages=max_messages)
+
+
+def fit_roster_members(members: list, start: int, total: int, from_end: bool = False,
+                       max_messages: int = MAX_REPLY_MESSAGES) -> int:
+    """
+    一次回覆（最多 max_messages 則 Flex Message）放得下幾位成員
+    start：members[0] 的序號
+    from_end：從最後一位往前算（往上一頁翻時保留與游標相鄰的成員）
+    """
+    if not from_end:
+        return sum(map(sum, _pack_roster(members, start, total, max_messages)))
+
+    row_sizes = _roster_row_sizes(members, start)
+    overhead = _roster_bubble_overhead(start + len(members), total)
+    count = sum(map(sum, pack_rows(row_sizes[::-1], overhead, max_messages=max_messages)))
+    # 反向塞滿的結果再以正向確認（create_roster_message 依正向分配）
+    while count and sum(map(sum, pack_rows(row_sizes[-count:], overhead, max_messages=max_messages))) < count:
+        count -= 1
+    return count
+
+
+@_timed
+def create_roster_message(members: list, total: int, start: int = 1,
+                          prev_cursor: str = None, next_cursor: str = None,
+                          max_messages: int = MAX_REPLY_MESSAGES) -> list:
+    """
+    建立名冊 Flex Message
+    依 JSON 大小把成員塞進最少的 bubble，超過一個 bubble 時以 carousel 送出，最多 max_messages 則；
+    members 應先以 fit_roster_members() 裁到放得下的數量，放不下的成員不會顯示
+    start：第一位成員的序號
+    prev_cursor / next_cursor：分頁游標（如 "1<41"、"101>160"），有指定時在最後一個 bubble 加上分頁按鈕
+    回傳: 訊息列表
+    """
+
+    # 如果有上一頁或下一頁，加入分頁按鈕
+    footer = None
+    if prev_cursor is not None or next_cursor is not None:
         footer_buttons = []
 
         # 上一頁按鈕
-        if page > 1:
-            footer_buttons.append({
-                "type": "button",
-                "style": "secondary",
-                "height": "sm",
-                "action": {
-                    "type": "message",
-                    "label": "⬅️ 上一頁",
-                    "text": f"/名冊 {page - 1}"
-                }
-            })
+        if prev_cursor is not None:
+            footer_buttons.append(ROSTER_PREV_BUTTON.render(text=f"/名冊 {prev_cursor}"))
 
         # 顯示全部按鈕
-        footer_buttons.append({
-            "type": "button",
-            "style": "primary",
-            "height": "sm",
-            "action": {
-                "type": "message",
-                "label": "📄 全部",
-                "text": "/名冊 全部"
-            },
-            "color": "#5B82DB"
-        })
+        footer_buttons.append(ROSTER_ALL_BUTTON)
 
         # 下一頁按鈕
-        if page < total_pages:
-            footer_buttons.append({
-                "type": "button",
-                "style": "secondary",
-                "height": "sm",
-                "action": {
-                    "type": "message",
-                    "label": "➡️ 下一頁",
-                    "text": f"/名冊 {page + 1}"
-                }
-            })
+        if next_cursor is not None:
+            footer_buttons.append(ROSTER_NEXT_BUTTON.render(text=f"/名冊 {next_cursor}"))
 
-        bubble["footer"] = {
-            "type": "box",
-            "layout": "horizontal",
-            "spacing": "sm",
-            "contents": footer_buttons
-        }
+        footer = ROSTER_FOOTER.render(buttons=footer_buttons)
 
-    return FlexMessage(
-        alt_text=f"成員名冊 - {page_info}",
-        contents=FlexContainer.from_dict(bubble)
-    )
+    if not members:
+        page_info = f"共 {total} 人"
+        return [RenderedFlexMessage(
+            alt_text=f"成員名冊 - {page_info}",
+            contents=ROSTER_BUBBLE.render(page_info=page_info, rows=[ROSTER_EMPTY_ROW], footer=footer)
+        )]
 
+    packed = _pack_roster(members, start, total, max_messages)
+    shown = sum(map(sum, packed))
+    page_info = _roster_page_info(total, start, shown)
 
-def create_search_result_message(query: str, results: list) -> FlexMessage:
-    """建立查詢結果 Flex Message"""
+    # 建立成員列表
+    member_contents = [
+        ROSTER_ROW.render(
+            number=f"{i}.",
+            line_display_name=f"{member['line_display_name']}",
+            game_name=f"{member['game_name']}"
+        )
+        for i, member in enumerate(members[:shown], start=start)
+    ]
 
-    if not results:
-        bubble = {
-            "type": "bubble",
-            "size": "kilo",
-            "body": {
-                "type": "box",
-                "layout": "vertical",
-                "contents": [
-                    {
-                        "type": "text",
-                        "text": f"🔍 查詢「{query}」",
-                        "weight": "bold",
-                        "size": "md",
-                        "color": "#5B82DB"
-                    },
-                    {
-                        "type": "text",
-                        "text": "查無相關結果",
-                        "size": "sm",
-                        "color": "#888888",
-                        "margin": "md"
-                    }
-                ]
+    messages = []
+    offset = 0
+    for message_index, bubble_counts in enumerate(packed):
+        bubbles = []
+        for bubble_index, count in enumerate(bubble_counts):
+            last = message_index == len(packed) - 1 and bubble_index == len(bubble_counts) - 1
+            bubbles.append(ROSTER_BUBBLE.render(
+                page_info=page_info,
+                rows=member_contents[offset:offset + count],
+                footer=footer if last else None
+            ))
+            offset += count
+        messages.append(RenderedFlexMessage(
+            alt_text=f"成員名冊 - {page_info}",
+            contents=carousel_or_bubble(bubbles)
+        ))
+    return messages
+
+
+SEARCH_TITLE = FlexTemplate({
+    "type": "text",
+    "text": Slot('text'),
+    "weight": "bold",
+    "size": "md",
+    "color": "#5B82DB"
+})
+
+SEARCH_EMPTY_BUBBLE = FlexTemplate({
+    "type": "bubble",
+    "size": "kilo",
+    "body": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": [
+            Slot('title'),
+            {
+                "type": "text",
+                "text": "查無相關結果",
+                "size": "sm",
+                "color": "#888888",
+                "margin": "md"
             }
+        ]
+    }
+}, samples=[{'title': SEARCH_TITLE.render(text="🔍 查詢「小明」")}])
+
+SEARCH_ROW = FlexTemplate({
+    "type": "box",
+    "layout": "horizontal",
+    "contents": [
+        {
+            "type": "text",
+            "text": Slot('line_display_name'),
+            "size": "sm",
+            "color": "#333333",
+            "flex": 4
+        },
+        {
+            "type": "text",
+            "text": "↔",
+            "size": "sm",
+            "color": "#888888",
+            "flex": 0
+        },
+        {
+            "type": "text",
+            "text": Slot('game_name'),
+            "size": "sm",
+            "color": "#1DB446",
+            "flex": 4,
+            "align": "end"
         }
-    else:
-        member_contents = []
-        for member in results:
-            member_contents.append({
-                "type": "box",
-                "layout": "horizontal",
-                "contents": [
-                    {
-                        "type": "text",
-                        "text": f"• {member['line_display_name']}",
-                        "size": "sm",
-                        "color": "#333333",
-                        "flex": 4
-                    },
-                    {
-                        "type": "text",
-                        "text": "↔",
-                        "size": "sm",
-                        "color": "#888888",
-                        "flex": 0
-                    },
-                    {
-                        "type": "text",
-                        "text": f"{member['game_name']}",
-                        "size": "sm",
-                        "color": "#1DB446",
-                        "flex": 4,
-                        "align": "end"
-                    }
-                ],
+    ],
+    "margin": "sm"
+})
+
+SEARCH_RESULT_BUBBLE = FlexTemplate({
+    "type": "bubble",
+    "size": "kilo",
+    "header": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": [
+            Slot('title'),
+            {
+                "type": "text",
+                "text": Slot('summary'),
+                "size": "xs",
+                "color": "#888888",
                 "margin": "sm"
-            })
+            }
+        ],
+        "paddingBottom": "sm"
+    },
+    "body": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": Slot('rows'),
+        "paddingTop": "none"
+    }
+}, samples=[{
+    'title': SEARCH_TITLE.render(text="🔍 查詢「小明」"),
+    'summary': "找到 1 筆結果",
+    'rows': [SEARCH_ROW.render(line_display_name="• 小明", game_name="勇者")]
+}])
+
+
+@_timed
+def create_search_result_message(query: str, results: list, truncated: bool = False):
+    """
+    建立查詢結果 Flex Message（truncated 表示結果超過上限，只顯示前幾筆）
+    依 JSON 大小把結果塞進最少的 bubble，超過一個 bubble 時以 carousel 送出；單則訊息放不下的結果不顯示，並標示為截斷
+    連一筆都放不下時（名稱過長）改以純文字訊息送出，不送出空的 carousel
+    """
+
+    title = SEARCH_TITLE.render(text=f"🔍 查詢「{query}」")
+    alt_text = truncate_text(f"查詢「{query}」的結果", ALT_TEXT_MAX_CHARS)
+
+    if not results:
+        return RenderedFlexMessage(
+            alt_text=alt_text,
+            contents=SEARCH_EMPTY_BUBBLE.render(title=title)
+        )
+
+    rows = [
+        {
+            'line_display_name': f"• {member['line_display_name']}",
+            'game_name': f"{member['game_name']}"
+        }
+        for member in results
+    ]
+    overhead = json_size(SEARCH_RESULT_BUBBLE.render(
+        title=title,
+        summary=f"結果過多，顯示前 {len(results)} 筆",
+        rows=[]
+    ))
+    packed = pack_rows([SEARCH_ROW.measure(**row) for row in rows], overhead)
+    bubble_counts = packed[0] if packed else []
+    shown = sum(bubble_counts)
+
+    if shown == 0:
+        summary = f"結果過多，顯示前 {len(results)} 筆" if truncated else f"找到 {len(results)} 筆結果"
+        lines = [f"{row['line_display_name']} ↔ {row['game_name']}" for row in rows]
+        text = "\n".join([f"🔍 查詢「{query}」", summary, ""] + lines)
+        return TextMessage(text=truncate_text(text, TEXT_MESSAGE_BUDGET))
+
+    truncated = truncated or shown < len(results)
+    summary = f"結果過多，顯示前 {shown} 筆" if truncated else f"找到 {shown} 筆結果"
 
-        bubble = {
-            "type": "bubble",
-            "size": "kilo",
-            "header": {
+    bubbles = []
+    offset = 0
+    for count in bubble_counts:
+        bubbles.append(SEARCH_RESULT_BUBBLE.render(
+            title=title,
+            summary=summary,
+            rows=[SEARCH_ROW.render(**row) for row in rows[offset:offset + count]]
+        ))
+        offset += count
+
+    return RenderedFlexMessage(
+        alt_text=alt_text,
+        contents=carousel_or_bubble(bubbles)
+    )
+
+
+PROFILE_UNREGISTERED_BUBBLE = FlexTemplate({
+    "type": "bubble",
+    "size": "kilo",
+    "body": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": [
+            {
+                "type": "text",
+                "text": "👤 我的資料",
+                "weight": "bold",
+                "size": "md",
+                "color": "#5B82DB"
+            },
+            {
+                "type": "separator",
+                "margin": "md"
+            },
+            {
                 "type": "box",
                 "layout": "vertical",
+                "margin": "md",
                 "contents": [
                     {
                         "type": "text",
-                        "text": f"🔍 查詢「{query}」",
-                        "weight": "bold",
-                        "size": "md",
-                        "color": "#5B82DB"
+                        "text": Slot('line_name_text'),
+                        "size": "sm",
+                        "color": "#333333"
                     },
                     {
                         "type": "text",
-                        "text": f"找到 {len(results)} 筆結果",
-                        "size": "xs",
+                        "text": "尚未登記",
+                        "size": "sm",
                         "color": "#888888",
                         "margin": "sm"
                     }
-                ],
-                "paddingBottom": "sm"
-            },
-            "body": {
-                "type": "box",
-                "layout": "vertical",
-                "contents": member_contents,
-                "paddingTop": "none"
+                ]
             }
-        }
-
-    return FlexMessage(
-        alt_text=f"查詢「{query}」的結果",
-        contents=FlexContainer.from_dict(bubble)
-    )
-
-
-def create_profile_message(member: dict, line_display_name: str, is_registered: bool) -> FlexMessage:
-    """建立個人資料 Flex Message"""
+        ]
+    },
+    "footer": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": [
+            {
+                "type": "button",
+                "style": "primary",
+                "action": {
+                    "type": "message",
+                    "label": "📝 立即登記",
+                    "text": "/登記"
+                },
+                "color": "#1DB446",
+                "height": "sm"
+            }
+        ]
+    }
+}, samples=[{'line_name_text': "LINE 名稱：小明"}])
 
-    if not is_registered:
-        bubble = {
-            "type": "bubble",
-            "size": "kilo",
-            "body": {
+PROFILE_BUBBLE = FlexTemplate({
+    "type": "bubble",
+    "size": "kilo",
+    "body": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": [
+            {
+                "type": "text",
+                "text": Slot('title'),
+                "weight": "bold",
+                "size": "md",
+                "color": "#5B82DB"
+            },
+            {
+                "type": "separator",
+                "margin": "md"
+            },
+            {
                 "type": "box",
                 "layout": "vertical",
+                "margin": "md",
+                "spacing": "sm",
                 "contents": [
-                    {
-                        "type": "text",
-                        "text": "👤 我的資料",
-                        "weight": "bold",
-                        "size": "md",
-                        "color": "#5B82DB"
-                    },
-                    {
-                        "type": "separator",
-                        "margin": "md"
-                    },
                     {
                         "type": "box",
-                        "layout": "vertical",
-                        "margin": "md",
+                        "layout": "horizontal",
                         "contents": [
                             {
                                 "type": "text",
-                                "text": f"LINE 名稱：{line_display_name}",
+                                "text": "LINE 名稱",
                                 "size": "sm",
-                                "color": "#333333"
+                                "color": "#888888",
+                                "flex": 2
                             },
                             {
                                 "type": "text",
-                                "text": "尚未登記",
+                                "text": Slot('line_display_name'),
                                 "size": "sm",
-                                "color": "#888888",
-                                "margin": "sm"
+                                "color": "#333333",
+                                "flex": 4,
+                                "align": "end"
                             }
                         ]
-                    }
-                ]
-            },
-            "footer": {
-                "type": "box",
-                "layout": "vertical",
-                "contents": [
-                    {
-                        "type": "button",
-                        "style": "primary",
-                        "action": {
-                            "type": "message",
-                            "label": "📝 立即登記",
-                            "text": "/登記"
-                        },
-                        "color": "#1DB446",
-                        "height": "sm"
-                    }
-                ]
-            }
-        }
-    else:
-        admin_badge = " 👑" if member['is_admin'] else ""
-        bubble = {
-            "type": "bubble",
-            "size": "kilo",
-            "body": {
-                "type": "box",
-                "layout": "vertical",
-                "contents": [
-                    {
-                        "type": "text",
-                        "text": f"👤 我的資料{admin_badge}",
-                        "weight": "bold",
-                        "size": "md",
-                        "color": "#5B82DB"
-                    },
-                    {
-                        "type": "separator",
-                        "margin": "md"
                     },
                     {
                         "type": "box",
-                        "layout": "vertical",
-                        "margin": "md",
-                        "spacing": "sm",
+                        "layout": "horizontal",
                         "contents": [
                             {
-                                "type": "box",
-                                "layout": "horizontal",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "LINE 名稱",
-                                        "size": "sm",
-                                        "color": "#888888",
-                                        "flex": 2
-                                    },
-                                    {
-                                        "type": "text",
-                                        "text": member['line_display_name'],
-                                        "size": "sm",
-                                        "color": "#333333",
-                                        "flex": 4,
-                                        "align": "end"
-                                    }
-                                ]
+                                "type": "text",
+                                "text": "遊戲名稱",
+                                "size": "sm",
+                                "color": "#888888",
+                                "flex": 2
                             },
                             {
-                                "type": "box",
-                                "layout": "horizontal",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "遊戲名稱",
-                                        "size": "sm",
-                                        "color": "#888888",
-                                        "flex": 2
-                                    },
-                                    {
-                                        "type": "text",
-                                        "text": member['game_name'],
-                                        "size": "sm",
-                                        "color": "#1DB446",
-                                        "weight": "bold",
-                                        "flex": 4,
-                                        "align": "end"
-                                    }
-                                ]
+                                "type": "text",
+                                "text": Slot('game_name'),
+                                "size": "sm",
+                                "color": "#1DB446",
+                                "weight": "bold",
+                                "flex": 4,
+                                "align": "end"
                             }
                         ]
                     }
                 ]
+            }
+        ]
+    },
+    "footer": {
+        "type": "box",
+        "layout": "horizontal",
+        "spacing": "sm",
+        "contents": [
+            {
+                "type": "button",
+                "style": "secondary",
+                "action": {
+                    "type": "message",
+                    "label": "✏️ 修改名稱",
+                    "text": "/修改"
+                },
+                "height": "sm"
             },
-            "footer": {
-                "type": "box",
-                "layout": "horizontal",
-                "spacing": "sm",
-                "contents": [
-                    {
-                        "type": "button",
-                        "style": "secondary",
-                        "action": {
-                            "type": "message",
-                            "label": "✏️ 修改名稱",
-                            "text": "/修改"
-                        },
-                        "height": "sm"
-                    },
-                    {
-                        "type": "button",
-                        "style": "secondary",
-                        "action": {
-                            "type": "message",
-                            "label": "📋 查看名冊",
-                            "text": "/名冊"
-                        },
-                        "height": "sm"
-                    }
-                ]
+            {
+                "type": "button",
+                "style": "secondary",
+                "action": {
+                    "type": "message",
+                    "label": "📋 查看名冊",
+                    "text": "/名冊"
+                },
+                "height": "sm"
             }
-        }
+        ]
+    }
+}, samples=[{'title': "👤 我的資料 👑", 'line_display_name': "小明", 'game_name': "勇者"}])
 
-    return FlexMessage(
+
+@_timed
+def create_profile_message(member: dict, line_display_name: str, is_registered: bool) -> RenderedFlexMessage:
+    """建立個人資料 Flex Message"""
+
+    if not is_registered:
+        bubble = PROFILE_UNREGISTERED_BUBBLE.render(line_name_text=f"LINE 名稱：{line_display_name}")
+    else:
+        admin_badge = " 👑" if member['is_admin'] else ""
+        bubble = PROFILE_BUBBLE.render(
+            title=f"👤 我的資料{admin_badge}",
+            line_display_name=member['line_display_name'],
+            game_name=member['game_name']
+        )
+
+    return RenderedFlexMessage(
         alt_text="我的資料",
-        contents=FlexContainer.from_dict(bubble)
+        contents=bubble
     )
 
 
+@_timed
+@lru_cache(maxsize=None)
 def create_help_message() -> FlexMessage:
-    """建立說明 Flex Message"""
+    """建立說明 Flex Message（內容固定，第一次呼叫時建立後重複使用）"""
 
     bubble = {
         "type": "bubble",
@@ -721,6 +968,7 @@ def create_help_message() -> FlexMessage:
     )
 
 
+@_timed
 def create_success_message(title: str, content: str, quick_actions: list = None) -> TextMessage:
     """建立成功訊息（含 Quick Reply）"""
     text = f"✅ {title}\n\n{content}"
@@ -733,6 +981,7 @@ def create_success_message(title: str, content: str, quick_actions: list = None)
     return TextMessage(text=text)
 
 
+@_timed
 def create_error_message(content: str, quick_actions: list = None) -> TextMessage:
     """建立錯誤訊息（含 Quick Reply）"""
     text = f"❌ {content}"
@@ -745,54 +994,69 @@ def create_error_message(content: str, quick_actions: list = None) -> TextMessag
     return TextMessage(text=text)
 
 
-def create_input_prompt_message(command: str, prompt: str, examples: list = None) -> FlexMessage:
+INPUT_PROMPT_TITLE = FlexTemplate({
+    "type": "text",
+    "text": Slot('text'),
+    "weight": "bold",
+    "size": "md",
+    "color": "#5B82DB"
+})
+
+INPUT_PROMPT_TEXT = FlexTemplate({
+    "type": "text",
+    "text": Slot('text'),
+    "size": "sm",
+    "color": "#333333",
+    "margin": "md",
+    "wrap": True
+})
+
+INPUT_PROMPT_EXAMPLES_LABEL = {
+    "type": "text",
+    "text": "範例：",
+    "size": "xs",
+    "color": "#888888",
+    "margin": "lg"
+}
+
+INPUT_PROMPT_EXAMPLE = FlexTemplate({
+    "type": "text",
+    "text": Slot('text'),
+    "size": "xs",
+    "color": "#888888"
+})
+
+INPUT_PROMPT_BUBBLE = FlexTemplate({
+    "type": "bubble",
+    "size": "kilo",
+    "body": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": Slot('contents')
+    }
+}, samples=[{'contents': [
+    INPUT_PROMPT_TITLE.render(text="📝 /登記"),
+    INPUT_PROMPT_TEXT.render(text="請輸入遊戲名稱"),
+    INPUT_PROMPT_EXAMPLES_LABEL,
+    INPUT_PROMPT_EXAMPLE.render(text="  /登記 勇者")
+]}])
+
+
+@_timed
+def create_input_prompt_message(command: str, prompt: str, examples: list = None) -> RenderedFlexMessage:
     """建立輸入提示 Flex Message（當指令缺少參數時）"""
 
     contents = [
-        {
-            "type": "text",
-            "text": f"📝 {command}",
-            "weight": "bold",
-            "size": "md",
-            "color": "#5B82DB"
-        },
-        {
-            "type": "text",
-            "text": prompt,
-            "size": "sm",
-            "color": "#333333",
-            "margin": "md",
-            "wrap": True
-        }
+        INPUT_PROMPT_TITLE.render(text=f"📝 {command}"),
+        INPUT_PROMPT_TEXT.render(text=prompt)
     ]
 
     if examples:
-        contents.append({
-            "type": "text",
-            "text": "範例：",
-            "size": "xs",
-            "color": "#888888",
-            "margin": "lg"
-        })
+        contents.append(INPUT_PROMPT_EXAMPLES_LABEL)
         for example in examples:
-            contents.append({
-                "type": "text",
-                "text": f"  {example}",
-                "size": "xs",
-                "color": "#888888"
-            })
-
-    bubble = {
-        "type": "bubble",
-        "size": "kilo",
-        "body": {
-            "type": "box",
-            "layout": "vertical",
-            "contents": contents
-        }
-    }
+            contents.append(INPUT_PROMPT_EXAMPLE.render(text=f"  {example}"))
 
-    return FlexMessage(
+    return RenderedFlexMessage(
         alt_text=prompt,
-        contents=FlexContainer.from_dict(bubble)
+        contents=INPUT_PROMPT_BUBBLE.render(contents=contents)
     )
@@ -0,0 +1,493 @@
+"""
+Prometheus 文字格式的監控指標模組
+- Counter / Gauge / Histogram：標籤組合第一次使用時建立，之後只更新預先配置好的數值
+- CallbackMetric：輸出時才呼叫函式取值（連線池、快取、佇列等既有的統計資料）
+- 多個 gunicorn worker：設定 METRICS_DIR 後各 worker 定期把數值寫成檔案，
+  /metrics 合併所有 worker 的檔案輸出；已結束的 worker 只保留 counter / histogram
+"""
+
+import bisect
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# 預設的延遲分桶（秒），涵蓋資料庫查詢到 LINE API 呼叫
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 訊息建構等純 CPU 工作用的細分桶（秒）
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+# reply token 年齡用的分桶（秒），涵蓋到 token 失效前後
+TOKEN_AGE_BUCKETS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 45.0, 60.0, 120.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Metric:
+    """指標基底：依標籤值建立子項目（child），同一組標籤只建立一次"""
+
+    type = None
+
+    def __init__(self, name: str, help: str, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values):
+        """取得標籤值對應的子項目（熱路徑上建議在模組載入時先取得並保存）"""
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要標籤 {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def reset(self):
+        with self._lock:
+            for child in self._children.values():
+                child.reset()
+
+    def samples(self) -> dict:
+        """{標籤值: 數值}（histogram 的數值為 [各分桶累計, 總和, 次數]）"""
+        return {values: child.value() for values, child in list(self._children.items())}
+
+
+class _CounterChild:
+    __slots__ = ('_lock', '_value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def reset(self):
+        with self._lock:
+            self._value = 0.0
+
+    def value(self):
+        return self._value
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float):
+        self._value = value
+
+
+class _HistogramChild:
+    __slots__ = ('_lock', '_bounds', '_counts', '_sum', '_count')
+
+    def __init__(self, bounds):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self._counts = [0] * len(bounds)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            if index < len(self._counts):
+                self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * len(self._bounds)
+            self._sum = 0.0
+            self._count = 0
+
+    def value(self):
+        with self._lock:
+            cumulative, total = [], 0
+            for count in self._counts:
+                total += count
+                cumulative.append(total)
+            return [cumulative, self._sum, self._count]
+
+
+class Counter(_Metric):
+    """只增不減的計數"""
+
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """可增可減的數值（例如處理中的請求數）"""
+
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    """分桶統計（延遲分佈）；分桶上限在建立時固定"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+
+class CallbackMetric(_Metric):
+    """
+    輸出時才呼叫 func() 取值的指標
+    func 回傳 {標籤值 tuple: 數值}；沒有標籤時可直接回傳數值
+    """
+
+    def __init__(self, name: str, help: str, metric_type: str, func, labelnames=(), registry=None):
+        self.type = metric_type
+        self.func = func
+        super().__init__(name, help, labelnames, registry)
+
+    def reset(self):
+        pass
+
+    def samples(self) -> dict:
+        try:
+            values = self.func()
+        except Exception as e:
+            print(f"讀取監控指標 {self.name} 失敗: {e}")
+            return {}
+        if not isinstance(values, dict):
+            return {(): values}
+        return {tuple(str(v) for v in key): value for key, value in values.items()}
+
+
+class Registry:
+    """指標登錄表；負責輸出、寫入 worker 檔案與合併"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"監控指標 {metric.name} 重複註冊")
+            self._metrics[metric.name] = metric
+
+    def reset(self):
+        """清除所有數值（fork 出的子行程不沿用父行程的數值）"""
+        for metric in list(self._metrics.values()):
+            metric.reset()
+
+    def snapshot(self) -> dict:
+        """目前行程所有指標的數值（可序列化為 JSON）"""
+        return {
+            name: {
+                'type': metric.type,
+                'help': metric.help,
+                'labelnames': list(metric.labelnames),
+                'buckets': list(getattr(metric, 'buckets', ())),
+                'samples': [[list(values), value] for values, value in metric.samples().items()],
+            }
+            for name, metric in list(self._metrics.items())
+        }
+
+    # ---- 多 worker ----
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(METRICS_DIR, f"metrics-{pid}.json")
+
+    def flush(self):
+        """把目前行程的數值寫入 METRICS_DIR（先寫暫存檔再改名，讀取端不會看到寫一半的檔案）"""
+        if not METRICS_DIR:
+            return
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = self._path(os.getpid())
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'pid': os.getpid(), 'time': time.time(), 'metrics': self.snapshot()}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"寫入監控指標檔案失敗: {e}")
+
+    def start(self):
+        """啟動定期寫檔的背景執行緒（未設定 METRICS_DIR 時不需要）"""
+        if not METRICS_DIR or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+    def _collect(self) -> list:
+        """讀取所有 worker 的數值；目前行程直接使用記憶體中的最新數值"""
+        snapshots = [self.snapshot()]
+        if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+            return snapshots
+
+        own_path = self._path(os.getpid())
+        for filename in os.listdir(METRICS_DIR):
+            path = os.path.join(METRICS_DIR, filename)
+            if not filename.endswith('.json') or path == own_path:
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            metrics = data.get('metrics', {})
+            if not _pid_alive(data.get('pid')):
+                # 已結束的 worker：gauge 不再有意義，counter / histogram 保留以維持遞增
+                metrics = {name: m for name, m in metrics.items() if m['type'] != 'gauge'}
+            snapshots.append(metrics)
+        return snapshots
+
+    def render(self) -> str:
+        """輸出 Prometheus 文字格式（合併所有 worker）"""
+        merged = {}
+        for snapshot in self._collect():
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, {
+                    'type': metric['type'],
+                    'help': metric['help'],
+                    'labelnames': metric['labelnames'],
+                    'buckets': metric['buckets'],
+                    'samples': {},
+                })
+                for values, value in metric['samples']:
+                    key = tuple(values)
+                    target['samples'][key] = _add(target['samples'].get(key), value)
+
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            labelnames = metric['labelnames']
+            for values, value in sorted(metric['samples'].items()):
+                if metric['type'] == 'histogram':
+                    cumulative, total, count = value
+                    for bound, bucket_count in zip(metric['buckets'], cumulative):
+                        labels = _format_labels(labelnames, values, ('le', _format_value(bound)))
+                        lines.append(f"{name}_bucket{labels} {bucket_count}")
+                    labels = _format_labels(labelnames, values, ('le', '+Inf'))
+                    lines.append(f"{name}_bucket{labels} {count}")
+                    labels = _format_labels(labelnames, values)
+                    lines.append(f"{name}_sum{labels} {_format_value(total)}")
+                    lines.append(f"{name}_count{labels} {count}")
+                else:
+                    lines.append(f"{name}{_format_labels(labelnames, values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid) -> bool:
+    if not isinstance(pid, int):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _add(current, value):
+    if current is None:
+        return value
+    if isinstance(value, list):
+        return [
+            [a + b for a, b in zip(current[0], value[0])],
+            current[1] + value[1],
+            current[2] + value[2],
+        ]
+    return current + value
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if not isinstance(value, int) else str(value)
+
+
+REGISTRY = Registry()
+os.register_at_fork(after_in_child=REGISTRY.reset)
+
+
+class timer:
+    """
+    計時並記錄到 histogram 子項目；例外時遞增錯誤計數，期間遞增處理中 gauge
+    可當 context manager 或裝飾器使用（裝飾器也支援 async 函式與產生器函式；
+    產生器從第一次取值計時到迭代結束或被 close()，提前停止迭代不算錯誤）
+    """
+
+    __slots__ = ('histogram', 'errors', 'inflight', '_start')
+
+    def __init__(self, histogram, errors=None, inflight=None):
+        self.histogram = histogram
+        self.errors = errors
+        self.inflight = inflight
+
+    def __enter__(self):
+        if self.inflight is not None:
+            self.inflight.inc()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self._start)
+        if self.inflight is not None:
+            self.inflight.dec()
+        if exc_type is not None and exc_type is not GeneratorExit and self.errors is not None:
+            self.errors.inc()
+        return False
+
+    def __call__(self, func):
+        histogram, errors, inflight = self.histogram, self.errors, self.inflight
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timer(histogram, errors, inflight):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                with timer(histogram, errors, inflight):
+                    yield from func(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(histogram, errors, inflight):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def instrument(histogram: Histogram, errors: Counter = None, inflight: Gauge = None):
+    """
+    產生以函式名稱為標籤的計時裝飾器
+    例：db_call = instrument(DB_CALL_SECONDS, DB_CALL_ERRORS, DB_CALL_INFLIGHT)
+        @db_call
+        def get_member_count(): ...
+    """
+    def decorator(func):
+        label = func.__name__
+        return timer(
+            histogram.labels(label),
+            errors.labels(label) if errors is not None else None,
+            inflight.labels(label) if inflight is not None else None
+        )(func)
+    return decorator
+
+
+# ---- 各模組共用的指標 ----
+
+WEBHOOK_SECONDS = Histogram(
+    'linebot_webhook_request_seconds', '/callback 請求處理時間（非同步模式只含驗證與排入佇列）')
+WEBHOOK_ERRORS = Counter(
+    'linebot_webhook_errors_total', '/callback 錯誤數', ['reason'])
+WEBHOOK_INFLIGHT = Gauge(
+    'linebot_webhook_inflight', '處理中的 /callback 請求數')
+
+EVENT_SECONDS = Histogram(
+    'linebot_event_seconds', '單一訊息事件的處理時間', ['kind'])
+EVENT_ERRORS = Counter(
+    'linebot_event_errors_total', '訊息事件處理失敗數')
+
+LINE_API_SECONDS = Histogram(
+    'linebot_line_api_seconds', 'LINE API 呼叫時間', ['endpoint'])
+LINE_API_ERRORS = Counter(
+    'linebot_line_api_errors_total', 'LINE API 呼叫失敗數', ['endpoint'])
+LINE_API_INFLIGHT = Gauge(
+    'linebot_line_api_inflight', '進行中的 LINE API 呼叫數', ['endpoint'])
+
+DB_CALL_SECONDS = Histogram(
+    'linebot_db_call_seconds', 'database.py 函式執行時間（含等待連線）', ['function'])
+DB_CALL_ERRORS = Counter(
+    'linebot_db_call_errors_total', 'database.py 函式失敗數', ['function'])
+DB_CALL_INFLIGHT = Gauge(
+    'linebot_db_call_inflight', '執行中的 database.py 函式數', ['function'])
+DB_STATEMENTS = Counter(
+    'linebot_db_statements_total', '送到資料庫的 SQL 語句數')
+DB_TRANSACTIONS = Counter(
+    'linebot_db_transactions_total', '結束的交易數', ['outcome'])
+
+MESSAGE_BUILD_SECONDS = Histogram(
+    'linebot_message_build_seconds', '訊息（Flex / 文字）建構時間', ['builder'], buckets=FAST_BUCKETS)
+
+REPLY_TOKEN_AGE = Histogram(
+    'linebot_reply_token_age_seconds', '回覆時 reply token 的年齡（距 webhook 事件時間）', buckets=TOKEN_AGE_BUCKETS)
+REPLY_FALLBACKS = Counter(
+    'linebot_reply_push_fallbacks_total', '改用 push 送出的回覆數', ['reason'])
+
+COMMAND_SECONDS = Histogram(
+    'linebot_command_seconds', '指令處理時間', ['command'])
+COMMAND_ERRORS = Counter(
+    'linebot_command_errors_total', '指令處理失敗數', ['command'])
+COMMAND_INFLIGHT = Gauge(
+    'linebot_command_inflight', '處理中的指令數', ['command'])
+COMMAND_RATE_LIMITED = Counter(
+    'linebot_command_rate_limited_total', '超過頻率限制而未執行的指令數')
@@ -0,0 +1,93 @@
+"""
+名稱比對鍵模組
+成員輸入名稱時常混用全形／半形、大小寫與繁簡字，查詢一律以正規化後的「比對鍵」比較：
+  NFKC（全形英數、相容字元轉為一般字元）→ 去除前後空白 → 忽略大小寫 → 繁體字轉為簡體字
+資料庫以相同規則的 SQL 函式 name_key() 維護 members / pending_users 的 *_key 欄位（見 database.init_db），
+本模組的 name_key() 供行程內的成員名錄與組合 LIKE 樣式使用
+
+繁簡對照為常用字的逐字對照表（一個字轉為一個字，可多個繁體字對應同一簡體字，如「發」「髮」→「发」），
+簡化後仍有兩種寫法的字（如「著」「乾」）不列入，維持原字比對；
+SQL 端以 lower() 忽略大小寫，除 ß 等少數字元外與 casefold() 結果相同
+"""
+
+import unicodedata
+
+# 繁體 → 簡體（每兩個字一組）
+_PAIRS = '''
+愛爱 罷罢 備备 貝贝 筆笔 畢毕 邊边 賓宾 標标 別别 補补 財财 參参 殘残 蠶蚕 倉仓 艙舱 層层
+產产 場场 長长 嘗尝 腸肠 廠厂 暢畅 車车 徹彻 塵尘 陳陈 襯衬 稱称 懲惩 誠诚 馳驰 齒齿 蟲虫
+籌筹 綢绸 醜丑 處处 觸触 傳传 創创 純纯 詞词 辭辞 從从 叢丛 聰聪 湊凑 錯错 達达 帶带 貸贷
+擔担 單单 膽胆 彈弹 當当 擋挡 黨党 蕩荡 導导 燈灯 鄧邓 敵敌 遞递 點点 電电 頂顶 訂订 東东
+動动 棟栋 凍冻 鬥斗 獨独 讀读 賭赌 斷断 隊队 對对 噸吨 頓顿 奪夺 墮堕 惡恶 兒儿 爾尔 發发
+髮发 罰罚 閥阀 範范 飯饭 訪访 紡纺 飛飞 廢废 費费 紛纷 墳坟 奮奋 憤愤 糞粪 豐丰 風风 瘋疯
+鋒锋 馮冯 縫缝 諷讽 鳳凤 膚肤 輔辅 撫抚 婦妇 復复 複复 負负 該该 蓋盖 幹干 趕赶 岡冈 剛刚
+鋼钢 綱纲 閣阁 個个 鞏巩 貢贡 溝沟 構构 購购 夠够 顧顾 觀观 關关 館馆 慣惯 貫贯 廣广 規规
+歸归 龜龟 櫃柜 貴贵 鍋锅 國国 過过 漢汉 號号 賀贺 紅红 後后 鬍胡 壺壶 護护 滬沪 華华 畫画
+劃划 話话 歡欢 還还 環环 換换 喚唤 煥焕 黃黄 謊谎 揮挥 輝辉 匯汇 會会 繪绘 葷荤 渾浑 夥伙
+貨货 禍祸 擊击 機机 積积 極极 級级 幾几 計计 記记 紀纪 際际 濟济 繼继 夾夹 價价 駕驾 堅坚
+殲歼 監监 儉俭 檢检 減减 簡简 見见 艦舰 劍剑 薦荐 鑑鉴 鍵键 漸渐 將将 獎奖 講讲 醬酱 膠胶
+驕骄 嬌娇 腳脚 餃饺 繳缴 較较 轎轿 階阶 節节 潔洁 結结 誡诫 屆届 緊紧 錦锦 僅仅 謹谨 進进
+盡尽 儘尽 勁劲 經经 莖茎 驚惊 鏡镜 競竞 淨净 糾纠 舊旧 舉举 據据 劇剧 懼惧 捲卷 絕绝 覺觉
+軍军 開开 凱凯 顆颗 殼壳 課课 墾垦 懇恳 庫库 誇夸 塊块 寬宽 礦矿 況况 虧亏 擴扩 闊阔 蠟蜡
+來来 賴赖 藍蓝 欄栏 攔拦 籃篮 蘭兰 爛烂 濫滥 勞劳 樂乐 淚泪 類类 壘垒 離离 裡里 裏里 禮礼
+麗丽 厲厉 勵励 歷历 曆历 隸隶 倆俩 聯联 蓮莲 連连 憐怜 簾帘 臉脸 戀恋 煉炼 練练 糧粮 兩两
+輛辆 諒谅 療疗 遼辽 獵猎 鄰邻 臨临 鱗鳞 靈灵 齡龄 嶺岭 領领 劉刘 龍龙 聾聋 樓楼 婁娄 盧卢
+蘆芦 爐炉 滷卤 陸陆 錄录 驢驴 呂吕 鋁铝 屢屡 縷缕 慮虑 濾滤 綠绿 亂乱 倫伦 輪轮 論论 羅罗
+邏逻 鑼锣 騾骡 絡络 駱骆 媽妈 瑪玛 碼码 螞蚂 馬马 罵骂 嗎吗 買买 麥麦 賣卖 邁迈 瞞瞒 饅馒
+蠻蛮 滿满 貓猫 錨锚 貿贸 麼么 沒没 鎂镁 門门 們们 悶闷 夢梦 謎谜 彌弥 覓觅 綿绵 緬缅 廟庙
+滅灭 憫悯 閩闽 鳴鸣 銘铭 謬谬 謀谋 畝亩 鈉钠 納纳 難难 撓挠 腦脑 惱恼 鬧闹 內内 擬拟 膩腻
+釀酿 鳥鸟 聶聂 鎳镍 檸柠 獰狞 寧宁 擰拧 濘泞 紐纽 農农 濃浓 膿脓 諾诺 歐欧 鷗鸥 毆殴 嘔呕
+盤盘 龐庞 賠赔 噴喷 鵬鹏 騙骗 飄飘 頻频 貧贫 蘋苹 憑凭 評评 潑泼 頗颇 撲扑 鋪铺 樸朴 譜谱
+齊齐 騎骑 豈岂 啟启 氣气 棄弃 訖讫 牽牵 鉛铅 遷迁 簽签 謙谦 錢钱 鉗钳 潛潜 淺浅 譴谴 塹堑
+槍枪 嗆呛 牆墙 薔蔷 強强 搶抢 橋桥 喬乔 僑侨 翹翘 竅窍 竊窃 親亲 寢寝 輕轻 氫氢 傾倾 頃顷
+請请 慶庆 瓊琼 窮穷 趨趋 區区 軀躯 驅驱 齲龋 顴颧 權权 勸劝 卻却 鵲鹊 確确 讓让 饒饶 擾扰
+繞绕 熱热 韌韧 認认 紉纫 榮荣 絨绒 軟软 銳锐 閏闰 潤润 灑洒 薩萨 鰓鳃 賽赛 傘伞 喪丧 騷骚
+掃扫 澀涩 殺杀 紗纱 篩筛 曬晒 刪删 閃闪 陝陕 贍赡 繕缮 傷伤 賞赏 燒烧 紹绍 賒赊 攝摄 懾慑
+設设 紳绅 審审 嬸婶 腎肾 滲渗 聲声 繩绳 勝胜 聖圣 師师 獅狮 濕湿 詩诗 屍尸 時时 蝕蚀 實实
+識识 駛驶 勢势 適适 釋释 飾饰 視视 試试 壽寿 獸兽 樞枢 輸输 書书 贖赎 屬属 術术 樹树 豎竖
+數数 帥帅 雙双 誰谁 稅税 順顺 說说 碩硕 爍烁 絲丝 飼饲 聳耸 慫怂 頌颂 訟讼 誦诵 擻擞 蘇苏
+訴诉 肅肃 雖虽 隨随 綏绥 歲岁 孫孙 損损 筍笋 縮缩 瑣琐 鎖锁 獺獭 撻挞 態态 攤摊 貪贪 癱瘫
+灘滩 壇坛 譚谭 談谈 嘆叹 湯汤 燙烫 濤涛 絛绦 討讨 騰腾 謄誊 銻锑 題题 體体 屜屉 條条 貼贴
+鐵铁 廳厅 聽听 烴烃 銅铜 統统 頭头 禿秃 圖图 塗涂 團团 頹颓 蛻蜕 脫脱 鴕鸵 馱驮 駝驼 橢椭
+窪洼 襪袜 彎弯 灣湾 頑顽 萬万 網网 韋韦 違违 圍围 為为 濰潍 維维 葦苇 偉伟 偽伪 緯纬 謂谓
+衛卫 溫温 聞闻 紋纹 穩稳 問问 甕瓮 撾挝 蝸蜗 渦涡 窩窝 臥卧 嗚呜 鎢钨 烏乌 誣诬 無无 蕪芜
+吳吴 塢坞 霧雾 務务 誤误 錫锡 犧牺 襲袭 習习 銑铣 戲戏 細细 蝦虾 轄辖 峽峡 俠侠 狹狭 廈厦
+嚇吓 鮮鲜 纖纤 鹹咸 賢贤 銜衔 閒闲 顯显 險险 現现 獻献 縣县 餡馅 羨羡 憲宪 線线 廂厢 鑲镶
+鄉乡 詳详 響响 項项 蕭萧 囂嚣 銷销 曉晓 嘯啸 協协 挾挟 攜携 脅胁 諧谐 寫写 瀉泻 謝谢 鋅锌
+釁衅 興兴 洶汹 鏽锈 繡绣 虛虚 噓嘘 須须 許许 敘叙 緒绪 續续 軒轩 懸悬 選选 癬癣 絢绚 學学
+勳勋 詢询 尋寻 馴驯 訓训 訊讯 遜逊 壓压 鴉鸦 鴨鸭 啞哑 亞亚 訝讶 閹阉 煙烟 鹽盐 嚴严 顏颜
+閻阎 艷艳 豔艳 厭厌 硯砚 彥彦 諺谚 驗验 鴦鸯 楊杨 揚扬 瘍疡 陽阳 癢痒 養养 樣样 瑤瑶 搖摇
+堯尧 遙遥 窯窑 謠谣 藥药 爺爷 頁页 業业 葉叶 醫医 銥铱 頤颐 遺遗 儀仪 蟻蚁 藝艺 億亿 憶忆
+義义 詣诣 議议 誼谊 譯译 異异 繹绎 蔭荫 陰阴 銀银 飲饮 隱隐 櫻樱 嬰婴 鷹鹰 應应 纓缨 瑩莹
+螢萤 營营 熒荧 蠅蝇 贏赢 穎颖 擁拥 傭佣 癰痈 踴踊 詠咏 優优 憂忧 郵邮 鈾铀 猶犹 遊游 誘诱
+輿舆 魚鱼 漁渔 娛娱 與与 嶼屿 語语 籲吁 禦御 獄狱 譽誉 預预 馭驭 鴛鸳 淵渊 轅辕 園园 員员
+圓圆 緣缘 遠远 願愿 約约 躍跃 鑰钥 嶽岳 粵粤 悅悦 閱阅 雲云 鄖郧 勻匀 隕陨 運运 蘊蕴 醞酝
+暈晕 韻韵 雜杂 災灾 載载 攢攒 暫暂 贊赞 讚赞 贓赃 髒脏 臟脏 鑿凿 棗枣 竈灶 責责 擇择 則则
+澤泽 賊贼 贈赠 紮扎 劄札 軋轧 鍘铡 閘闸 詐诈 齋斋 債债 氈毡 盞盏 斬斩 輾辗 嶄崭 棧栈 戰战
+綻绽 張张 漲涨 帳帐 賬账 脹胀 趙赵 蟄蛰 轍辙 鍺锗 這这 貞贞 針针 偵侦 診诊 鎮镇 陣阵 掙挣
+睜睁 猙狰 爭争 幀帧 鄭郑 證证 織织 職职 執执 紙纸 摯挚 擲掷 幟帜 質质 滯滞 鐘钟 鍾钟 終终
+種种 腫肿 眾众 衆众 謅诌 軸轴 皺皱 晝昼 驟骤 豬猪 諸诸 誅诛 燭烛 矚瞩 囑嘱 貯贮 鑄铸 築筑
+駐驻 專专 磚砖 轉转 賺赚 樁桩 莊庄 裝装 妝妆 壯壮 狀状 錐锥 贅赘 墜坠 綴缀 諄谆 準准 濁浊
+茲兹 資资 漬渍 蹤踪 綜综 總总 縱纵 鄒邹 詛诅 組组 鑽钻 緻致 蹟迹 跡迹 誌志 捨舍 睏困 製制
+衝冲 徵征 鬆松 穀谷 臺台 颱台 檯台 餘余 隻只 閉闭 間间 閑闲 鬱郁 淒凄 悽凄 戶户 拋抛 暉晖
+燁烨 煒炜 瑋玮 韓韩 蔣蒋 魯鲁 顥颢 曄晔 綺绮 婭娅 嫻娴 靜静 楓枫 鵝鹅 鶴鹤 鸚鹦 鵡鹉 鶯莺
+鯨鲸 鯉鲤 鱷鳄 鯊鲨 驍骁 騏骐 驥骥 殤殇 魘魇 靂雳 霽霁 麵面 餅饼 飽饱 餓饿 饑饥 饞馋 幣币
+'''
+
+_MAPPING = {pair[0]: pair[1] for pair in _PAIRS.split()}
+
+# 供 SQL translate() 使用：兩個字串等長，逐字對應
+TRADITIONAL = ''.join(_MAPPING)
+SIMPLIFIED = ''.join(_MAPPING.values())
+
+_TRANSLATION = str.maketrans(TRADITIONAL, SIMPLIFIED)
+
+
+def name_key(value: str) -> str:
+    """
+    名稱的比對鍵（與資料庫的 SQL 函式 name_key() 規則相同）
+    例：「Ｈｅｒｏ」「HERO」「hero」→ "hero"；「龍騎士」「龙骑士」→「龙骑士」
+    """
+    if value is None:
+        return None
+    return unicodedata.normalize('NFKC', value).strip(' ').casefold().translate(_TRANSLATION)
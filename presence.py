@@ -0,0 +1,279 @@
+"""
+用戶活動紀錄節流模組
+- PresenceDebouncer：一般聊天訊息不需要即時更新 pending_users，每位用戶在
+  PRESENCE_DEBOUNCE_SECONDS 秒內最多寫入一次；間隔只記錄在目前行程的記憶體中（每個 worker 各自計算）
+- PresenceBuffer：要寫入的活動紀錄先放在記憶體，定時或累積到一定數量時以單一語句整批寫入；
+  本行程尚未寫入過的用戶（第一次出現或名稱變更）不放入緩衝，由呼叫端立即寫入
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import database as db
+import metrics
+
+# 一般聊天訊息的活動紀錄寫入間隔（秒，0 = 每則訊息都寫入）
+PRESENCE_DEBOUNCE_SECONDS = float(os.environ.get('PRESENCE_DEBOUNCE_SECONDS', 300))
+PRESENCE_DEBOUNCE_MAX_USERS = int(os.environ.get('PRESENCE_DEBOUNCE_MAX_USERS', 20000))
+# 活動紀錄緩衝的寫入間隔（秒，0 = 不緩衝，直接寫入）與立即寫入的筆數門檻
+PRESENCE_BUFFER_INTERVAL = float(os.environ.get('PRESENCE_BUFFER_INTERVAL', 5))
+PRESENCE_BUFFER_MAX_SIZE = int(os.environ.get('PRESENCE_BUFFER_MAX_SIZE', 500))
+
+
+class PresenceDebouncer:
+    """
+    記錄每位用戶上次寫入活動紀錄的時間
+    - claim()：到期時登記本次寫入並回傳 True（同一用戶同時只有一個呼叫者會拿到）
+    - release()：寫入失敗時取消登記，下一則訊息會重試
+    - touch()：其他路徑（例如指令）已寫入時更新時間
+    - 超過 max_users 時淘汰最久沒有寫入的用戶
+    """
+
+    def __init__(self, interval: float = 300, max_users: int = 20000):
+        self.interval = interval
+        self.max_users = max_users
+        self._written = OrderedDict()  # user_id -> 上次寫入時間（monotonic）
+        self._lock = threading.Lock()
+
+        self.claimed = 0
+        self.skipped = 0
+
+    def is_due(self, user_id: str) -> bool:
+        """是否已到可以再次寫入的時間（不登記）"""
+        with self._lock:
+            return self._is_due(user_id, time.monotonic())
+
+    def _is_due(self, user_id: str, now: float) -> bool:
+        written_at = self._written.get(user_id)
+        return written_at is None or now - written_at >= self.interval
+
+    def claim(self, user_id: str) -> bool:
+        """到期時登記本次寫入並回傳 True，否則回傳 False"""
+        now = time.monotonic()
+        with self._lock:
+            if not self._is_due(user_id, now):
+                self.skipped += 1
+                return False
+            self._mark(user_id, now)
+            self.claimed += 1
+            return True
+
+    def touch(self, user_id: str):
+        """記錄已寫入（不影響統計）"""
+        with self._lock:
+            self._mark(user_id, time.monotonic())
+
+    def release(self, user_id: str):
+        """取消登記"""
+        with self._lock:
+            self._written.pop(user_id, None)
+
+    def _mark(self, user_id: str, now: float):
+        self._written[user_id] = now
+        self._written.move_to_end(user_id)
+        while len(self._written) > self.max_users:
+            self._written.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'tracked': len(self._written),
+                'interval': self.interval,
+                'claimed': self.claimed,
+                'skipped': self.skipped,
+            }
+
+
+presence_debouncer = PresenceDebouncer(
+    interval=PRESENCE_DEBOUNCE_SECONDS,
+    max_users=PRESENCE_DEBOUNCE_MAX_USERS
+)
+
+
+class PresenceBuffer:
+    """
+    活動紀錄寫回緩衝（write-behind）
+    - add()：記下 (用戶, 顯示名稱, 出現時間)，同一用戶只保留最新一筆；
+      本行程還沒確認寫入過這個用戶與名稱時不放入緩衝並回傳 False，由呼叫端立即寫入後呼叫 mark_written()，
+      剛出現的用戶不論在哪個 worker 發言，/代登記 都能馬上在 pending_users 找到
+    - mark_written()：記錄已寫入資料庫的用戶與名稱（最多 max_known 位，淘汰的用戶下次出現時再立即寫入一次）
+    - 背景執行緒每 interval 秒寫入一次；累積到 max_size 筆時提早寫入
+    - flush()：立即寫入（例如 /代登記 查詢 pending_users 之前）；寫入失敗的資料放回緩衝下次重試
+    - stop()：停止背景執行緒並寫入剩餘資料（worker 結束時呼叫）
+    背景執行緒在第一次 add() 時啟動，fork 之後會重新啟動；
+    background 設為 False 時不啟動，改由呼叫端以 drain() / restore() 自行寫入（例如 async_app）
+    """
+
+    def __init__(self, writer, interval: float = 5, max_size: int = 500, max_known: int = 20000):
+        self.writer = writer
+        self.interval = interval
+        self.max_size = max(1, max_size)
+        self.max_known = max_known
+
+        self._entries = {}  # user_id -> (user_id, display_name, 出現時間)
+        self._known = OrderedDict()  # user_id -> 已寫入資料庫的顯示名稱
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self.background = True
+
+        self.added = 0
+        self.bypassed = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    @property
+    def full(self) -> bool:
+        """是否已累積到需要提早寫入的筆數"""
+        return len(self._entries) >= self.max_size
+
+    def add(self, user_id: str, display_name: str) -> bool:
+        """
+        加入一筆活動紀錄
+        回傳: 是否已放入緩衝；False 表示需要由呼叫端立即寫入（寫入成功後呼叫 mark_written()）
+        """
+        if self.background:
+            self._ensure_started()
+        with self._lock:
+            if self._known.get(user_id) != display_name:
+                # 緩衝中較舊的紀錄捨棄，以立即寫入的為準
+                self._entries.pop(user_id, None)
+                self.bypassed += 1
+                return False
+            self._entries[user_id] = (user_id, display_name, time.time())
+            self.added += 1
+            full = len(self._entries) >= self.max_size
+        if full:
+            self._wake.set()
+        return True
+
+    def mark_written(self, entries):
+        """記錄已寫入資料庫的活動紀錄 [(user_id, display_name, ...)]"""
+        with self._lock:
+            for user_id, display_name, *_ in entries:
+                self._known[user_id] = display_name
+                self._known.move_to_end(user_id)
+            while len(self._known) > self.max_known:
+                self._known.popitem(last=False)
+
+    def flush(self) -> int:
+        """
+        將緩衝中的資料整批寫入
+        回傳: 寫入的筆數（失敗時為 0）
+        """
+        with self._flush_lock:
+            entries = self.drain()
+            if not entries:
+                return 0
+            try:
+                self.writer(entries)
+            except Exception as e:
+                print(f"寫入活動紀錄失敗（{len(entries)} 筆，稍後重試）: {e}")
+                self.restore(entries)
+                return 0
+            self.record_flush(entries)
+            return len(entries)
+
+    def drain(self) -> list:
+        """取出緩衝中的所有資料 [(user_id, display_name, 出現時間)]"""
+        with self._lock:
+            entries, self._entries = self._entries, {}
+        return list(entries.values())
+
+    def restore(self, entries):
+        """放回寫入失敗的資料；寫入期間又有新紀錄的用戶以新紀錄為準"""
+        with self._lock:
+            self.failures += 1
+            for entry in entries:
+                self._entries.setdefault(entry[0], entry)
+
+    def record_flush(self, entries):
+        """記錄一次成功寫入"""
+        self.mark_written(entries)
+        with self._lock:
+            self.flushes += 1
+            self.flushed += len(entries)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # fork 之後緩衝屬於父行程，子行程從空的緩衝開始
+            self._entries = {}
+            self._flush_lock = threading.Lock()
+            self._stopping = False
+            self._wake = threading.Event()
+            self._thread = threading.Thread(target=self._flush_loop, name='presence-buffer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _flush_loop(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def stop(self, timeout: float = 10):
+        """停止背景執行緒並寫入剩餘資料"""
+        if self._pid == os.getpid():
+            self._stopping = True
+            self._wake.set()
+            self._thread.join(timeout)
+            self._pid = None
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'pending': len(self._entries),
+                'interval': self.interval,
+                'added': self.added,
+                'bypassed': self.bypassed,
+                'flushes': self.flushes,
+                'flushed': self.flushed,
+                'failures': self.failures,
+            }
+
+
+presence_buffer = PresenceBuffer(
+    writer=db.record_presence_batch,
+    interval=PRESENCE_BUFFER_INTERVAL,
+    max_size=PRESENCE_BUFFER_MAX_SIZE,
+    max_known=PRESENCE_DEBOUNCE_MAX_USERS
+)
+
+# 輸出 /metrics 時才讀取統計資料
+metrics.CallbackMetric(
+    'linebot_presence_debounce_total', '一般聊天訊息的活動紀錄節流結果', 'counter',
+    lambda: {
+        (result,): presence_debouncer.stats()[result] for result in ('claimed', 'skipped')
+    },
+    ['result']
+)
+metrics.CallbackMetric(
+    'linebot_presence_buffer_pending', '活動紀錄緩衝中等待寫入的筆數', 'gauge',
+    lambda: presence_buffer.stats()['pending']
+)
+metrics.CallbackMetric(
+    'linebot_presence_buffer_flushed_total', '活動紀錄緩衝寫入的筆數', 'counter',
+    lambda: presence_buffer.stats()['flushed']
+)
+metrics.CallbackMetric(
+    'linebot_presence_buffer_flushes_total', '活動紀錄緩衝整批寫入次數', 'counter',
+    lambda: {
+        (result,): presence_buffer.stats()[key] for result, key in (('ok', 'flushes'), ('failed', 'failures'))
+    },
+    ['result']
+)
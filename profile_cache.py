@@ -0,0 +1,145 @@
+"""
+LINE 使用者名稱快取模組
+以 (來源類型, 群組/聊天室 ID, 使用者 ID) 為 key 的 TTL + LRU 快取
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 5000))
+PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', 600))
+PROFILE_CACHE_NEGATIVE_TTL = float(os.environ.get('PROFILE_CACHE_NEGATIVE_TTL', 30))
+
+
+class ProfileCache:
+    """
+    有上限的顯示名稱快取
+    - 成功取得的名稱保留 ttl 秒
+    - 取得失敗的結果保留 negative_ttl 秒，避免 LINE API 異常時每則訊息都重試
+    - 超過 max_size 時淘汰最久未使用的項目
+    """
+
+    def __init__(self, max_size: int = 5000, ttl: float = 600, negative_ttl: float = 30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()  # key -> (display_name, expires_at, is_negative)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(source, user_id: str) -> tuple:
+        """依據訊息來源建立快取 key"""
+        source_type = getattr(source, 'type', None)
+        if source_type == 'group':
+            return ('group', source.group_id, user_id)
+        if source_type == 'room':
+            return ('room', source.room_id, user_id)
+        return ('user', None, user_id)
+
+    def get(self, key):
+        """
+        取得快取名稱
+        回傳: (found, display_name)；失敗結果的 display_name 為 None
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            display_name, expires_at, is_negative = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            if is_negative:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, display_name
+
+    def peek(self, key):
+        """取得未過期的名稱但不影響統計與 LRU 順序"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic() or entry[2]:
+                return None
+            return entry[0]
+
+    def put(self, key, display_name: str):
+        """寫入成功取得的名稱"""
+        self._store(key, display_name, self.ttl, False)
+
+    def put_negative(self, key):
+        """寫入取得失敗的結果"""
+        self._store(key, None, self.negative_ttl, True)
+
+    def _store(self, key, display_name, ttl: float, is_negative: bool):
+        with self._lock:
+            self._entries[key] = (display_name, time.monotonic() + ttl, is_negative)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def note_refresh(self):
+        """記錄一次強制重新取得"""
+        with self._lock:
+            self.refreshes += 1
+
+    def invalidate(self, key=None):
+        """清除指定 key 或全部快取"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        """命中/未命中統計"""
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'evictions': self.evictions,
+                'hit_ratio': round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+profile_cache = ProfileCache(
+    max_size=PROFILE_CACHE_SIZE,
+    ttl=PROFILE_CACHE_TTL,
+    negative_ttl=PROFILE_CACHE_NEGATIVE_TTL
+)
+
+# 輸出 /metrics 時才讀取統計資料
+metrics.CallbackMetric(
+    'linebot_profile_cache_lookups_total', '顯示名稱快取查詢數', 'counter',
+    lambda: {
+        (result,): profile_cache.stats()[key]
+        for result, key in (('hit', 'hits'), ('negative_hit', 'negative_hits'), ('miss', 'misses'))
+    },
+    ['result']
+)
+metrics.CallbackMetric(
+    'linebot_profile_cache_entries', '顯示名稱快取筆數', 'gauge',
+    lambda: profile_cache.stats()['size']
+)
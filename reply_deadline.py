@@ -0,0 +1,82 @@
+"""
+Reply token 期限模組
+LINE 的 reply token 在事件發生後一段時間就會失效，處理太慢時 reply_message 會失敗、使用者收不到回覆。
+- 從 webhook 事件的 timestamp 計算 token 年齡並記錄到監控指標
+- 年齡已超過 REPLY_TOKEN_BUDGET，或 reply 回傳 token 無效時，同一則訊息改用 push 送到事件來源
+  （push 會計入官方帳號的訊息額度，只在 reply 無法使用時才會用到）
+"""
+
+import os
+import time
+
+from linebot.v3.messaging import ApiException
+
+import line_client
+import metrics
+
+# 事件發生後超過此秒數就不再嘗試 reply，直接改用 push（reply token 約一分鐘後失效，保留餘裕）
+REPLY_TOKEN_BUDGET = float(os.environ.get('REPLY_TOKEN_BUDGET', 50))
+# 1 = reply 無法使用時改用 push；0 = 不改用（維持 reply 失敗）
+REPLY_PUSH_FALLBACK = os.environ.get('REPLY_PUSH_FALLBACK', '1') == '1'
+
+_TOKEN_AGE = metrics.REPLY_TOKEN_AGE.labels()
+_FALLBACKS = {
+    reason: metrics.REPLY_FALLBACKS.labels(reason)
+    for reason in ('expired', 'invalid_token')
+}
+
+
+def token_age(event, now: float = None) -> float:
+    """事件發生到現在的秒數（webhook timestamp 為毫秒）"""
+    if now is None:
+        now = time.time()
+    timestamp = getattr(event, 'timestamp', None)
+    if not timestamp:
+        return 0.0
+    return max(0.0, now - timestamp / 1000)
+
+
+def check_budget(event):
+    """
+    回覆前呼叫：記錄 token 年齡
+    回傳: 需要直接改用 push 時回傳 'expired'，否則回傳 None
+    """
+    age = token_age(event)
+    _TOKEN_AGE.observe(age)
+    if REPLY_PUSH_FALLBACK and age >= REPLY_TOKEN_BUDGET:
+        return 'expired'
+    return None
+
+
+def is_invalid_reply_token(error: Exception) -> bool:
+    """reply 失敗的原因是否為 reply token 無效（過期或已使用），且允許改用 push"""
+    if not REPLY_PUSH_FALLBACK or not isinstance(error, ApiException) or error.status != 400:
+        return False
+    body = error.body
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+    return 'invalid reply token' in (body or '').lower()
+
+
+def push_target(source):
+    """push 的對象：群組、聊天室或用戶本人"""
+    source_type = getattr(source, 'type', None)
+    if source_type == 'group':
+        return source.group_id
+    if source_type == 'room':
+        return source.room_id
+    return getattr(source, 'user_id', None)
+
+
+def push_request(event, messages: list, reason: str):
+    """
+    建立改用 push 的請求並記錄原因（'expired' / 'invalid_token'）
+    回傳: push API 的 call_api 參數（line_client.push_call）；事件沒有可推送的對象時回傳 None
+    """
+    target = push_target(event.source)
+    if not target:
+        print(f"reply token 無法使用（{reason}），且事件沒有可推送的對象")
+        return None
+    _FALLBACKS[reason].inc()
+    print(f"reply token 無法使用（{reason}，年齡 {token_age(event):.1f} 秒），改用 push")
+    return line_client.push_call(target, messages)
@@ -0,0 +1,236 @@
+"""
+指令路由模組
+- 指令與別名對應到處理函式，並宣告權限、是否寫入資料、是否需要最新 LINE 顯示名稱
+- 中介層（middleware）依序包住處理函式，處理計時、權限檢查、頻率限制等共通邏輯
+- match() 讓 webhook 在取得顯示名稱、查資料庫之前就能判斷訊息是不是指令
+"""
+
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# 每位使用者在 COMMAND_RATE_WINDOW 秒內最多可執行的指令數（0 = 不限制）
+COMMAND_RATE_LIMIT = int(os.environ.get('COMMAND_RATE_LIMIT', 20))
+COMMAND_RATE_WINDOW = float(os.environ.get('COMMAND_RATE_WINDOW', 60))
+# 處理時間超過此毫秒數的指令會記錄到 log（0 = 不記錄）
+COMMAND_SLOW_MS = float(os.environ.get('COMMAND_SLOW_MS', 1000))
+
+# 處理函式可以宣告的參數，依名稱從 CommandContext 帶入
+CONTEXT_PARAMS = ('line_user_id', 'line_display_name', 'args', 'ctx')
+
+
+class Command:
+    """
+    指令定義
+    - admin_only：僅限管理員（由權限中介層檢查）
+    - writes：會寫入資料
+    - needs_display_name：需要最新的 LINE 顯示名稱（webhook 會強制重新取得）
+    """
+
+    def __init__(self, name: str, handler, aliases=(), admin_only: bool = False,
+                 writes: bool = False, needs_display_name: bool = False):
+        self.name = name
+        self.handler = handler
+        self.aliases = tuple(aliases)
+        self.admin_only = admin_only
+        self.writes = writes
+        self.needs_display_name = needs_display_name
+
+        params = inspect.signature(handler).parameters
+        unknown = [p for p in params if p not in CONTEXT_PARAMS]
+        if unknown:
+            raise ValueError(f"指令 {name} 的處理函式有無法帶入的參數: {unknown}")
+        self._params = tuple(params)
+
+    def call(self, ctx: 'CommandContext'):
+        """依處理函式宣告的參數呼叫"""
+        return self.handler(**{p: (ctx if p == 'ctx' else getattr(ctx, p)) for p in self._params})
+
+    def __repr__(self):
+        return f"Command({self.name!r})"
+
+
+class CommandContext:
+    """一次指令呼叫的內容；is_admin 第一次讀取時才查詢，同一次呼叫內共用結果"""
+
+    def __init__(self, router: 'CommandRouter', command: Command, line_user_id: str,
+                 line_display_name: str, args: str):
+        self.router = router
+        self.command = command
+        self.line_user_id = line_user_id
+        self.line_display_name = line_display_name
+        self.args = args
+        self._is_admin = None
+
+    @property
+    def is_admin(self) -> bool:
+        if self._is_admin is None:
+            self._is_admin = bool(self.router.is_admin(self.line_user_id))
+        return self._is_admin
+
+
+class CommandRouter:
+    """
+    指令路由
+    - is_admin(line_user_id)：權限檢查函式，供 CommandContext.is_admin 使用
+    - middleware(ctx, call_next)：依註冊順序由外而內包住處理函式，
+      可以直接回傳訊息（不呼叫 call_next）來中止處理
+    """
+
+    def __init__(self, is_admin=None):
+        self.is_admin = is_admin
+        self._commands = {}
+        self._middleware = []
+
+    def command(self, name: str, aliases=(), **options):
+        """註冊指令的裝飾器"""
+        def decorator(handler):
+            self.register(Command(name, handler, aliases, **options))
+            return handler
+        return decorator
+
+    def register(self, command: Command):
+        for key in (command.name,) + command.aliases:
+            key = key.lower()
+            if key in self._commands:
+                raise ValueError(f"指令 {key} 重複註冊")
+            self._commands[key] = command
+        return command
+
+    def use(self, middleware):
+        """加入中介層"""
+        self._middleware.append(middleware)
+        return middleware
+
+    @property
+    def commands(self) -> list:
+        """所有指令（不含別名，依註冊順序）"""
+        return list(dict.fromkeys(self._commands.values()))
+
+    @staticmethod
+    def split(text: str):
+        """
+        分離指令和參數
+        回傳: (小寫的指令, 參數)；不是以 / 開頭時回傳 (None, '')
+        """
+        text = text.strip()
+        if not text.startswith('/'):
+            return None, ''
+        parts = text.split(maxsplit=1)
+        return parts[0].lower(), parts[1] if len(parts) > 1 else ""
+
+    def match(self, text: str):
+        """回傳訊息對應的 Command，不是指令時回傳 None（不做任何 I/O）"""
+        name, _ = self.split(text)
+        if name is None:
+            return None
+        return self._commands.get(name)
+
+    def dispatch(self, line_user_id: str, line_display_name: str, text: str):
+        """
+        執行指令
+        回傳: 處理函式的回傳值；不是指令時回傳 None
+        """
+        name, args = self.split(text)
+        command = self._commands.get(name) if name else None
+        if command is None:
+            return None
+
+        ctx = CommandContext(self, command, line_user_id, line_display_name, args)
+
+        def call(index):
+            if index == len(self._middleware):
+                return command.call(ctx)
+            return self._middleware[index](ctx, lambda: call(index + 1))
+
+        return call(0)
+
+
+class CommandTimer:
+    """計時中介層：記錄每個指令的處理時間、失敗數與處理中數量（metrics.COMMAND_*）"""
+
+    def __init__(self, slow_ms: float = COMMAND_SLOW_MS):
+        self.slow_ms = slow_ms
+        self._children = {}  # 指令名稱 -> (處理時間, 失敗數, 處理中數量) 的指標子項
+
+    def _metrics_for(self, name: str) -> tuple:
+        """每個指令只在第一次執行時查詢一次指標子項，之後直接重用"""
+        children = self._children.get(name)
+        if children is None:
+            children = (metrics.COMMAND_SECONDS.labels(name),
+                        metrics.COMMAND_ERRORS.labels(name),
+                        metrics.COMMAND_INFLIGHT.labels(name))
+            self._children[name] = children
+        return children
+
+    def __call__(self, ctx: CommandContext, call_next):
+        name = ctx.command.name
+        start = time.perf_counter()
+        try:
+            with metrics.timer(*self._metrics_for(name)):
+                return call_next()
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if self.slow_ms and elapsed_ms >= self.slow_ms:
+                print(f"指令 {name} 處理較慢: {elapsed_ms:.0f} ms")
+
+
+class RateLimiter:
+    """
+    頻率限制中介層（每位使用者一個 token bucket，只在目前行程內計算）
+    超過限制時，每個時間窗只回覆一次 on_limited() 的訊息，其餘直接略過不回覆
+    """
+
+    def __init__(self, on_limited, limit: int = COMMAND_RATE_LIMIT,
+                 window: float = COMMAND_RATE_WINDOW, max_users: int = 10000):
+        self.on_limited = on_limited
+        self.limit = limit
+        self.window = window
+        self.max_users = max_users
+
+        self._lock = threading.Lock()
+        # user_id -> [剩餘 token, 上次補充時間, 上次提醒時間]
+        self._buckets = OrderedDict()
+        self.limited = 0
+
+    def allow(self, line_user_id: str):
+        """
+        回傳: (是否允許, 是否需要提醒使用者)
+        """
+        if self.limit <= 0:
+            return True, False
+
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(line_user_id)
+            if bucket is None:
+                bucket = [float(self.limit), now, None]
+                self._buckets[line_user_id] = bucket
+                if len(self._buckets) > self.max_users:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(line_user_id)
+                refill = (now - bucket[1]) * self.limit / self.window
+                bucket[0] = min(float(self.limit), bucket[0] + refill)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True, False
+
+            self.limited += 1
+            metrics.COMMAND_RATE_LIMITED.inc()
+            notify = bucket[2] is None or now - bucket[2] >= self.window
+            if notify:
+                bucket[2] = now
+            return False, notify
+
+    def __call__(self, ctx: CommandContext, call_next):
+        allowed, notify = self.allow(ctx.line_user_id)
+        if allowed:
+            return call_next()
+        return self.on_limited() if notify else None
@@ -0,0 +1,77 @@
+"""
+Webhook 流量錄製模組
+設定 WEBHOOK_CAPTURE_FILE 後，/callback 收到的（簽章正確的）請求內容會附加到 JSONL 檔案，
+供 benchmarks/replay.py 重播。使用者、群組、聊天室 ID 以 HMAC 匿名化，
+同一個 ID 每次都對應到同一個匿名 ID，保留「誰在哪個群組說話」的流量結構。
+
+每行格式：{"t": 收到時間（Unix 秒）, "body": 匿名化後的 webhook 內容}
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+WEBHOOK_CAPTURE_FILE = os.environ.get('WEBHOOK_CAPTURE_FILE')
+# 匿名化金鑰；未設定時由 channel secret 衍生（不知道 secret 就無法由匿名 ID 反推）
+WEBHOOK_CAPTURE_KEY = os.environ.get('WEBHOOK_CAPTURE_KEY')
+
+ID_FIELDS = ('userId', 'groupId', 'roomId')
+
+
+class WebhookCapture:
+    """將 webhook 內容匿名化後附加到檔案（多個 worker 可同時寫入同一個檔案）"""
+
+    def __init__(self, path: str, key: bytes):
+        self.path = path
+        self.key = key
+        self._lock = threading.Lock()
+        self.captured = 0
+
+    def anonymize_id(self, value: str) -> str:
+        """保留開頭的類型字母（U / C / R），其餘換成 HMAC"""
+        if not value:
+            return value
+        digest = hmac.new(self.key, value.encode(), hashlib.sha256).hexdigest()[:32]
+        return value[0] + digest
+
+    def _anonymize(self, node):
+        if isinstance(node, dict):
+            return {
+                key: self.anonymize_id(value) if key in ID_FIELDS and isinstance(value, str)
+                else self._anonymize(value)
+                for key, value in node.items()
+            }
+        if isinstance(node, list):
+            return [self._anonymize(item) for item in node]
+        return node
+
+    def record(self, body: str):
+        """附加一筆請求內容（失敗只記錄 log，不影響 webhook 處理）"""
+        try:
+            payload = self._anonymize(json.loads(body))
+            line = json.dumps({'t': round(time.time(), 3), 'body': payload}, ensure_ascii=False) + '\n'
+            # O_APPEND 單次寫入整行，多個 worker 同時寫入也不會交錯
+            with self._lock:
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                try:
+                    os.write(fd, line.encode('utf-8'))
+                finally:
+                    os.close(fd)
+                self.captured += 1
+        except (OSError, ValueError) as e:
+            print(f"錄製 Webhook 失敗: {e}")
+
+
+def create_capture(channel_secret: str):
+    """依環境變數建立 WebhookCapture；未設定 WEBHOOK_CAPTURE_FILE 時回傳 None"""
+    if not WEBHOOK_CAPTURE_FILE:
+        return None
+    if WEBHOOK_CAPTURE_KEY:
+        key = WEBHOOK_CAPTURE_KEY.encode()
+    else:
+        key = hmac.new(channel_secret.encode(), b'webhook-capture', hashlib.sha256).digest()
+    print(f"Webhook 錄製已啟用: {WEBHOOK_CAPTURE_FILE}")
+    return WebhookCapture(WEBHOOK_CAPTURE_FILE, key)
@@ -0,0 +1,341 @@
+"""
+Webhook 背景處理模組
+/callback 只驗證簽章並將事件放入佇列，由背景執行緒池處理
+同一個 webhook 內的多個事件依來源分組，不同用戶的事件並行處理
+"""
+
+import inspect
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from linebot.v3 import WebhookHandler
+from linebot.v3.webhooks import MessageEvent
+
+WEBHOOK_ASYNC = os.environ.get('WEBHOOK_ASYNC', '0') == '1'
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 200))
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.environ.get('WEBHOOK_SHUTDOWN_TIMEOUT', 20))
+# 同一個 webhook 內最多同時處理幾位用戶的事件（1 = 依序處理）
+WEBHOOK_EVENT_CONCURRENCY = int(os.environ.get('WEBHOOK_EVENT_CONCURRENCY', 4))
+
+_STOP = object()
+
+
+def partition_key(event):
+    """同一來源的事件必須依序處理：有用戶 ID 時以用戶分組，否則以群組/聊天室分組"""
+    source = getattr(event, 'source', None)
+    if source is None:
+        return None
+    return (getattr(source, 'user_id', None)
+            or getattr(source, 'group_id', None)
+            or getattr(source, 'room_id', None))
+
+
+class QueuedWebhookHandler(WebhookHandler):
+    """
+    支援背景處理的 WebhookHandler
+    - handle()：在目前執行緒處理整批事件，處理完才返回（錯誤會拋出）
+    - enqueue()：驗證簽章後將整批事件放入有上限的佇列並立即返回
+      佇列已滿時改在目前執行緒處理，避免遺失事件
+    - 同一批事件依來源（用戶）分組：同一用戶的事件依序處理以保留順序，
+      不同用戶的事件最多 event_concurrency 組並行
+    - before_batch()：註冊批次前置處理，在分派事件前對整批事件執行一次
+      （例如合併寫入），回傳值在處理事件時可由 current_batch() 取得
+    """
+
+    def __init__(self, channel_secret, workers: int = 4, queue_size: int = 200,
+                 event_concurrency: int = 4):
+        super().__init__(channel_secret)
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.event_concurrency = max(1, event_concurrency)
+
+        self._queue = None
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+        self._before_batch = None
+        self._batch_local = threading.local()
+        self._executor = None
+        self._executor_pid = None
+
+        # 統計資料
+        self._stats_lock = threading.Lock()
+        # 事件數
+        self._enqueued = 0
+        self._processed = 0
+        self._failed = 0
+        self._inline_events = 0
+        # 批次數（每個 webhook 請求一批）
+        self._enqueued_batches = 0
+        self._processed_batches = 0
+        self._inline = 0
+        self._busy = 0
+        self._max_depth = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._process_total = 0.0
+        self._process_max = 0.0
+
+    def dispatch(self, event, destination=None):
+        """依事件類型找出對應的處理函式並執行（與 WebhookHandler.handle 相同的規則）"""
+        func = None
+        if isinstance(event, MessageEvent):
+            func = self._handlers.get(f"{event.__class__.__name__}_{event.message.__class__.__name__}")
+        if func is None:
+            func = self._handlers.get(event.__class__.__name__)
+        if func is None:
+            func = self._default
+        if func is None:
+            return
+
+        # 處理函式可接受 (event, destination)、(event) 或不接受參數
+        spec = inspect.getfullargspec(func)
+        if spec.varargs is not None or len(spec.args) == 2:
+            func(event, destination)
+        elif len(spec.args) == 1:
+            func(event)
+        else:
+            func()
+
+    def before_batch(self, func):
+        """註冊批次前置處理 func(events)，回傳值供 current_batch() 取得"""
+        self._before_batch = func
+        return func
+
+    def current_batch(self):
+        """目前處理中批次的前置處理結果（沒有時為 None）"""
+        return getattr(self._batch_local, 'context', None)
+
+    def handle(self, body: str, signature: str):
+        """驗證簽章並在目前執行緒處理整批事件；任一事件失敗時在全部處理完後拋出第一個錯誤"""
+        payload = self.parser.parse(body, signature, as_payload=True)
+        errors = self._run_batch(payload.events, payload.destination, None)
+        if errors:
+            raise errors[0]
+
+    def map_concurrent(self, func, items) -> list:
+        """
+        以事件執行緒池並行執行 func(item)，依輸入順序回傳結果
+        只能在事件分派之前呼叫（例如 before_batch 中），避免執行緒池互相等待
+        """
+        items = list(items)
+        if len(items) < 2 or self.event_concurrency < 2:
+            return [func(item) for item in items]
+        executor = self._get_executor()
+        futures = [executor.submit(func, item) for item in items[1:]]
+        first = func(items[0])
+        return [first] + [future.result() for future in futures]
+
+    def enqueue(self, body: str, signature: str) -> int:
+        """
+        驗證簽章並將事件放入佇列（簽章錯誤時拋出 InvalidSignatureError）
+        回傳: 放入佇列的事件數
+        """
+        payload = self.parser.parse(body, signature, as_payload=True)
+        if not payload.events:
+            return 0
+        self._ensure_started()
+
+        try:
+            self._queue.put_nowait((payload.events, payload.destination, time.monotonic()))
+        except queue.Full:
+            print("Webhook 佇列已滿，改為同步處理")
+            with self._stats_lock:
+                self._inline += 1
+                self._inline_events += len(payload.events)
+            self._process(payload.events, payload.destination, time.monotonic())
+            return 0
+
+        with self._stats_lock:
+            self._enqueued += len(payload.events)
+            self._enqueued_batches += 1
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+        return len(payload.events)
+
+    def _ensure_started(self):
+        """第一次使用時（或 fork 之後）啟動背景執行緒"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"webhook-worker-{i}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def _worker_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self._process(*item)
+            finally:
+                self._queue.task_done()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """事件執行緒池（第一次使用時或 fork 之後建立）"""
+        if self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.event_concurrency - 1,
+                        thread_name_prefix='webhook-event'
+                    )
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _process(self, events, destination, enqueued_at: float):
+        with self._stats_lock:
+            self._busy += 1
+        try:
+            self._run_batch(events, destination, enqueued_at)
+        finally:
+            with self._stats_lock:
+                self._busy -= 1
+                self._processed_batches += 1
+
+    def _run_batch(self, events, destination, enqueued_at) -> list:
+        """
+        處理一批事件：先執行批次前置處理，再依來源分組並行分派
+        enqueued_at 為 None 表示同步處理（不計入佇列統計）
+        回傳: 失敗事件的例外
+        """
+        if not events:
+            return []
+
+        context = None
+        if self._before_batch is not None:
+            try:
+                context = self._before_batch(events)
+            except Exception as e:
+                print(f"Webhook 批次前置處理失敗: {e}")
+
+        groups = {}
+        for event in events:
+            groups.setdefault(partition_key(event), []).append(event)
+        partitions = list(groups.values())
+
+        if len(partitions) == 1 or self.event_concurrency < 2:
+            return self._run_partition(events, destination, enqueued_at, context)
+
+        # 目前執行緒處理第一組，其餘交給事件執行緒池
+        executor = self._get_executor()
+        futures = [
+            executor.submit(self._run_partition, partition, destination, enqueued_at, context)
+            for partition in partitions[1:]
+        ]
+        errors = self._run_partition(partitions[0], destination, enqueued_at, context)
+        for future in futures:
+            errors.extend(future.result())
+        return errors
+
+    def _run_partition(self, events, destination, enqueued_at, context) -> list:
+        self._batch_local.context = context
+        try:
+            errors = []
+            for event in events:
+                error = self._process_event(event, destination, enqueued_at)
+                if error is not None:
+                    errors.append(error)
+            return errors
+        finally:
+            self._batch_local.context = None
+
+    def _process_event(self, event, destination, enqueued_at):
+        """分派單一事件，回傳例外（成功時為 None）"""
+        started = time.monotonic()
+        failed = None
+        try:
+            self.dispatch(event, destination)
+        except Exception as e:
+            failed = e
+            print(f"處理 Webhook 事件失敗: {e}")
+        finally:
+            if enqueued_at is not None:
+                self._record(started, enqueued_at, failed)
+        return failed
+
+    def _record(self, started: float, enqueued_at: float, failed):
+        """記錄佇列事件的等待與處理時間"""
+        finished = time.monotonic()
+        waited = started - enqueued_at
+        elapsed = finished - started
+        with self._stats_lock:
+            self._processed += 1
+            if failed is not None:
+                self._failed += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._process_total += elapsed
+            self._process_max = max(self._process_max, elapsed)
+
+    def stop(self, timeout: float = 20):
+        """停止背景執行緒，等待佇列中的事件處理完畢（最多 timeout 秒）"""
+        self._stop_queue(timeout)
+
+        # 佇列處理完才關閉事件執行緒池（背景執行緒處理時仍會使用）
+        with self._lock:
+            executor = self._executor if self._executor_pid == os.getpid() else None
+            self._executor = None
+            self._executor_pid = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _stop_queue(self, timeout: float):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            threads, self._threads = self._threads, []
+            self._pid = None
+
+        for _ in threads:
+            self._queue.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+        remaining = self._queue.qsize()
+        if remaining:
+            print(f"Webhook 佇列仍有 {remaining} 個事件未處理")
+
+    def stats(self) -> dict:
+        """
+        佇列深度（批次數）、事件等待時間與處理時間統計
+        enqueued / processed / failed / inline_events 為事件數，
+        enqueued_batches / processed_batches / inline 為批次數（processed 含佇列已滿時同步處理的部分）
+        """
+        depth = self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+        with self._stats_lock:
+            processed = self._processed
+            return {
+                'depth': depth,
+                'max_depth': self._max_depth,
+                'capacity': self.queue_size,
+                'workers': len(self._threads),
+                'busy': self._busy,
+                'enqueued': self._enqueued,
+                'processed': processed,
+                'failed': self._failed,
+                'inline_events': self._inline_events,
+                'enqueued_batches': self._enqueued_batches,
+                'processed_batches': self._processed_batches,
+                'inline': self._inline,
+                'wait_time_avg': round(self._wait_total / processed, 6) if processed else 0.0,
+                'wait_time_max': round(self._wait_max, 6),
+                'process_time_avg': round(self._process_total / processed, 6) if processed else 0.0,
+                'process_time_max': round(self._process_max, 6),
+            }